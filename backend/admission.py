@@ -0,0 +1,209 @@
+"""
+Per-worker admission control and load shedding.
+
+When an exam starts or a deadline passes, every student hits the server at
+once. Queueing everyone until gunicorn's timeout makes the whole burst slow.
+Each worker therefore decides up front whether it can serve a request
+quickly, and otherwise answers at once with `503` and a `Retry-After` the
+client backs off for.
+
+Views are tagged with a priority class by `@priority(...)`. Untagged views
+are 'normal'. For each class the controller checks, in order:
+
+1. Queue time. When the proxy sets `X-Request-Start`, a request that already
+   waited in the listen backlog longer than the class allows is dropped: its
+   client is about to time out anyway.
+2. Rate. Classes with a token bucket (teacher dashboards and exports by
+   default) are limited to a steady rate per worker.
+3. Concurrency. A class may only use its share of ADMISSION_MAX_CONCURRENT
+   slots, so lower classes always leave room for submissions. Submissions
+   may wait briefly for a slot instead of being rejected.
+
+Limits are per class and read from ADMISSION_<CLASS>_SHARE, _MAX_QUEUE,
+_MAX_WAIT, _RATE, _BURST and _RETRY_AFTER.
+"""
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app, g, jsonify, request
+
+EXEMPT = 'exempt'
+PRIORITIES = ('critical', 'high', 'normal', 'low')
+
+# share: fraction of the concurrency slots the class may use
+# max_queue: seconds a request may have waited before reaching the worker
+# max_wait: seconds a request may wait here for a slot
+# rate, burst: token bucket (requests per second per worker), None for no limit
+# retry_after: seconds sent in Retry-After when the class is rejected
+PriorityLimits = namedtuple('PriorityLimits', ['share', 'max_queue', 'max_wait', 'rate', 'burst', 'retry_after'])
+
+DEFAULT_LIMITS = {
+    'critical': PriorityLimits(share=1.0, max_queue=20.0, max_wait=2.0, rate=None, burst=None, retry_after=2),
+    'high': PriorityLimits(share=0.9, max_queue=10.0, max_wait=0.5, rate=None, burst=None, retry_after=3),
+    'normal': PriorityLimits(share=0.75, max_queue=5.0, max_wait=0.0, rate=None, burst=None, retry_after=5),
+    'low': PriorityLimits(share=0.5, max_queue=3.0, max_wait=0.0, rate=5.0, burst=10, retry_after=10),
+}
+
+
+def priority(name):
+    """Tag a view with its admission priority class ('critical', 'high', 'normal', 'low' or 'exempt')"""
+    if name not in PRIORITIES and name != EXEMPT:
+        raise ValueError(f'Unknown priority {name!r}')
+
+    def decorate(view):
+        view.admission_priority = name
+        return view
+    return decorate
+
+
+def priority_limits(environ):
+    """DEFAULT_LIMITS with ADMISSION_<CLASS>_<SETTING> overrides"""
+    limits = {}
+    for name, defaults in DEFAULT_LIMITS.items():
+        values = defaults._asdict()
+        for field, value in values.items():
+            setting = environ.get(f'ADMISSION_{name.upper()}_{field.upper()}')
+            if setting is not None:
+                values[field] = float(setting) if setting.strip() else None
+        limits[name] = PriorityLimits(**values)
+    return limits
+
+
+def request_queue_time(header, now=None):
+    """Seconds since the proxy received the request, from X-Request-Start ("t=<epoch>" in s, ms or us)"""
+    if not header:
+        return None
+    value = header.strip()
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    # nginx's $msec is in seconds; other routers send milliseconds or microseconds
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(0.0, (now or time.time()) - started)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token; returns 0, or the seconds until one is available"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+
+class AdmissionController:
+    """Admits, delays or rejects each request before its view runs"""
+
+    def __init__(self, max_concurrent=0, limits=None, registry=None):
+        self.max_concurrent = max_concurrent  # 0: no concurrency limit
+        self.limits = limits or DEFAULT_LIMITS
+        self.registry = registry
+        self.buckets = {name: TokenBucket(limits.rate, limits.burst)
+                        for name, limits in self.limits.items() if limits.rate}
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _slots(self, limits):
+        return max(1, int(self.max_concurrent * limits.share))
+
+    def _count(self, outcome, name):
+        if self.registry is not None:
+            self.registry.inc('nano_admission_requests_total', priority=name, outcome=outcome)
+
+    def _gauge(self, metric, value, name):
+        if self.registry is not None:
+            self.registry.add_gauge(metric, value, priority=name)
+
+    def _acquire(self, name, limits):
+        with self._condition:
+            if not self.max_concurrent or self.in_flight < self._slots(limits):
+                self.in_flight += 1
+                return True
+            if not limits.max_wait:
+                return False
+            deadline = time.monotonic() + limits.max_wait
+            self._gauge('nano_admission_waiting', 1, name)
+            try:
+                while self.in_flight >= self._slots(limits):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return True
+            finally:
+                self._gauge('nano_admission_waiting', -1, name)
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _reject(self, name, reason, retry_after):
+        self._count(reason, name)
+        retry_after = max(1, math.ceil(retry_after))
+        response = jsonify({'message': 'Server is busy, please retry shortly', 'retry_after': retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+    def _before_request(self):
+        if request.method == 'OPTIONS':
+            return None  # CORS preflight
+        view = current_app.view_functions.get(request.endpoint)
+        name = getattr(view, 'admission_priority', 'normal')
+        if name == EXEMPT:
+            return None
+        limits = self.limits[name]
+
+        queue_time = request_queue_time(request.headers.get('X-Request-Start'))
+        if queue_time is not None:
+            if self.registry is not None:
+                self.registry.observe('nano_request_queue_seconds', queue_time, priority=name)
+            if limits.max_queue is not None and queue_time > limits.max_queue:
+                return self._reject(name, 'queue_timeout', limits.retry_after)
+
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            wait = bucket.take()
+            if wait:
+                return self._reject(name, 'rate_limited', max(wait, limits.retry_after))
+
+        if not self._acquire(name, limits):
+            return self._reject(name, 'saturated', limits.retry_after)
+        g.admission_priority = name
+        self._count('admitted', name)
+        self._gauge('nano_admission_in_flight', 1, name)
+        return None
+
+    def _teardown_request(self, exc):
+        name = g.pop('admission_priority', None)
+        if name is not None:
+            self._gauge('nano_admission_in_flight', -1, name)
+            self._release()
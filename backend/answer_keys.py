@@ -0,0 +1,141 @@
+"""
+Per-worker cache of compiled answer keys used to score submissions.
+
+A compiled key holds the test's question ids and correct options as compact
+arrays, so scoring a submission never loads Question rows through the ORM.
+Keys are cached by (test id, version); bumping `Test.version` whenever a test
+changes makes every worker recompile on its next lookup. Versions come from a
+counter shared by all tests and never repeat, so a cached key can never be
+mistaken for the key of a new test that reused a deleted test's id.
+"""
+
+from array import array
+from collections import OrderedDict, namedtuple
+from operator import eq
+import threading
+
+from models import db, Test, Question, OPTION_CODES, OTHER_ANSWER
+
+MARKS_PER_CORRECT = 4
+MARKS_PER_WRONG = 1
+
+Score = namedtuple('Score', [
+    'correct_count', 'wrong_count', 'unanswered_count',
+    'marks_obtained', 'max_marks', 'percentage', 'is_passed', 'responses'
+])
+
+
+class AnswerKey:
+    """Question ids and correct options of one test version, in question order"""
+
+    __slots__ = ('test_id', 'version', 'passing_marks', 'question_ids', 'question_keys', 'correct')
+
+    def __init__(self, test_id, version, passing_marks, rows):
+        self.test_id = test_id
+        self.version = version
+        self.passing_marks = passing_marks
+        self.question_ids = array('q', (question_id for question_id, _ in rows))
+        self.question_keys = tuple(str(question_id) for question_id, _ in rows)
+        self.correct = bytes(OPTION_CODES.get(correct_answer, OTHER_ANSWER + 1) for _, correct_answer in rows)
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    @property
+    def max_marks(self):
+        return len(self) * MARKS_PER_CORRECT
+
+
+def compile_answer_key(test_id, version, passing_marks):
+    rows = (db.session.query(Question.id, Question.correct_answer)
+            .filter(Question.test_id == test_id)
+            .order_by(Question.order, Question.id)
+            .all())
+    return AnswerKey(test_id, version, passing_marks, rows)
+
+
+def encode_responses(key, answers, question_status):
+    """Align a submission to the key's question order as a bytes vector of option codes"""
+    answers = answers or {}
+    question_status = question_status or {}
+    responses = bytearray(len(key))
+    for i, q_id in enumerate(key.question_keys):
+        # Only answers with status 'answered' are scored; skipped or marked_only count as unanswered
+        if question_status.get(q_id) == 'answered':
+            answer = answers.get(q_id)
+            if answer is not None:
+                responses[i] = OPTION_CODES.get(answer, OTHER_ANSWER)
+    return bytes(responses)
+
+
+def score_responses(key, responses):
+    """Score an encoded response vector against the key: +4 correct, -1 wrong, never below 0"""
+    correct_count = sum(map(eq, responses, key.correct))
+    answered_count = len(responses) - responses.count(0)
+    wrong_count = answered_count - correct_count
+    unanswered_count = len(responses) - answered_count
+
+    marks = max(0, correct_count * MARKS_PER_CORRECT - wrong_count * MARKS_PER_WRONG)
+    max_marks = key.max_marks
+    percentage = (marks / max_marks * 100) if max_marks > 0 else 0
+    return Score(
+        correct_count=correct_count,
+        wrong_count=wrong_count,
+        unanswered_count=unanswered_count,
+        marks_obtained=marks,
+        max_marks=max_marks,
+        percentage=round(percentage, 2),
+        is_passed=percentage >= key.passing_marks,
+        responses=responses
+    )
+
+
+def score_submission(key, answers, question_status):
+    return score_responses(key, encode_responses(key, answers, question_status))
+
+
+class AnswerKeyCache:
+    """Thread-safe LRU of compiled answer keys keyed by (test id, version)"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, test_id):
+        """Return the current answer key for a test, or None if the test does not exist"""
+        try:
+            test_id = int(test_id)
+        except (TypeError, ValueError):
+            return None
+        row = (db.session.query(Test.version, Test.passing_marks)
+               .filter(Test.id == test_id, Test.deleted_at.is_(None))
+               .first())
+        if row is None:
+            return None
+        cache_key = (test_id, row.version)
+
+        with self._lock:
+            key = self._keys.get(cache_key)
+            if key is not None:
+                self._keys.move_to_end(cache_key)
+                return key
+
+        key = compile_answer_key(test_id, row.version, row.passing_marks or 0)
+        with self._lock:
+            # Drop keys for older versions of this test along with the LRU tail
+            for stale in [k for k in self._keys if k[0] == test_id]:
+                del self._keys[stale]
+            self._keys[cache_key] = key
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return key
+
+    def invalidate(self, test_id):
+        with self._lock:
+            for stale in [k for k in self._keys if k[0] == test_id]:
+                del self._keys[stale]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
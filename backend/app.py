@@ -1,13 +1,47 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
 from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
+import io
+import uuid
+import click
+import csv
 import json
 
-from models import db, Teacher, Student, Test, Question, TestResult
+from sqlalchemy.exc import IntegrityError
+
+from models import (db, Teacher, Student, Test, Question, TestResult, Image, TestStats,
+                    StudentSummary, Job, AttemptSession, OPTION_CODES, next_test_version, normalize_email,
+                    pack_answers, query_result_listing, result_row_to_dict, serialize_result_rows)
+from image_store import (ImageStore, InvalidImageError, ALLOWED_MIME_TYPES, decode_image, detect_image_type,
+                         is_image_hash, strip_metadata)
+from image_variants import tests_using_images, transcode_images
+from migrations import MIGRATIONS, migrate, pending_migrations
+from answer_keys import AnswerKeyCache
+from submissions import SubmissionSpool, build_result_values, record_scored, flush_spool
+from item_stats import ensure_stats_rows, get_test_analytics, rebuild_test_stats
+from rankings import Histogram, get_standing, rebuild_score_buckets, stale_score_buckets
+from student_summaries import get_student_summary, rebuild_student_summary, record_results
+from deletions import count_results, delete_test_now, deleted_test_ids, purge_test, soft_delete_test, sync_delete_limit
+from regrade import regrade_test
+from local_store import BackgroundFlusher
+from static_assets import StaticManifest, encoded_response, REVALIDATE_CACHE_CONTROL
+from snapshots import SnapshotStore
+from caching import cache, ACTIVE_TESTS_KEY, teacher_tests_key, invalidate_test_listings
+from jobs import add_job_errors, create_job, start_job
+from question_bank import (QuestionImportError, prepare_question, validate_questions, insert_questions,
+                           read_ndjson_upload, read_multipart_upload)
+from roster import RosterFormatError, iter_roster_rows, validate_roster, import_students
+from pagination import (InvalidCursorError, after_cursor, encode_cursor, parse_page_size,
+                        after_leaderboard_cursor, encode_leaderboard_cursor)
+from metrics import Metrics
+from attempts import AttemptStore, InvalidAttemptChange, empty_state, flush_attempts, merge_changes
+from admission import AdmissionController, priority, priority_limits
+from db_routing import (ReplicaRouter, enforce_foreign_keys, pool_options, replica_binds, replica_reads,
+                        use_primary)
 
 load_dotenv()
 
@@ -21,23 +55,158 @@ os.makedirs(INSTANCE_DIR, exist_ok=True)  # Ensure instance folder exists
 DATABASE_PATH = os.path.join(INSTANCE_DIR, 'nano_test_platform.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', f'sqlite:///{DATABASE_PATH}')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pools: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT for the primary,
+# DB_REPLICA_* for each replica in DATABASE_REPLICA_URLS (falling back to the DB_* values)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = pool_options(os.environ, 'DB_')
+app.config['SQLALCHEMY_BINDS'] = replica_binds(
+    os.getenv('DATABASE_REPLICA_URLS'), pool_options(os.environ, 'DB_REPLICA_', fallback_prefix='DB_')
+)
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your_jwt_secret_key')
+app.config['IMAGE_STORE_DIR'] = os.getenv('IMAGE_STORE_DIR', os.path.join(INSTANCE_DIR, 'images'))
+# Frontend files: static/ in the Docker image, ../frontend/ in local development
+STATIC_DIR = os.path.join(BACKEND_DIR, 'static')
+FRONTEND_DIR = os.path.join(BACKEND_DIR, '..', 'frontend')
+app.config['STATIC_ROOT'] = os.getenv('STATIC_ROOT', STATIC_DIR if os.path.exists(STATIC_DIR) else FRONTEND_DIR)
+app.config['STATIC_RELOAD'] = os.getenv('STATIC_RELOAD', os.getenv('FLASK_DEBUG', 'False')).lower() == 'true'
+# Listing cache: FileSystemCache is shared by all workers on a host, SimpleCache is per process
+app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'FileSystemCache')
+app.config['CACHE_DIR'] = os.getenv('CACHE_DIR', os.path.join(INSTANCE_DIR, 'cache'))
+app.config['CACHE_DEFAULT_TIMEOUT'] = int(os.getenv('CACHE_DEFAULT_TIMEOUT', 300))
+# Serialized GET /api/tests/<id> responses, shared by all workers on a host
+app.config['SNAPSHOT_DIR'] = os.getenv('SNAPSHOT_DIR', os.path.join(INSTANCE_DIR, 'snapshots'))
+# 'direct' commits each submission in the request; 'spool' acknowledges from a local spool and writes in batches
+app.config['SUBMISSION_INGEST_MODE'] = os.getenv('SUBMISSION_INGEST_MODE', 'direct')
+app.config['SUBMISSION_SPOOL_PATH'] = os.getenv('SUBMISSION_SPOOL_PATH', os.path.join(INSTANCE_DIR, 'submission_spool.db'))
+app.config['SUBMISSION_FLUSH_INTERVAL'] = float(os.getenv('SUBMISSION_FLUSH_INTERVAL', 0.5))
+app.config['SUBMISSION_FLUSH_BATCH'] = int(os.getenv('SUBMISSION_FLUSH_BATCH', 200))
+# Attempt autosaves are merged in a host-local store and written to the database in batches
+app.config['ATTEMPT_STORE_PATH'] = os.getenv('ATTEMPT_STORE_PATH', os.path.join(INSTANCE_DIR, 'attempt_store.db'))
+app.config['ATTEMPT_FLUSH_INTERVAL'] = float(os.getenv('ATTEMPT_FLUSH_INTERVAL', 2))
+app.config['ATTEMPT_FLUSH_BATCH'] = int(os.getenv('ATTEMPT_FLUSH_BATCH', 500))
+# Attempts are resumable this many seconds past their time limit (to submit); after that a new attempt starts
+app.config['ATTEMPT_EXPIRY_GRACE'] = int(os.getenv('ATTEMPT_EXPIRY_GRACE', 300))
+# Per-worker metric snapshots and profiles; must be a directory shared by all workers of the server
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', os.path.join(INSTANCE_DIR, 'metrics'))
+# Schema setup: 'import' whenever the app is imported (flask run, python app.py); 'master' once in the
+# preloading gunicorn master (set by gunicorn_config.py); 'command' only via `flask db-upgrade`
+app.config['SCHEMA_SETUP'] = os.getenv('SCHEMA_SETUP', 'import')
 
 # Initialize extensions
 db.init_app(app)
+cache.init_app(app)
+db_router = ReplicaRouter(
+    check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5)),
+    retry_after=float(os.getenv('DB_REPLICA_RETRY_AFTER', 30)),
+    sticky_seconds=int(os.getenv('DB_REPLICA_STICKY_SECONDS', 30))
+)
+db_router.init_app(app, db)
 jwt = JWTManager(app)
+metrics = Metrics(app.config['METRICS_DIR'])
+metrics.init_app(app)
+# Registered after metrics so rejected requests are still counted
+admission = AdmissionController(
+    max_concurrent=int(os.getenv('ADMISSION_MAX_CONCURRENT', 0)),
+    limits=priority_limits(os.environ),
+    registry=metrics.registry
+)
+admission.init_app(app)
 CORS(app, 
      origins="*",
      allow_headers="*",
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
+     expose_headers=["Retry-After"],
      supports_credentials=True)
 
+image_store = ImageStore(app.config['IMAGE_STORE_DIR'])
+static_manifest = StaticManifest(app.config['STATIC_ROOT'], reload=app.config['STATIC_RELOAD'])
+test_snapshots = SnapshotStore(app.config['SNAPSHOT_DIR'], maxsize=int(os.getenv('SNAPSHOT_CACHE_SIZE', 64)))
+answer_keys = AnswerKeyCache(maxsize=int(os.getenv('ANSWER_KEY_CACHE_SIZE', 256)))
+submission_spool = SubmissionSpool(app.config['SUBMISSION_SPOOL_PATH'])
+submission_flusher = BackgroundFlusher(
+    app,
+    lambda: flush_spool(submission_spool, answer_keys, app.config['SUBMISSION_FLUSH_BATCH']),
+    interval=app.config['SUBMISSION_FLUSH_INTERVAL'],
+    name='submission-flusher'
+)
+attempt_store = AttemptStore(app.config['ATTEMPT_STORE_PATH'])
+attempt_flusher = BackgroundFlusher(
+    app,
+    lambda: flush_attempts(attempt_store, app.config['ATTEMPT_FLUSH_BATCH']),
+    interval=app.config['ATTEMPT_FLUSH_INTERVAL'],
+    name='attempt-flusher'
+)
+
 with app.app_context():
-    db.create_all()
+    for engine in db.engines.values():
+        enforce_foreign_keys(engine)
+        metrics.instrument_engine(engine)
+
+
+def prepare_database():
+    """Create missing tables, apply migrations and rebuild stale histograms; returns the migrations applied"""
+    with app.app_context():
+        db.create_all(bind_key=None)  # Replicas receive the schema from the primary
+        applied = migrate(db)
+        # Histograms that missed submissions (or predate them) are rebuilt before serving
+        for stale_test_id in stale_score_buckets():
+            try:
+                rebuild_score_buckets(stale_test_id)
+                db.session.commit()
+                print(f"[INFO] Rebuilt score histogram for test {stale_test_id}")
+            except IntegrityError:
+                db.session.rollback()  # Another worker rebuilt it at the same time
+        db.session.remove()
+        # No connection opened here may be inherited by forked workers
+        for engine in db.engines.values():
+            engine.dispose()
+    return applied
+
+
+def reset_after_fork():
+    """Run in each worker forked from a preloaded app: forget the parent's pooled connections"""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the sockets to the parent instead of closing them under it
+            engine.dispose(close=False)
+
+
+if app.config['SCHEMA_SETUP'] == 'import':
+    prepare_database()
+
+
+def store_image(value, raw=False):
+    """
+    Stage a base64 image (or raw bytes when raw=True) for the image store and return its hash.
+    
+    The blob only appears in the store when publish_staged_images() runs after the commit;
+    images of rejected requests are discarded when the app context ends.
+    """
+    if raw:
+        data, mime_type = value, detect_image_type(value)
+    else:
+        data, mime_type = decode_image(value)
+    data = strip_metadata(data)
+    image_hash, tmp_path = image_store.stage(data)
+    if tmp_path is not None:
+        g.setdefault('staged_images', []).append((image_hash, tmp_path))
+    if db.session.get(Image, image_hash) is None:
+        db.session.add(Image(hash=image_hash, mime_type=mime_type, size=len(data)))
+    return image_hash
+
+
+def publish_staged_images():
+    """Move the images staged by store_image into the store; call once their rows are committed"""
+    image_store.publish(g.pop('staged_images', []))
+
+
+@app.teardown_appcontext
+def discard_staged_images(exc):
+    image_store.discard(g.pop('staged_images', []))
 
 # ==================== Authentication Routes ====================
 
 @app.route('/api/auth/teacher-login', methods=['POST'])
+@priority('high')
 def teacher_login():
     data = request.get_json()
     teacher_id = data.get('teacher_id')
@@ -69,9 +238,10 @@ def teacher_login():
 
 
 @app.route('/api/auth/student-login', methods=['POST'])
+@priority('high')
 def student_login():
     data = request.get_json()
-    email = data.get('email')
+    email = normalize_email(data.get('email'))
     password = data.get('password')
     
     if not email or not password:
@@ -108,9 +278,60 @@ def student_login():
     }), 200
 
 
+# ==================== Roster Routes (Teacher) ====================
+
+@app.route('/api/students/import', methods=['POST'])
+@priority('low')
+@jwt_required()
+def import_roster():
+    """Bulk-create students from a CSV, NDJSON or JSON upload"""
+    claims = get_jwt()
+    if claims.get('type') != 'teacher':
+        return jsonify({'message': 'Only teachers can import students'}), 403
+    
+    try:
+        rows, errors = validate_roster(iter_roster_rows(request.stream, request.content_type))
+    except RosterFormatError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if not rows:
+        return jsonify({'message': 'No valid students to import', 'errors': errors}), 422
+    
+    job = create_job('student_import', teacher_id=claims['id'], total=len(rows), errors=errors)
+    start_job(app, job.id, import_students, rows)
+    
+    return jsonify({
+        'message': 'Import started',
+        'job': job.to_dict(),
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@priority('low')
+@jwt_required()
+def get_job(job_id):
+    claims = get_jwt()
+    job = db.session.get(Job, job_id)
+    
+    if not job:
+        return jsonify({'message': 'Job not found'}), 404
+    
+    if claims.get('type') != 'teacher' or job.teacher_id != claims['id']:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    return jsonify(job.to_dict()), 200
+
+
 # ==================== Test Routes (Teacher) ====================
 
+def get_live_test(test_id):
+    """The test, or None if it does not exist or is being purged"""
+    return Test.query.filter(Test.id == test_id, Test.deleted_at.is_(None)).first()
+
+
 @app.route('/api/tests', methods=['POST'])
+@priority('low')
 @jwt_required()
 def create_test():
     claims = get_jwt()
@@ -118,103 +339,148 @@ def create_test():
         return jsonify({'message': 'Only teachers can create tests'}), 403
     
     data = request.get_json()
-    print(f"[DEBUG] Received test data: {data}")
+    questions_data = data.get('questions') or []
+    print(f"[DEBUG] Received test '{data.get('name')}' with {len(questions_data)} questions")
     
     # Validate required fields
     if not data.get('name'):
         return jsonify({'message': 'Test name is required'}), 422
-    if not data.get('questions') or len(data.get('questions', [])) == 0:
+    if len(questions_data) == 0:
         return jsonify({'message': 'At least one question is required'}), 422
     
     try:
-        # Create test
-        test = Test(
-            teacher_id=claims['id'],
-            name=data.get('name'),
-            description=data.get('description', ''),
-            duration=int(data.get('duration', 30)),
-            passing_marks=int(data.get('passing_marks', 40))
-        )
-        db.session.add(test)
-        db.session.flush()
-        
-        # Add questions with base64-encoded images
-        questions_data = data.get('questions', [])
-        for idx, q_data in enumerate(questions_data):
-            # Validate question fields
-            print(f"[DEBUG] Processing question {idx + 1}: {q_data.keys()}")
-            
-            if not q_data.get('text'):
-                return jsonify({'message': f'Question {idx + 1}: Question text is required'}), 422
-            if not q_data.get('optionA') or not q_data.get('optionB') or not q_data.get('optionC') or not q_data.get('optionD'):
-                missing = []
-                if not q_data.get('optionA'): missing.append('A')
-                if not q_data.get('optionB'): missing.append('B')
-                if not q_data.get('optionC'): missing.append('C')
-                if not q_data.get('optionD'): missing.append('D')
-                return jsonify({'message': f'Question {idx + 1}: Missing options: {", ".join(missing)}'}), 422
-            if not q_data.get('correct'):
-                return jsonify({'message': f'Question {idx + 1}: Correct answer is required'}), 422
-            
-            # Get base64-encoded image if provided
-            image_data = q_data.get('image', None)
-            if image_data:
-                print(f"[DEBUG] Question {idx + 1} has image (size: {len(image_data)} chars)")
-            
-            question = Question(
-                test_id=test.id,
-                question_text=q_data.get('text'),
-                option_a=q_data.get('optionA'),
-                option_b=q_data.get('optionB'),
-                option_c=q_data.get('optionC'),
-                option_d=q_data.get('optionD'),
-                correct_answer=q_data.get('correct'),
-                order=idx + 1,
-                image=image_data  # Store base64-encoded image
-            )
-            db.session.add(question)
-        
-        db.session.commit()
-        print(f"[DEBUG] Test created successfully: {test.id}")
-        
-        return jsonify({
-            'message': 'Test created successfully',
-            'test': test.to_dict()
-        }), 201
+        # Decode base64-encoded images into the image store, then validate every question at once
+        questions = [prepare_question(q_data, store_image) for q_data in questions_data]
+        return save_test(claims['id'], data, questions)
     except Exception as e:
         db.session.rollback()
         print(f"[ERROR] Exception creating test: {str(e)}")
         return jsonify({'message': f'Error creating test: {str(e)}'}), 500
 
 
+@app.route('/api/tests/import', methods=['POST'])
+@priority('low')
+@jwt_required()
+def import_test():
+    """Create a test from a streamed NDJSON or multipart CSV question bank"""
+    claims = get_jwt()
+    if claims.get('type') != 'teacher':
+        return jsonify({'message': 'Only teachers can create tests'}), 403
+    
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+            test_data, questions = read_ndjson_upload(request.stream, store_image)
+        elif request.mimetype == 'multipart/form-data':
+            test_data, questions = read_multipart_upload(request.form, request.files, store_image)
+        else:
+            return jsonify({'message': 'Upload must be application/x-ndjson or multipart/form-data'}), 400
+    except QuestionImportError as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 400
+    
+    print(f"[DEBUG] Importing test '{test_data.get('name')}' with {len(questions)} questions")
+    if not test_data.get('name'):
+        db.session.rollback()
+        return jsonify({'message': 'Test name is required'}), 422
+    if len(questions) == 0:
+        db.session.rollback()
+        return jsonify({'message': 'At least one question is required'}), 422
+    
+    try:
+        return save_test(claims['id'], test_data, questions)
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ERROR] Exception importing test: {str(e)}")
+        return jsonify({'message': f'Error importing test: {str(e)}'}), 500
+
+
+def save_test(teacher_id, data, questions):
+    """Validate prepared questions and create the test with them in one transaction"""
+    errors = validate_questions(questions)
+    if errors:
+        db.session.rollback()
+        return jsonify({'message': errors[0]['message'], 'errors': errors}), 422
+    
+    try:
+        duration = int(data.get('duration', 30))
+        passing_marks = int(data.get('passing_marks', 40))
+    except (TypeError, ValueError):
+        db.session.rollback()
+        return jsonify({'message': 'Duration and passing marks must be numbers'}), 422
+    
+    test = Test(
+        teacher_id=teacher_id,
+        name=data.get('name'),
+        description=data.get('description', ''),
+        duration=duration,
+        passing_marks=passing_marks,
+        question_count=len(questions),
+        version=next_test_version()
+    )
+    db.session.add(test)
+    db.session.flush()
+    
+    question_ids = insert_questions(test.id, questions)
+    ensure_stats_rows(test.id, question_ids)
+    db.session.commit()
+    publish_staged_images()
+    invalidate_test_listings(teacher_id)
+    print(f"[DEBUG] Test created successfully: {test.id}")
+    
+    response = {
+        'message': 'Test created successfully',
+        'test': test.to_dict()
+    }
+    image_hashes = sorted({q['image_hash'] for q in questions if q['image_hash']})
+    if image_hashes:
+        # Downscaled variants are made in the background; the test is served with the originals until then
+        job = create_job('image_transcode', teacher_id=teacher_id, total=len(image_hashes))
+        start_job(app, job.id, transcode_question_images, image_hashes)
+        response['image_job'] = job.to_dict()
+    return jsonify(response), 201
+
+
 @app.route('/api/tests', methods=['GET'])
 @jwt_required()
 def get_tests():
     claims = get_jwt()
     
     if claims.get('type') == 'teacher':
-        tests = Test.query.filter_by(teacher_id=claims['id']).all()
+        cache_key = teacher_tests_key(claims['id'])
+        query = Test.query.filter_by(teacher_id=claims['id'], deleted_at=None)
     else:
-        tests = Test.query.filter_by(is_active=True).all()
+        cache_key = ACTIVE_TESTS_KEY
+        query = Test.query.filter_by(is_active=True, deleted_at=None)
     
-    return jsonify([test.to_dict() for test in tests]), 200
+    tests_data = cache.get(cache_key)
+    if tests_data is None:
+        tests_data = [test.to_dict() for test in query.all()]
+        cache.set(cache_key, tests_data)
+    
+    return jsonify(tests_data), 200
 
 
 @app.route('/api/tests/<int:test_id>', methods=['GET'])
+@priority('high')
+@replica_reads
 def get_test(test_id):
-    test = Test.query.get(test_id)
-    
-    if not test:
+    """Serve the test from its pre-serialized snapshot; only the version is read from the database"""
+    version = db.session.query(Test.version).filter(Test.id == test_id, Test.deleted_at.is_(None)).scalar()
+    if version is None:
         return jsonify({'message': 'Test not found'}), 404
     
-    return jsonify(test.to_dict(include_questions=True)), 200
+    snapshot = test_snapshots.get(
+        test_id, version, lambda: Test.query.get(test_id).to_dict(include_questions=True)
+    )
+    return encoded_response(request, snapshot, REVALIDATE_CACHE_CONTROL)
 
 
 @app.route('/api/tests/<int:test_id>', methods=['PUT'])
+@priority('low')
 @jwt_required()
 def update_test(test_id):
     claims = get_jwt()
-    test = Test.query.get(test_id)
+    test = get_live_test(test_id)
     
     if not test:
         return jsonify({'message': 'Test not found'}), 404
@@ -228,8 +494,11 @@ def update_test(test_id):
     test.duration = data.get('duration', test.duration)
     test.passing_marks = data.get('passing_marks', test.passing_marks)
     test.is_active = data.get('is_active', test.is_active)
+    test.bump_version()
     
     db.session.commit()
+    invalidate_test_listings(test.teacher_id)
+    test_snapshots.invalidate(test_id)
     
     return jsonify({
         'message': 'Test updated successfully',
@@ -237,11 +506,69 @@ def update_test(test_id):
     }), 200
 
 
+@app.route('/api/tests/<int:test_id>/answer-key', methods=['PUT'])
+@priority('low')
+@jwt_required()
+def update_answer_key(test_id):
+    """Change correct answers ({'answers': {question_id: 'A'-'D'}}) and regrade every result in the background"""
+    claims = get_jwt()
+    test = get_live_test(test_id)
+    
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+    
+    if claims.get('type') != 'teacher' or test.teacher_id != claims['id']:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    answers = (request.get_json(silent=True) or {}).get('answers')
+    if not isinstance(answers, dict) or not answers:
+        return jsonify({'message': 'answers must map question ids to A, B, C or D'}), 422
+    
+    questions = {str(q.id): q for q in Question.query.filter_by(test_id=test_id)}
+    errors = []
+    for q_id, correct in answers.items():
+        if str(q_id) not in questions:
+            errors.append({'question_id': q_id, 'message': f'Question {q_id} is not part of this test'})
+        elif str(correct or '').strip().upper() not in OPTION_CODES:
+            errors.append({'question_id': q_id, 'message': f'Question {q_id}: Correct answer must be A, B, C or D'})
+    if errors:
+        return jsonify({'message': errors[0]['message'], 'errors': errors}), 422
+    
+    changed = 0
+    for q_id, correct in answers.items():
+        question = questions[str(q_id)]
+        correct = str(correct).strip().upper()
+        if question.correct_answer != correct:
+            question.correct_answer = correct
+            changed += 1
+    if not changed:
+        return jsonify({'message': 'Answer key unchanged', 'questions_changed': 0}), 200
+    
+    test.bump_version()
+    db.session.commit()
+    answer_keys.invalidate(test_id)
+    test_snapshots.invalidate(test_id)
+    
+    result_count = count_results(test_id)
+    if not result_count:
+        return jsonify({'message': 'Answer key updated', 'questions_changed': changed}), 200
+    
+    job = create_job('regrade', teacher_id=claims['id'], total=result_count)
+    start_job(app, job.id, regrade_test, answer_keys.get(test_id))
+    return jsonify({
+        'message': 'Answer key updated, regrading started',
+        'questions_changed': changed,
+        'job': job.to_dict(),
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
+
 @app.route('/api/tests/<int:test_id>', methods=['DELETE'])
+@priority('low')
 @jwt_required()
 def delete_test(test_id):
     claims = get_jwt()
-    test = Test.query.get(test_id)
+    test = get_live_test(test_id)
     
     if not test:
         return jsonify({'message': 'Test not found'}), 404
@@ -249,16 +576,140 @@ def delete_test(test_id):
     if test.teacher_id != claims['id']:
         return jsonify({'message': 'Unauthorized'}), 403
     
-    db.session.delete(test)
+    result_count = count_results(test_id)
+    if result_count <= sync_delete_limit():
+        delete_test_now(test)
+        job = None
+    else:
+        # Hidden right away; the results are deleted in chunks by a background job
+        soft_delete_test(test)
+        db.session.commit()
+        job = create_job('test_purge', teacher_id=claims['id'], total=result_count)
+        start_job(app, job.id, purge_test, test_id)
+    answer_keys.invalidate(test_id)
+    test_snapshots.invalidate(test_id)
+    invalidate_test_listings(claims['id'])
+    
+    if job is None:
+        return jsonify({'message': 'Test deleted successfully'}), 200
+    return jsonify({
+        'message': 'Test deletion started',
+        'job': job.to_dict(),
+        'status_url': f'/api/jobs/{job.id}'
+    }), 202
+
+
+# ==================== Attempt Routes (Student) ====================
+
+@app.route('/api/attempts', methods=['POST'])
+@priority('high')
+@jwt_required()
+def start_attempt():
+    """Start an attempt at a test, or resume the student's attempt in progress if it has not expired"""
+    claims = get_jwt()
+    if claims.get('type') != 'student':
+        return jsonify({'message': 'Only students can attempt tests'}), 403
+    
+    data = request.get_json() or {}
+    key = answer_keys.get(data.get('test_id'))
+    if key is None:
+        return jsonify({'message': 'Test not found'}), 404
+    
+    attempt = (AttemptSession.query
+               .filter_by(student_id=claims['id'], test_id=key.test_id, status='in_progress')
+               .order_by(AttemptSession.started_at.desc())
+               .first())
+    if attempt is not None and expire_if_overdue(attempt):
+        # Abandoned past its time limit; resuming would only auto-submit it
+        attempt = None
+    if attempt is not None:
+        state, seq = attempt_store.current_state(attempt)
+        return jsonify({'attempt': attempt.to_dict(state, seq)}), 200
+    
+    test = db.session.get(Test, key.test_id)
+    started_at = datetime.utcnow()
+    attempt = AttemptSession(
+        id=str(uuid.uuid4()),
+        student_id=claims['id'],
+        test_id=key.test_id,
+        state=empty_state(),
+        started_at=started_at,
+        expires_at=started_at + timedelta(minutes=test.duration) if test.duration else None
+    )
+    db.session.add(attempt)
     db.session.commit()
+    return jsonify({'attempt': attempt.to_dict()}), 201
+
+
+def expire_if_overdue(attempt):
+    """Mark an attempt in progress past its time limit and ATTEMPT_EXPIRY_GRACE expired; True if it is expired"""
+    grace = timedelta(seconds=app.config['ATTEMPT_EXPIRY_GRACE'])
+    if (attempt.status == 'in_progress' and attempt.expires_at is not None
+            and datetime.utcnow() > attempt.expires_at + grace):
+        attempt.status = 'expired'
+        db.session.commit()
+        attempt_store.discard(attempt.id)
+    return attempt.status == 'expired'
+
+
+@app.route('/api/attempts/<attempt_id>', methods=['GET'])
+@priority('high')
+@jwt_required()
+def get_attempt(attempt_id):
+    claims = get_jwt()
+    attempt = db.session.get(AttemptSession, attempt_id)
+    if not attempt or claims.get('type') != 'student' or attempt.student_id != claims['id']:
+        return jsonify({'message': 'Attempt not found'}), 404
     
-    return jsonify({'message': 'Test deleted successfully'}), 200
+    state, seq = attempt_store.current_state(attempt)
+    return jsonify({'attempt': attempt.to_dict(state, seq)}), 200
+
+
+@app.route('/api/attempts/<attempt_id>', methods=['PATCH'])
+@priority('critical')
+@jwt_required()
+def save_attempt(attempt_id):
+    """Autosave the questions that changed since the last save"""
+    claims = get_jwt()
+    if claims.get('type') != 'student':
+        return jsonify({'message': 'Attempt not found'}), 404
+    
+    # Saves of an attempt this host already tracks never touch the main database
+    row = attempt_store.load(attempt_id)
+    if row is None:
+        attempt = db.session.get(AttemptSession, attempt_id)
+        if not attempt or attempt.student_id != claims['id']:
+            return jsonify({'message': 'Attempt not found'}), 404
+        if expire_if_overdue(attempt):
+            return jsonify({'message': 'Attempt expired'}), 409
+        if attempt.status != 'in_progress':
+            return jsonify({'message': 'Attempt already submitted'}), 409
+        attempt_store.seed(attempt)
+        test_id = attempt.test_id
+    elif row['student_id'] != claims['id']:
+        return jsonify({'message': 'Attempt not found'}), 404
+    else:
+        test_id = row['test_id']
+    
+    key = answer_keys.get(test_id)
+    if key is None:
+        return jsonify({'message': 'Test not found'}), 404
+    
+    try:
+        seq = attempt_store.apply(attempt_id, (request.get_json() or {}).get('changes'), set(key.question_keys))
+    except InvalidAttemptChange as e:
+        return jsonify({'message': str(e)}), 400
+    if seq is None:
+        return jsonify({'message': 'Attempt already submitted'}), 409
+    attempt_flusher.ensure_started()
+    return jsonify({'attempt_id': attempt_id, 'seq': seq}), 200
 
 
 # ==================== Test Results Routes ====================
 
 @app.route('/api/results/submit', methods=['POST'])
 @app.route('/api/submit-test', methods=['POST'])
+@priority('critical')
 @jwt_required()
 def submit_test():
     claims = get_jwt()
@@ -266,68 +717,152 @@ def submit_test():
         return jsonify({'message': 'Only students can submit tests'}), 403
     
     data = request.get_json()
-    test_id = data.get('test_id')
-    answers = data.get('answers', {})
-    marked_for_review = data.get('marked_for_review', {})
-    question_status = data.get('question_status', {})  # New: tracks answer/skip/marked_only
+    attempt = None
+    if data.get('attempt_id'):
+        # Autosaved attempts are submitted by reference; the answers are already on the server
+        attempt = db.session.get(AttemptSession, str(data['attempt_id']))
+        if not attempt or attempt.student_id != claims['id']:
+            return jsonify({'message': 'Attempt not found'}), 404
+        if expire_if_overdue(attempt):
+            return jsonify({'message': 'Attempt expired'}), 409
+        if attempt.status == 'submitted':
+            return resubmitted_attempt(attempt)
+        test_id = attempt.test_id
+    else:
+        test_id = data.get('test_id')
     
-    test = Test.query.get(test_id)
-    if not test:
+    # Score against the cached answer key so the questions table is not touched
+    key = answer_keys.get(test_id)
+    if key is None:
         return jsonify({'message': 'Test not found'}), 404
     
-    # Calculate score with new status-based system
-    correct_count = 0
-    wrong_count = 0
-    unanswered_count = 0
+    if attempt is not None:
+        state, seq = attempt_store.current_state(attempt)
+        try:
+            merge_changes(state, data.get('changes') or {}, set(key.question_keys))
+        except InvalidAttemptChange as e:
+            return jsonify({'message': str(e)}), 400
+        answers = state['answers']
+        marked_for_review = state['marked_for_review']
+        question_status = state['question_status']
+        attempt.status = 'submitted'
+        attempt.state = state
+        attempt.saved_seq = seq
+        attempt.submitted_at = datetime.utcnow()
+    else:
+        answers = data.get('answers', {})
+        marked_for_review = data.get('marked_for_review', {})
+        question_status = data.get('question_status', {})  # New: tracks answer/skip/marked_only
     
-    for question in test.questions:
-        q_id = str(question.id)
-        status = question_status.get(q_id)  # 'answered', 'skipped', 'marked_only', or None
-        student_answer = answers.get(q_id)
-        
-        # Only score if status is 'answered' (not skipped or marked_only)
-        if status == 'answered' and student_answer is not None:
-            if student_answer == question.correct_answer:
-                correct_count += 1
-            else:
-                wrong_count += 1
-        else:
-            # Skipped, marked_only, or unanswered = 0 points
-            unanswered_count += 1
-    
-    # Calculate total marks: +4 for correct, -1 for wrong, ensure no negative marks
-    total_marks = (correct_count * 4) - (wrong_count * 1)
-    total_marks = max(0, total_marks)  # Ensure marks never go below 0
-    max_marks = len(test.questions) * 4
-    percentage = (total_marks / max_marks * 100) if max_marks > 0 else 0
-    is_passed = percentage >= test.passing_marks
-    
-    # Create result record
-    result = TestResult(
-        student_id=claims['id'],
-        test_id=test_id,
-        answers=answers,
-        marked_for_review=marked_for_review,
-        marks_obtained=total_marks,
-        max_marks=max_marks,
-        percentage=round(percentage, 2),
-        correct_count=correct_count,
-        wrong_count=wrong_count,
-        unanswered_count=unanswered_count,
-        is_passed=is_passed
-    )
+    if app.config['SUBMISSION_INGEST_MODE'] == 'spool':
+        submission = submission_spool.enqueue(
+            claims['id'],
+            key.test_id,
+            {'answers': answers, 'marked_for_review': marked_for_review, 'question_status': question_status},
+            # Retries of an attempt reuse its receipt even without an Idempotency-Key header
+            idempotency_key=request.headers.get('Idempotency-Key') or (attempt and f'attempt:{attempt.id}')
+        )
+        submission_flusher.ensure_started()
+        if attempt is not None:
+            attempt.receipt_id = submission['receipt_id']
+            db.session.commit()
+            attempt_store.discard(attempt.id)
+        return jsonify({'message': 'Submission received', **submission_to_dict(submission)}), 202
+    
+    # Create result record and update item statistics in the same transaction
+    values, score = build_result_values(key, claims['id'], answers, marked_for_review, question_status)
+    result = TestResult(**values)
     
     db.session.add(result)
+    record_scored([(key, score)])
+    db.session.flush()
+    record_results([{**values, 'id': result.id, 'submitted_at': result.submitted_at}])
+    if attempt is not None:
+        attempt.result_id = result.id
     db.session.commit()
+    if attempt is not None:
+        attempt_store.discard(attempt.id)
     
     return jsonify({
         'message': 'Test submitted successfully',
-        'result': result.to_dict()
+        'result': result_with_standing(result)
     }), 201
 
 
+def resubmitted_attempt(attempt):
+    """Response to a repeated submit of an attempt: its result, or its spool receipt until that is written"""
+    if attempt.result_id is not None:
+        result = db.session.get(TestResult, attempt.result_id)
+        return jsonify({'message': 'Test already submitted', 'result': result_with_standing(result)}), 200
+    submission = submission_spool.get(attempt.receipt_id) if attempt.receipt_id else None
+    if submission is not None:
+        return jsonify({'message': 'Submission received', **submission_to_dict(submission)}), 202
+    return jsonify({'message': 'Test already submitted', 'receipt_id': attempt.receipt_id}), 409
+
+
+def result_with_standing(result):
+    """Result as a dict with its rank and percentile among all results of the test"""
+    data = result.to_dict()
+    standing = get_standing(result.test_id, result.marks_obtained)
+    if standing is None and db.session.get(TestStats, result.test_id) is None:
+        # Tests created before item statistics existed are backfilled on first request, on the primary;
+        # a replica may only be behind
+        use_primary()
+        standing = get_standing(result.test_id, result.marks_obtained)
+        key = answer_keys.get(result.test_id)
+        if standing is None and db.session.get(TestStats, result.test_id) is None and key is not None:
+            rebuild_test_stats(key)  # key is None once the test is being purged
+            db.session.commit()
+            standing = get_standing(result.test_id, result.marks_obtained)
+    data['standing'] = standing
+    return data
+
+
+def submission_to_dict(submission):
+    data = {
+        'receipt_id': submission['receipt_id'],
+        'status': submission['status'],
+        'status_url': f"/api/submissions/{submission['receipt_id']}",
+        'result_id': submission['result_id']
+    }
+    if submission['status'] == 'completed':
+        result = TestResult.query.get(submission['result_id'])
+        data['result'] = result_with_standing(result) if result else None
+    elif submission['status'] == 'failed':
+        data['error'] = submission['error']
+    return data
+
+
+@app.route('/api/submissions/<receipt_id>', methods=['GET'])
+@priority('critical')
+@jwt_required()
+def get_submission_status(receipt_id):
+    claims = get_jwt()
+    submission = submission_spool.get(receipt_id)
+    
+    if not submission:
+        return jsonify({'message': 'Submission not found'}), 404
+    
+    if claims.get('type') != 'student' or submission['student_id'] != claims['id']:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    if submission['status'] in ('pending', 'flushing'):
+        submission_flusher.ensure_started()
+    
+    return jsonify(submission_to_dict(submission)), 200
+
+
+@app.cli.command('flush-submissions')
+def flush_submissions():
+    """Write every spooled submission to the database"""
+    while flush_spool(submission_spool, answer_keys, app.config['SUBMISSION_FLUSH_BATCH']):
+        pass
+    print(f"Pending submissions: {submission_spool.pending_count()}")
+
+
 @app.route('/api/results', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_results():
     claims = get_jwt()
     
@@ -335,12 +870,12 @@ def get_results():
     if claims.get('type') != 'student':
         return jsonify({'message': 'Only students can access their results'}), 403
     
-    results = TestResult.query.filter_by(student_id=claims['id']).all()
-    return jsonify([result.to_dict() for result in results]), 200
+    return list_results(query_result_listing(TestResult.student_id == claims['id']))
 
 
 @app.route('/api/results/<int:result_id>', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_result(result_id):
     claims = get_jwt()
     result = TestResult.query.get(result_id)
@@ -353,23 +888,20 @@ def get_result(result_id):
         return jsonify({'message': 'Unauthorized'}), 403
     
     # Get test questions for detailed feedback
-    test = Test.query.get(result.test_id)
-    result_data = result.to_dict()
+    test = get_live_test(result.test_id)
+    if not test:
+        return jsonify({'message': 'Result not found'}), 404
+    result_data = result_with_standing(result)
     result_data['test'] = test.to_dict()
     
-    # Normalize marked_for_review - could be list or dict
-    marked_ids = []
-    if result.marked_for_review:
-        if isinstance(result.marked_for_review, list):
-            marked_ids = [str(qid) for qid in result.marked_for_review]
-        elif isinstance(result.marked_for_review, dict):
-            marked_ids = list(result.marked_for_review.keys())
+    questions = test.questions
+    answers, marked_ids = result.decode_answers([str(question.id) for question in questions])
     
     # Add question details with correct answers
     questions_with_answers = []
-    for question in test.questions:
+    for question in questions:
         q_dict = question.to_dict(include_answer=True)
-        q_dict['student_answer'] = result.answers.get(str(question.id)) if result.answers else None
+        q_dict['student_answer'] = answers.get(str(question.id))
         q_dict['is_marked_for_review'] = str(question.id) in marked_ids
         questions_with_answers.append(q_dict)
     
@@ -380,6 +912,7 @@ def get_result(result_id):
 
 @app.route('/api/students/<int:student_id>/results', methods=['GET'])
 @jwt_required()
+@replica_reads
 def get_student_results(student_id):
     claims = get_jwt()
     
@@ -387,15 +920,48 @@ def get_student_results(student_id):
     if claims.get('type') == 'student' and claims['id'] != student_id:
         return jsonify({'message': 'Unauthorized'}), 403
     
-    results = TestResult.query.filter_by(student_id=student_id).all()
-    return jsonify([result.to_dict() for result in results]), 200
+    return list_results(query_result_listing(TestResult.student_id == student_id))
+
+
+@app.route('/api/students/<int:student_id>/summary', methods=['GET'])
+@jwt_required()
+@replica_reads
+def get_student_summary_route(student_id):
+    """Attempt count, averages, best/worst and most recent results from one summary row"""
+    claims = get_jwt()
+    
+    if claims.get('type') == 'student' and claims['id'] != student_id:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    summary = db.session.get(StudentSummary, student_id)
+    if summary is None:
+        # Built on first read, from the primary's results and committed there
+        use_primary()
+        if db.session.get(Student, student_id) is None:
+            return jsonify({'message': 'Student not found'}), 404
+        summary = get_student_summary(student_id)
+    
+    return jsonify(summary.to_dict()), 200
+
+
+@app.cli.command('rebuild-student-summaries')
+@click.option('--student-id', type=int, default=None, help='Rebuild a single student')
+def rebuild_student_summaries(student_id):
+    """Recompute per-student summaries from stored results"""
+    student_ids = [student_id] if student_id else [row.id for row in db.session.query(Student.id).order_by(Student.id)]
+    for sid in student_ids:
+        rebuild_student_summary(sid)
+        db.session.commit()
+    print(f"Rebuilt summaries of {len(student_ids)} students")
 
 
 @app.route('/api/tests/<int:test_id>/results', methods=['GET'])
+@priority('low')
 @jwt_required()
+@replica_reads
 def get_test_results(test_id):
     claims = get_jwt()
-    test = Test.query.get(test_id)
+    test = get_live_test(test_id)
     
     if not test:
         return jsonify({'message': 'Test not found'}), 404
@@ -404,20 +970,480 @@ def get_test_results(test_id):
     if claims.get('type') != 'teacher' or test.teacher_id != claims['id']:
         return jsonify({'message': 'Unauthorized'}), 403
     
-    results = TestResult.query.filter_by(test_id=test_id).all()
-    results_data = []
+    return list_results(query_result_listing(TestResult.test_id == test_id))
+
+
+@app.route('/api/tests/<int:test_id>/leaderboard', methods=['GET'])
+@jwt_required()
+@replica_reads
+def get_leaderboard(test_id):
+    """Results of a test best first, one keyset page at a time (?limit, ?cursor)"""
+    claims = get_jwt()
+    test = get_live_test(test_id)
+    
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+    
+    # Only the test's teacher sees who is who; students see their own entries and anonymous ranks
+    is_teacher = claims.get('type') == 'teacher'
+    if is_teacher and test.teacher_id != claims['id']:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    query = (db.session.query(TestResult.id, TestResult.marks_obtained, TestResult.percentage,
+                              TestResult.submitted_at, Student.id, Student.name, Student.email)
+             .join(Student, Student.id == TestResult.student_id)
+             .filter(TestResult.test_id == test_id))
+    try:
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        if cursor:
+            query = query.filter(after_leaderboard_cursor(
+                TestResult.marks_obtained, TestResult.submitted_at, TestResult.id, cursor
+            ))
+    except InvalidCursorError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    rows = (query.order_by(TestResult.marks_obtained.desc(), TestResult.submitted_at, TestResult.id)
+            .limit(limit + 1)
+            .all())
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_leaderboard_cursor(last.marks_obtained, last.submitted_at, last[0])
+    
+    histogram = Histogram(test_id)
+    entries = []
+    for result_id, marks, percentage, submitted_at, student_id, name, email in rows:
+        entry = {
+            **histogram.standing(marks),
+            'marks_obtained': marks,
+            'percentage': percentage,
+            'submitted_at': submitted_at.isoformat()
+        }
+        if is_teacher:
+            entry.update(result_id=result_id, student_id=student_id, student_name=name, student_email=email)
+        elif student_id == claims['id']:
+            entry.update(result_id=result_id, student_id=student_id, student_name=name, is_own=True)
+        entries.append(entry)
+    
+    return jsonify({
+        'test_id': test_id,
+        'total': histogram.total,
+        'entries': entries,
+        'next_cursor': next_cursor
+    }), 200
+
+
+@app.route('/api/tests/<int:test_id>/analytics', methods=['GET'])
+@priority('low')
+@jwt_required()
+@replica_reads
+def get_test_analytics_route(test_id):
+    claims = get_jwt()
+    test = get_live_test(test_id)
+    
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+    
+    if claims.get('type') != 'teacher' or test.teacher_id != claims['id']:
+        return jsonify({'message': 'Unauthorized'}), 403
+    
+    analytics = get_test_analytics(test_id)
+    if analytics is None:
+        # Tests created before item statistics existed are backfilled on first request, on the primary
+        use_primary()
+        analytics = get_test_analytics(test_id)
+    if analytics is None:
+        rebuild_test_stats(answer_keys.get(test_id))
+        db.session.commit()
+        analytics = get_test_analytics(test_id)
+    
+    return jsonify(analytics), 200
+
+
+@app.cli.command('rebuild-item-stats')
+@click.option('--test-id', type=int, default=None, help='Rebuild a single test')
+def rebuild_item_stats(test_id):
+    """Recompute item-analysis statistics from stored results"""
+    test_ids = [test_id] if test_id else [row.id for row in db.session.query(Test.id).order_by(Test.id)]
+    for tid in test_ids:
+        key = answer_keys.get(tid)
+        if key is None:
+            print(f"[ERROR] Test {tid} not found")
+            continue
+        rebuild_test_stats(key)
+        db.session.commit()
+        print(f"Rebuilt item statistics for test {tid}")
+
+
+@app.cli.command('regrade-test')
+@click.option('--test-id', type=int, required=True)
+def regrade_test_command(test_id):
+    """Rescore every result of a test against its current answer key"""
+    key = answer_keys.get(test_id)
+    if key is None:
+        print(f"[ERROR] Test {test_id} not found")
+        return
+    outcome = regrade_test(None, key)
+    print(f"Regraded {outcome['regraded']} results of test {test_id} ({outcome['changed']} changed)")
+
+
+@app.cli.command('purge-deleted-tests')
+def purge_deleted_tests():
+    """Finish purging tests that were soft-deleted but not yet removed"""
+    test_ids = deleted_test_ids()
+    for tid in test_ids:
+        outcome = purge_test(None, tid)
+        print(f"Purged test {tid} ({outcome['results_deleted']} results)")
+    print(f"Purged {len(test_ids)} tests")
+
+
+@app.cli.command('pack-answers')
+def pack_answers_command():
+    """Convert JSON answers of existing results to the packed binary format"""
+    batch_size = 500
+    packed = 0
+    last_id = 0
+    while True:
+        results = (TestResult.query
+                   .filter(TestResult.id > last_id, TestResult.answers_packed.is_(None))
+                   .order_by(TestResult.id)
+                   .limit(batch_size)
+                   .all())
+        if not results:
+            break
+        for result in results:
+            last_id = result.id
+            key = answer_keys.get(result.test_id)
+            if key is None:
+                continue
+            answers = {k: v for k, v in (result.answers or {}).items() if v is not None}
+            # question_status was never stored, so every recorded answer is treated as answered
+            status = dict.fromkeys(answers, 'answered')
+            result.answers_packed = pack_answers(key.question_keys, answers, result.marked_for_review, status)
+            result.answers = None
+            result.marked_for_review = None
+            packed += 1
+        db.session.commit()
+    print(f"Packed answers of {packed} results")
+
+
+# ==================== Result Listing Helpers ====================
+
+EXPORT_CHUNK_SIZE = 1000
+CSV_EXPORT_FIELDS = [
+    'id', 'student_id', 'student_email', 'test_id', 'test_name', 'marks_obtained', 'max_marks',
+    'percentage', 'correct_count', 'wrong_count', 'unanswered_count', 'is_passed', 'submitted_at'
+]
+
+
+def list_results(query):
+    """
+    Respond with a result listing.
+    
+    ?format=ndjson|csv streams every row; ?limit / ?cursor return one keyset page as
+    {'results': [...], 'next_cursor': ...}; otherwise the full list is returned as before.
+    """
+    query = query.order_by(TestResult.submitted_at, TestResult.id)
+    export_format = request.args.get('format')
+    
+    try:
+        if export_format in ('ndjson', 'csv'):
+            cursor = request.args.get('cursor')
+            if cursor:
+                query = query.filter(after_cursor(TestResult.submitted_at, TestResult.id, cursor))
+            return export_results(query, export_format)
+        if export_format:
+            return jsonify({'message': f'Unsupported format: {export_format}'}), 400
+        
+        if 'limit' not in request.args and 'cursor' not in request.args:
+            return jsonify(serialize_result_rows(query.all())), 200
+        
+        limit = parse_page_size(request.args.get('limit'))
+        cursor = request.args.get('cursor')
+        if cursor:
+            query = query.filter(after_cursor(TestResult.submitted_at, TestResult.id, cursor))
+    except InvalidCursorError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Fetch one extra row to know whether another page exists
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].submitted_at, rows[-1].id)
+    
+    return jsonify({'results': serialize_result_rows(rows), 'next_cursor': next_cursor}), 200
+
+
+def iter_result_chunks(query):
+    """Yield lists of serialized results, reading rows from a server-side cursor"""
+    chunk = []
+    for row in query.yield_per(EXPORT_CHUNK_SIZE):
+        chunk.append(result_row_to_dict(row))
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_results(query, export_format):
+    """Stream results as NDJSON or CSV at flat memory"""
+    def generate_ndjson():
+        for chunk in iter_result_chunks(query):
+            yield ''.join(json.dumps(result) + '\n' for result in chunk)
+    
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_EXPORT_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        for chunk in iter_result_chunks(query):
+            writer.writerows(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    
+    if export_format == 'csv':
+        response = Response(stream_with_context(generate_csv()), mimetype='text/csv')
+        response.headers['Content-Disposition'] = 'attachment; filename=results.csv'
+    else:
+        response = Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+    return response
+
+
+# ==================== Schema Commands ====================
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Create missing tables and apply pending schema migrations"""
+    applied = prepare_database()
+    print(f"Applied {len(applied)} migrations" if applied else "Schema is up to date")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List schema migrations and whether this database has applied them"""
+    pending = {m.version for m in pending_migrations(db.engine)}
+    for m in sorted(MIGRATIONS):
+        print(f"{m.version:4d}  {'pending' if m.version in pending else 'applied':8s}  {m.description}")
+
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print every plan, not only regressions')
+def check_query_plans_command(verbose):
+    """EXPLAIN the hot queries and fail if one scans a whole table or sorts instead of using an index"""
+    from query_plans import check_query_plans  # Only needed by this command
+    failures = 0
+    for hot_query, details, problems in check_query_plans(db.engine):
+        print(f"{'FAIL' if problems else 'ok':4s}  {hot_query.name}" + (f": {'; '.join(problems)}" if problems else ''))
+        if problems or verbose:
+            for line in details:
+                print(f"        {line}")
+        failures += bool(problems)
+    if failures:
+        raise SystemExit(1)
+
+
+# ==================== Image Routes ====================
+
+@app.route('/api/images/<image_hash>', methods=['GET'])
+@priority('high')
+def get_image(image_hash):
+    """Serve a stored image; content is addressed by hash so it never changes"""
+    if not is_image_hash(image_hash):
+        return jsonify({'message': 'Image not found'}), 404
     
-    for result in results:
-        r_data = result.to_dict()
-        r_data['student_email'] = result.student.email
-        results_data.append(r_data)
+    image = db.session.get(Image, image_hash)
+    # Images stored before types were checked are only served if they are one of the allowed types
+    if not image or image.mime_type not in ALLOWED_MIME_TYPES or not image_store.exists(image_hash):
+        return jsonify({'message': 'Image not found'}), 404
     
-    return jsonify(results_data), 200
+    response = send_file(
+        image_store.path_for(image_hash),
+        mimetype=image.mime_type,
+        etag=image_hash,
+        conditional=True,
+        max_age=31536000
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    # Never let a browser treat an image URL as a document, even when opened directly
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+    return response
+
+
+def transcode_question_images(job, image_hashes):
+    """Job body: create image variants, then publish them in every test showing the images"""
+    transcoded, errors = transcode_images(image_store, image_hashes, job=job)
+    add_job_errors(job, errors)
+    test_ids = publish_image_variants(transcoded)
+    return {'transcoded': len(transcoded), 'failed': len(errors), 'tests_updated': len(test_ids)}
+
+
+def publish_image_variants(image_hashes):
+    """Bump the tests showing these images so every worker rebuilds their snapshot with image_srcset"""
+    test_ids = tests_using_images(image_hashes)
+    for test in Test.query.filter(Test.id.in_(test_ids)):
+        test.bump_version()
+    db.session.commit()
+    for test_id in test_ids:
+        test_snapshots.invalidate(test_id)
+    return test_ids
+
+
+@app.cli.command('transcode-images')
+@click.option('--force', is_flag=True, help='Also redo images that already have variants')
+def transcode_images_command(force):
+    """Create downscaled WebP variants of question images"""
+    batch_size = 50
+    transcoded = 0
+    failed = 0
+    test_ids = set()
+    last_hash = ''
+    while True:
+        image_hashes = [image_hash for (image_hash,) in db.session.query(Question.image_hash)
+                        .filter(Question.image_hash > last_hash)
+                        .distinct()
+                        .order_by(Question.image_hash)
+                        .limit(batch_size)]
+        if not image_hashes:
+            break
+        last_hash = image_hashes[-1]
+        done, errors = transcode_images(image_store, image_hashes, force=force)
+        for error in errors:
+            print(f"[ERROR] Image {error['image_hash']}: {error['message']}")
+        test_ids.update(publish_image_variants(done))
+        transcoded += len(done)
+        failed += len(errors)
+    print(f"Transcoded {transcoded} images ({failed} failed), updated {len(test_ids)} tests")
+    if db.session.query(Question.query.filter(Question.image.isnot(None)).exists()).scalar():
+        print("Inline base64 images were skipped; run `flask migrate-images` first to move them into the image store")
+
+
+@app.cli.command('strip-image-metadata')
+def strip_image_metadata_command():
+    """Strip EXIF, XMP and text metadata from images stored before uploads were cleaned"""
+    batch_size = 100
+    stripped = 0
+    last_hash = ''
+    while True:
+        images = (Image.query
+                  .filter(Image.hash > last_hash, Image.mime_type.in_(ALLOWED_MIME_TYPES))
+                  .order_by(Image.hash)
+                  .limit(batch_size)
+                  .all())
+        if not images:
+            break
+        last_hash = images[-1].hash
+        for image in images:
+            if not image_store.exists(image.hash):
+                continue
+            data = image_store.read(image.hash)
+            try:
+                clean = strip_metadata(data)
+            except InvalidImageError as e:
+                print(f"[ERROR] Image {image.hash}: {e}")
+                continue
+            if clean != data:
+                # Questions and variants keep pointing at the same hash
+                image_store.rewrite(image.hash, clean)
+                image.size = len(clean)
+                stripped += 1
+        db.session.commit()
+    print(f"Stripped metadata from {stripped} images")
+
+
+@app.cli.command('migrate-images')
+def migrate_images():
+    """Move legacy base64 question images into the image store"""
+    batch_size = 100
+    migrated = 0
+    failed = 0
+    last_id = 0
+    while True:
+        questions = (Question.query
+                     .filter(Question.id > last_id, Question.image.isnot(None))
+                     .order_by(Question.id)
+                     .limit(batch_size)
+                     .all())
+        if not questions:
+            break
+        for question in questions:
+            last_id = question.id
+            try:
+                question.image_hash = store_image(question.image)
+            except InvalidImageError as e:
+                print(f"[ERROR] Question {question.id}: {e}, leaving inline image in place")
+                failed += 1
+                continue
+            question.image = None
+            migrated += 1
+        db.session.commit()
+        publish_staged_images()
+    print(f"Migrated {migrated} question images ({failed} failed)")
+
+
+# ==================== Metrics Routes ====================
+
+@app.route('/api/metrics', methods=['GET'])
+@priority('exempt')
+def get_metrics():
+    """Prometheus metrics summed over every worker of this server"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics/profile', methods=['POST'])
+@priority('exempt')
+@jwt_required()
+def start_profile():
+    """Profile the next N requests to an endpoint (Teacher only)"""
+    claims = get_jwt()
+    if claims.get('type') != 'teacher':
+        return jsonify({'message': 'Only teachers can profile requests'}), 403
+    
+    data = request.get_json() or {}
+    endpoint = data.get('endpoint')
+    if endpoint not in app.view_functions:
+        return jsonify({'message': 'Unknown endpoint',
+                        'endpoints': sorted(name for name in app.view_functions if name != 'static')}), 400
+    try:
+        requests = int(data.get('requests', 10))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'requests must be a number'}), 400
+    if not 1 <= requests <= 100:
+        return jsonify({'message': 'requests must be between 1 and 100'}), 400
+    
+    profile_id = metrics.request_profile(endpoint, requests)
+    return jsonify({'profile_id': profile_id, 'endpoint': endpoint, 'requests': requests}), 201
+
+
+@app.route('/api/metrics/profile/<profile_id>', methods=['GET'])
+@priority('exempt')
+@jwt_required()
+def get_profile(profile_id):
+    """pstats report of the requests captured so far (Teacher only)"""
+    claims = get_jwt()
+    if claims.get('type') != 'teacher':
+        return jsonify({'message': 'Only teachers can view profiles'}), 403
+    if not profile_id.isalnum():
+        return jsonify({'message': 'Profile not found'}), 404
+    
+    report = metrics.profile_report(profile_id)
+    if report is None:
+        return jsonify({'message': 'Profile not found'}), 404
+    spec, captured, text = report
+    header = f"Profile {profile_id}: {captured} of {spec['requests']} requests to {spec['endpoint']} captured\n\n"
+    return Response(header + text, mimetype='text/plain')
 
 
 # ==================== Home Routes ====================
 
 @app.route('/api/health', methods=['GET'])
+@priority('exempt')
 def health():
     return jsonify({'status': 'OK', 'message': 'Nano Test Platform Backend'}), 200
 
@@ -425,64 +1451,35 @@ def health():
 # Configure static file serving BEFORE route definitions
 @app.before_request
 def before_request():
-    """Serve static files if they exist"""
-    if request.path.startswith('/api/'):
+    """Serve static files from the preloaded manifest"""
+    if request.path.startswith('/api/') or request.method not in ('GET', 'HEAD'):
         return  # Let API routes handle it
     
-    # Try to serve static files
-    static_dir = os.path.join(os.path.dirname(__file__), 'static')
-    frontend_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend')
-    
-    requested_file = request.path.lstrip('/')
-    if not requested_file or requested_file == '':
-        requested_file = 'index.html'
-    
-    # Check static directory first (Docker)
-    if os.path.exists(static_dir):
-        file_path = os.path.join(static_dir, requested_file)
-        if os.path.exists(file_path):
-            return send_from_directory(static_dir, requested_file)
-    
-    # Check frontend directory (local development)
-    if os.path.exists(frontend_dir):
-        file_path = os.path.join(frontend_dir, requested_file)
-        if os.path.exists(file_path):
-            return send_from_directory(frontend_dir, requested_file)
+    return static_manifest.serve(request, request.path)
 
 
 @app.route('/', methods=['GET'])
+@priority('exempt')
 def home():
     """Serve the frontend index.html"""
-    static_dir = os.path.join(os.path.dirname(__file__), 'static')
-    frontend_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend')
-    
-    if os.path.exists(static_dir):
-        return send_from_directory(static_dir, 'index.html')
-    elif os.path.exists(frontend_dir):
-        return send_from_directory(frontend_dir, 'index.html')
-    else:
+    response = static_manifest.serve(request, '/index.html')
+    if response is None:
         return jsonify({'error': 'Frontend files not found'}), 404
+    return response
 
 
 @app.route('/<path:filename>', methods=['GET'])
+@priority('exempt')
 def serve_file(filename):
     """Serve files from frontend directory"""
-    static_dir = os.path.join(os.path.dirname(__file__), 'static')
-    frontend_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend')
-    
-    # Try static directory first (Docker)
-    if os.path.exists(static_dir):
-        return send_from_directory(static_dir, filename)
-    
-    # Try frontend directory (Local)
-    if os.path.exists(frontend_dir):
-        return send_from_directory(frontend_dir, filename)
-    
-    # Not found - return 404
-    return jsonify({'error': f'File {filename} not found'}), 404
+    response = static_manifest.serve(request, filename)
+    if response is None:
+        return jsonify({'error': f'File {filename} not found'}), 404
+    return response
 
 
 @app.route('/api/', methods=['GET'])
+@priority('exempt')
 def api_info():
     """Show API endpoints information"""
     return jsonify({
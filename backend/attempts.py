@@ -0,0 +1,170 @@
+"""
+Incremental autosave of in-progress attempts.
+
+While a student works through a test the page sends small patches (the
+questions that changed since the last save). Patches are merged into the
+attempt's state in a host-local SQLite store, so saving never waits on the
+main database, and a BackgroundFlusher writes the latest state of every
+changed attempt to `attempt_sessions` in batched executemany updates.
+
+Each merge bumps the attempt's `seq`; the main database only accepts a flush
+with a higher `seq` than it already has, so concurrent flushers in different
+workers cannot write an older state over a newer one. The final submit reads
+the newest state from the store (falling back to the database) and only needs
+the attempt id from the client.
+
+Patches for one attempt must reach the same host, which holds as long as the
+app runs on one host or the load balancer uses sticky sessions.
+"""
+
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, AttemptSession
+from local_store import LocalStore
+
+ATTEMPT_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS attempt_state (
+    attempt_id TEXT PRIMARY KEY,
+    student_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    flushed_seq INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempt_state_dirty ON attempt_state (updated_at) WHERE seq > flushed_seq;
+'''
+STATE_FIELDS = ('answers', 'marked_for_review', 'question_status')
+QUESTION_STATUSES = (None, 'answered', 'skipped', 'marked_only')
+IDLE_RETENTION = 24 * 60 * 60  # Flushed state of untouched attempts is dropped after a day
+
+
+class InvalidAttemptChange(ValueError):
+    """Raised when a patch refers to unknown questions or has malformed values"""
+
+
+def empty_state():
+    return {field: {} for field in STATE_FIELDS}
+
+
+def merge_changes(state, changes, question_keys):
+    """Apply a patch of {field: {question_id: value}} to state in place"""
+    if not isinstance(changes, dict):
+        raise InvalidAttemptChange('Changes must be an object')
+    for field in STATE_FIELDS:
+        values = changes.get(field) or {}
+        if not isinstance(values, dict):
+            raise InvalidAttemptChange(f'{field} must be an object')
+        for question_key, value in values.items():
+            question_key = str(question_key)
+            if question_key not in question_keys:
+                raise InvalidAttemptChange(f'Question {question_key} is not part of this test')
+            if field == 'answers' and value is not None and not isinstance(value, str):
+                raise InvalidAttemptChange('Answers must be strings or null')
+            if field == 'question_status' and value not in QUESTION_STATUSES:
+                raise InvalidAttemptChange(f'Unknown question status {value!r}')
+            if field == 'marked_for_review':
+                value = bool(value)
+            state.setdefault(field, {})[question_key] = value
+    return state
+
+
+class AttemptStore:
+    """Latest autosaved state of each attempt on this host"""
+
+    def __init__(self, path):
+        self.store = LocalStore(path, ATTEMPT_STORE_SCHEMA)
+
+    def load(self, attempt_id):
+        return self.store.connection().execute(
+            'SELECT * FROM attempt_state WHERE attempt_id = ?', (attempt_id,)
+        ).fetchone()
+
+    def seed(self, attempt):
+        """Start tracking an attempt from its state in the main database"""
+        self.store.connection().execute(
+            'INSERT OR IGNORE INTO attempt_state '
+            '(attempt_id, student_id, test_id, state, seq, flushed_seq, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (attempt.id, attempt.student_id, attempt.test_id, json.dumps(attempt.state or empty_state()),
+             attempt.saved_seq, attempt.saved_seq, time.time())
+        )
+
+    def apply(self, attempt_id, changes, question_keys):
+        """Merge a patch into the stored state and return the new seq, or None if the attempt was submitted"""
+        with self.store.transaction() as conn:
+            row = conn.execute('SELECT state, seq FROM attempt_state WHERE attempt_id = ?', (attempt_id,)).fetchone()
+            if row is None:
+                return None
+            state = merge_changes(json.loads(row['state']), changes, question_keys)
+            seq = row['seq'] + 1
+            conn.execute(
+                'UPDATE attempt_state SET state = ?, seq = ?, updated_at = ? WHERE attempt_id = ?',
+                (json.dumps(state), seq, time.time(), attempt_id)
+            )
+        return seq
+
+    def current_state(self, attempt):
+        """(state, seq) of the newest save of an attempt, local or flushed"""
+        row = self.load(attempt.id)
+        if row is not None and row['seq'] >= attempt.saved_seq:
+            return json.loads(row['state']), row['seq']
+        return attempt.state or empty_state(), attempt.saved_seq
+
+    def dirty(self, batch_size):
+        return self.store.connection().execute(
+            'SELECT attempt_id, state, seq, updated_at FROM attempt_state WHERE seq > flushed_seq '
+            'ORDER BY updated_at LIMIT ?', (batch_size,)
+        ).fetchall()
+
+    def mark_flushed(self, flushed):
+        """flushed is a list of (attempt_id, seq) pairs now stored in the main database"""
+        with self.store.transaction() as conn:
+            conn.executemany(
+                'UPDATE attempt_state SET flushed_seq = MAX(flushed_seq, ?) WHERE attempt_id = ?',
+                [(seq, attempt_id) for attempt_id, seq in flushed]
+            )
+
+    def discard(self, attempt_id):
+        self.store.connection().execute('DELETE FROM attempt_state WHERE attempt_id = ?', (attempt_id,))
+
+    def prune(self, older_than):
+        self.store.connection().execute(
+            'DELETE FROM attempt_state WHERE seq <= flushed_seq AND updated_at < ?', (older_than,)
+        )
+
+
+def flush_attempts(attempt_store, batch_size=500):
+    """Write one batch of changed attempt states to the main database; returns True if a batch was written"""
+    rows = attempt_store.dirty(batch_size)
+    if not rows:
+        attempt_store.prune(time.time() - IDLE_RETENTION)
+        return False
+
+    table = AttemptSession.__table__
+    stmt = (update(table)
+            .where(table.c.id == bindparam('b_id'),
+                   table.c.saved_seq < bindparam('b_seq'),
+                   table.c.status == 'in_progress')
+            .values(state=bindparam('b_state', type_=table.c.state.type),
+                    saved_seq=bindparam('b_seq'),
+                    saved_at=bindparam('b_saved_at')))
+    try:
+        db.session.execute(stmt, [
+            {'b_id': row['attempt_id'], 'b_seq': row['seq'], 'b_state': json.loads(row['state']),
+             'b_saved_at': datetime.utcfromtimestamp(row['updated_at'])}
+            for row in rows
+        ])
+        db.session.commit()
+    except OperationalError as e:
+        # Database unavailable: the states stay dirty and are retried on the next flush
+        db.session.rollback()
+        print(f"[ERROR] Flushing attempt autosaves failed, will retry: {str(e)}")
+        return False
+
+    attempt_store.mark_flushed([(row['attempt_id'], row['seq']) for row in rows])
+    return len(rows) == batch_size
@@ -0,0 +1,474 @@
+"""
+Exam-surge benchmark.
+
+Seeds a fresh database with synthetic teachers, tests (some with images),
+students and historical results, starts `wsgi:app` and replays an exam:
+
+1. login storm      - every student logs in
+2. test fetch       - every student loads the exam test and its images
+3. submit burst     - submissions released in synchronized waves, as at a deadline
+4. teacher browsing - listings, paginated results, analytics and result details
+
+Latency percentiles and throughput are reported per phase and endpoint and
+written as JSON, which `compare` diffs between two runs (e.g. two commits).
+
+    python benchmarks/exam_surge.py run --output base.json
+    python benchmarks/exam_surge.py run --database-url postgresql://localhost/nano_bench --reset --output pg.json
+    python benchmarks/exam_surge.py run --server gunicorn --output sync.json
+    python benchmarks/exam_surge.py run --server gunicorn --gunicorn-profile gevent --output gevent.json
+    python benchmarks/exam_surge.py compare base.json head.json
+
+Run it from the backend directory. Any existing database is only touched when
+`--reset` is passed, and then all of its tables are dropped.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+# ==================== Environment ====================
+
+def configure_environment(args):
+    """Point the app at a scratch directory; must run before the app is imported"""
+    workdir = args.workdir or tempfile.mkdtemp(prefix='nano-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['IMAGE_STORE_DIR'] = os.path.join(workdir, 'images')
+    os.environ['SUBMISSION_SPOOL_PATH'] = os.path.join(workdir, 'submission_spool.db')
+    os.environ['CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    os.environ['SNAPSHOT_DIR'] = os.path.join(workdir, 'snapshots')
+    os.environ['ATTEMPT_STORE_PATH'] = os.path.join(workdir, 'attempt_store.db')
+    os.environ['SUBMISSION_INGEST_MODE'] = args.ingest_mode
+    os.environ.setdefault('JWT_SECRET_KEY', 'exam-surge-benchmark-secret-key-0000')
+    sys.path.insert(0, BACKEND_DIR)
+    return workdir
+
+
+# ==================== Seeding ====================
+
+def synthetic_image(rng):
+    return PNG_SIGNATURE + rng.randbytes(rng.randint(2048, 16384))
+
+
+def seed(args):
+    """Create the synthetic dataset; returns the exam test id"""
+    from sqlalchemy import insert
+    from werkzeug.security import generate_password_hash
+
+    from app import app, store_image, answer_keys
+    from models import db, Teacher, Student, Test, TestResult
+    from migrations import migrate
+    from question_bank import insert_questions
+    from item_stats import ensure_stats_rows
+    from submissions import build_result_values, record_scored
+
+    rng = random.Random(args.seed)
+    with app.app_context():
+        if args.reset:
+            db.drop_all(bind_key=None)
+            db.create_all(bind_key=None)
+            migrate(db)
+        elif db.session.query(Test.id).first() is not None:
+            sys.exit('Database already has tests; pass --reset to drop all tables first')
+
+        # Teacher 0 is the hardcoded demo login, so browsing sees its tests
+        teacher_ids = []
+        for i in range(args.teachers):
+            teacher = Teacher(teacher_id='nano123' if i == 0 else f'bench-teacher-{i}', name=f'Teacher {i}')
+            teacher.set_password('nano123' if i == 0 else PASSWORD)
+            db.session.add(teacher)
+            db.session.flush()
+            teacher_ids.append(teacher.id)
+
+        # Every student shares one hash: logins still pay the full verification cost
+        password_hash = generate_password_hash(PASSWORD)
+        db.session.execute(insert(Student), [
+            {'email': f'student{i}@bench.test', 'name': f'Student {i}', 'password_hash': password_hash,
+             'roll_number': str(i)}
+            for i in range(args.students)
+        ])
+        student_ids = [student_id for (student_id,) in db.session.query(Student.id).order_by(Student.id)]
+
+        test_ids = []
+        for teacher_id in teacher_ids:
+            for t in range(args.tests_per_teacher):
+                questions = []
+                for n in range(args.questions):
+                    image_hash = None
+                    if rng.random() < args.image_fraction:
+                        image_hash = store_image(synthetic_image(rng), raw=True)
+                    questions.append({
+                        'text': f'Question {n + 1}: ' + ' '.join(rng.choice(WORDS) for _ in range(20)),
+                        'optionA': 'Option A', 'optionB': 'Option B', 'optionC': 'Option C', 'optionD': 'Option D',
+                        'correct': rng.choice('ABCD'),
+                        'image_hash': image_hash
+                    })
+                test = Test(teacher_id=teacher_id, name=f'Bench test {teacher_id}-{t}', description='Synthetic',
+                            duration=60, passing_marks=40, question_count=len(questions))
+                db.session.add(test)
+                db.session.flush()
+                ensure_stats_rows(test.id, insert_questions(test.id, questions))
+                test_ids.append(test.id)
+        db.session.commit()
+
+        for test_id in test_ids:
+            key = answer_keys.get(test_id)
+            students = rng.sample(student_ids, min(args.results_per_test, len(student_ids)))
+            for start in range(0, len(students), 500):
+                rows, scored = [], []
+                for student_id in students[start:start + 500]:
+                    answers, status = random_answers(rng, key)
+                    values, score = build_result_values(key, student_id, answers, {}, status)
+                    rows.append(values)
+                    scored.append((key, score))
+                db.session.execute(insert(TestResult), rows)
+                record_scored(scored)
+                db.session.commit()
+
+        # The exam is the first test of the demo teacher
+        return test_ids[0]
+
+
+def random_answers(rng, key):
+    answers, status = {}, {}
+    for question_key in key.question_keys:
+        if rng.random() < 0.9:
+            answers[question_key] = rng.choice('ABCD')
+            status[question_key] = 'answered'
+    return answers, status
+
+
+WORDS = ('force', 'mass', 'energy', 'velocity', 'charge', 'field', 'atom', 'reaction', 'acid', 'base',
+         'matrix', 'vector', 'integral', 'limit', 'cell', 'enzyme', 'gene', 'orbit', 'wave', 'lens')
+
+
+# ==================== Server ====================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, workdir):
+    """Start wsgi:app and return (base_url, stop)"""
+    if args.url:
+        return args.url.rstrip('/'), lambda: None
+
+    port = free_port()
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f'127.0.0.1:{port}',
+                   '--pid', os.path.join(workdir, 'gunicorn.pid'),
+                   '--access-logfile', os.path.join(workdir, 'access.log'), 'wsgi:app']
+        if args.workers:
+            command[-1:-1] = ['--workers', str(args.workers)]
+        process = subprocess.Popen(
+            command, cwd=BACKEND_DIR, env=dict(os.environ, GUNICORN_PROFILE=args.gunicorn_profile),
+            stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, 'gunicorn.log'), 'w')
+        )
+        stop = process.terminate
+    else:
+        from werkzeug.serving import make_server
+        from wsgi import app
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No per-request log lines
+        server = make_server('127.0.0.1', port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stop = server.shutdown
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/api/health', timeout=2).read()
+            return base_url, stop
+        except OSError:
+            time.sleep(0.2)
+    stop()
+    sys.exit('Server did not become healthy within 60 seconds')
+
+
+# ==================== Load generation ====================
+
+class Recorder:
+    """Collects (endpoint, status, seconds) samples for the current phase"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def request(self, label, method, path, body=None, token=None):
+        headers = {'Accept-Encoding': 'gzip'}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        req = urllib.request.Request(self.base_url + path, data=data, method=method, headers=headers)
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                payload = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            payload, status = e.read(), e.code
+        except OSError:
+            payload, status = b'', 0
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.samples.append((label, status, elapsed))
+        if status and payload and response_is_json(payload):
+            return status, json.loads(payload)
+        return status, None
+
+
+def response_is_json(payload):
+    return payload[:1] in (b'{', b'[')
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples, wall_time):
+    by_label = {}
+    for label, status, elapsed in samples:
+        by_label.setdefault(label, []).append((status, elapsed))
+    summary = {}
+    for label, entries in sorted(by_label.items()):
+        latencies = sorted(elapsed * 1000 for _, elapsed in entries)
+        summary[label] = {
+            'count': len(entries),
+            'errors': sum(1 for status, _ in entries if not 200 <= status < 400),
+            'shed': sum(1 for status, _ in entries if status == 503),  # Rejected by admission control
+            'throughput_rps': round(len(entries) / wall_time, 2) if wall_time else None,
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2),
+        }
+    return summary
+
+
+def run_phase(name, base_url, concurrency, tasks, report):
+    """Run callables of one Recorder each across a thread pool and add the phase to the report"""
+    recorder = Recorder(base_url)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda task: task(recorder), tasks))
+    wall_time = time.perf_counter() - start
+    report['phases'][name] = {'wall_time_s': round(wall_time, 3), 'endpoints': summarize(recorder.samples, wall_time)}
+    print(f'{name}: {len(recorder.samples)} requests in {wall_time:.2f}s')
+    return results
+
+
+def exam_scenario(args, base_url, exam_test_id, report):
+    emails = [f'student{i}@bench.test' for i in range(args.students)]
+
+    def login(email):
+        def task(recorder):
+            _, body = recorder.request('POST /api/auth/student-login', 'POST', '/api/auth/student-login',
+                                       {'email': email, 'password': PASSWORD})
+            return body['access_token'] if body and 'access_token' in body else None
+        return task
+
+    tokens = [t for t in run_phase('login_storm', base_url, args.concurrency, [login(e) for e in emails], report) if t]
+    if not tokens:
+        sys.exit('No student could log in')
+
+    def fetch_test(token):
+        def task(recorder):
+            _, body = recorder.request('GET /api/tests/<id>', 'GET', f'/api/tests/{exam_test_id}', token=token)
+            if body and args.fetch_images:
+                for question in body.get('questions', []):
+                    if (question.get('image') or '').startswith('/api/images/'):
+                        recorder.request('GET /api/images/<hash>', 'GET', question['image'])
+            return body
+        return task
+
+    tests = run_phase('test_fetch', base_url, args.concurrency, [fetch_test(t) for t in tokens], report)
+    questions = next((t['questions'] for t in tests if t), [])
+    rng = random.Random(args.seed + 1)
+
+    # Release submissions in waves so each wave hits the server at the same instant
+    waves = [tokens[i:i + args.concurrency] for i in range(0, len(tokens), args.concurrency)]
+    barriers = [threading.Barrier(len(wave)) for wave in waves]
+
+    def submit(token, barrier):
+        answers = {str(q['id']): rng.choice('ABCD') for q in questions}
+
+        def task(recorder):
+            barrier.wait()
+            recorder.request('POST /api/results/submit', 'POST', '/api/results/submit', {
+                'test_id': exam_test_id,
+                'answers': answers,
+                'marked_for_review': {},
+                'question_status': {q_id: 'answered' for q_id in answers}
+            }, token=token)
+        return task
+
+    run_phase('submit_burst', base_url, args.concurrency,
+              [submit(token, barrier) for wave, barrier in zip(waves, barriers) for token in wave], report)
+
+    def browse(recorder):
+        _, body = recorder.request('POST /api/auth/teacher-login', 'POST', '/api/auth/teacher-login',
+                                   {'teacher_id': 'nano123', 'password': 'nano123'})
+        token = body['access_token']
+        _, tests = recorder.request('GET /api/tests', 'GET', '/api/tests', token=token)
+        for test in (tests or [])[:args.browse_tests]:
+            cursor, result_ids = None, []
+            while True:
+                path = f"/api/tests/{test['id']}/results?limit=100" + (f'&cursor={cursor}' if cursor else '')
+                _, page = recorder.request('GET /api/tests/<id>/results', 'GET', path, token=token)
+                if not page:
+                    break
+                result_ids.extend(r['id'] for r in page['results'])
+                cursor = page.get('next_cursor')
+                if not cursor:
+                    break
+            recorder.request('GET /api/tests/<id>/analytics', 'GET', f"/api/tests/{test['id']}/analytics", token=token)
+            for result_id in result_ids[:args.browse_results]:
+                recorder.request('GET /api/results/<id>', 'GET', f'/api/results/{result_id}', token=token)
+
+    run_phase('teacher_browsing', base_url, args.teacher_sessions, [browse] * args.teacher_sessions, report)
+
+
+# ==================== Commands ====================
+
+def git_revision():
+    try:
+        revision = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                           stderr=subprocess.DEVNULL, text=True).strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD'], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL) != 0
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = configure_environment(args)
+    started = time.perf_counter()
+    exam_test_id = seed(args)
+    print(f'Seeded in {time.perf_counter() - started:.1f}s ({workdir})')
+
+    base_url, stop = start_server(args, workdir)
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat(),
+            'database': os.environ['DATABASE_URL'].split(':', 1)[0],
+            'server': 'external' if args.url else args.server,
+            'workers': args.workers if args.server == 'gunicorn' else 1,
+            'gunicorn_profile': args.gunicorn_profile if args.server == 'gunicorn' else None,
+            'ingest_mode': args.ingest_mode,
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'scale': {name: getattr(args, name) for name in (
+                'teachers', 'tests_per_teacher', 'questions', 'image_fraction', 'students',
+                'results_per_test', 'concurrency', 'teacher_sessions', 'seed')}
+        },
+        'phases': {}
+    }
+    try:
+        exam_scenario(args, base_url, exam_test_id, report)
+    finally:
+        stop()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f'Wrote {args.output}')
+    else:
+        print(output)
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"base: {base['meta'].get('revision')} ({base['meta'].get('database')})   "
+          f"head: {head['meta'].get('revision')} ({head['meta'].get('database')})")
+    print(f"{'phase / endpoint':<52} {'metric':<15} {'base':>10} {'head':>10} {'change':>9}")
+    for phase, phase_data in head['phases'].items():
+        base_endpoints = base['phases'].get(phase, {}).get('endpoints', {})
+        for endpoint, stats in phase_data['endpoints'].items():
+            before = base_endpoints.get(endpoint)
+            if before is None:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'errors', 'shed'):
+                old, new = before.get(metric), stats.get(metric)
+                if old is None or new is None:
+                    continue  # Reports from before the metric existed
+                change = f'{(new - old) / old * 100:+.1f}%' if old else ''
+                print(f'{phase + " " + endpoint:<52} {metric:<15} {old:>10} {new:>10} {change:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='Seed a database and run the exam scenario')
+    run_parser.add_argument('--database-url', help='Defaults to a fresh SQLite file in the work directory')
+    run_parser.add_argument('--reset', action='store_true', help='Drop all tables of --database-url first')
+    run_parser.add_argument('--workdir', help='Scratch directory for images, caches and the SQLite file')
+    run_parser.add_argument('--server', choices=('werkzeug', 'gunicorn'), default='werkzeug')
+    run_parser.add_argument('--workers', type=int, help='Gunicorn workers (default: from gunicorn_config.py)')
+    run_parser.add_argument('--gunicorn-profile', choices=('sync', 'gevent'), default='sync',
+                            help='GUNICORN_PROFILE for --server gunicorn')
+    run_parser.add_argument('--url', help='Benchmark an already running server that uses --database-url')
+    run_parser.add_argument('--ingest-mode', choices=('direct', 'spool'), default='direct')
+    run_parser.add_argument('--teachers', type=int, default=3)
+    run_parser.add_argument('--tests-per-teacher', type=int, default=3)
+    run_parser.add_argument('--questions', type=int, default=50)
+    run_parser.add_argument('--image-fraction', type=float, default=0.2)
+    run_parser.add_argument('--students', type=int, default=200)
+    run_parser.add_argument('--results-per-test', type=int, default=200)
+    run_parser.add_argument('--concurrency', type=int, default=32)
+    run_parser.add_argument('--teacher-sessions', type=int, default=4)
+    run_parser.add_argument('--browse-tests', type=int, default=3, help='Tests whose results each teacher browses')
+    run_parser.add_argument('--browse-results', type=int, default=20, help='Result details opened per test')
+    run_parser.add_argument('--no-images', dest='fetch_images', action='store_false',
+                            help='Do not fetch question images with the test')
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='Compare two JSON reports')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Worker boot benchmark.
+
+Starts gunicorn with `gunicorn_config.py` against a scratch SQLite database,
+with and without `preload_app`, and measures how quickly the server can take
+traffic:
+
+- master ready  - process start until `/api/health` first answers
+- all workers   - process start until every worker has logged "booted in"
+- worker boot   - fork until the worker accepts requests, per worker (from the log)
+- scale out     - boot time of one extra worker added with SIGTTIN, as when
+                  gunicorn replaces a crashed worker in the middle of an exam
+
+    python benchmarks/worker_boot.py --output boot.json
+    python benchmarks/worker_boot.py --workers 8 --runs 5 --modes preload
+
+Run it from the backend directory.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOOTED = re.compile(r'Worker (\d+) booted in ([0-9.]+)s')
+MODES = {'preload': 'true', 'no-preload': 'false'}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def scratch_environment(workdir):
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'boot.db')}",
+        'IMAGE_STORE_DIR': os.path.join(workdir, 'images'),
+        'SUBMISSION_SPOOL_PATH': os.path.join(workdir, 'submission_spool.db'),
+        'ATTEMPT_STORE_PATH': os.path.join(workdir, 'attempt_store.db'),
+        'CACHE_DIR': os.path.join(workdir, 'cache'),
+        'METRICS_DIR': os.path.join(workdir, 'metrics'),
+        'SNAPSHOT_DIR': os.path.join(workdir, 'snapshots'),
+    })
+    env.pop('SCHEMA_SETUP', None)  # Let gunicorn_config.py pick it for the mode
+    return env
+
+
+def booted_workers(log_path):
+    with open(log_path) as f:
+        return {int(pid): float(seconds) for pid, seconds in BOOTED.findall(f.read())}
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        value = condition()
+        if value:
+            return value
+        time.sleep(0.01)
+    raise TimeoutError('Server did not get ready in time')
+
+
+def healthy(base_url):
+    try:
+        urllib.request.urlopen(base_url + '/api/health', timeout=1).read()
+        return True
+    except OSError:
+        return False
+
+
+def boot_once(mode, workers, workdir):
+    """Start gunicorn once and return the timings of this boot"""
+    port = free_port()
+    log_path = os.path.join(workdir, f'gunicorn-{mode}.log')
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    env = dict(scratch_environment(workdir), GUNICORN_PRELOAD=MODES[mode], WEB_CONCURRENCY=str(workers))
+    started = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f'127.0.0.1:{port}',
+         '--pid', os.path.join(workdir, 'gunicorn.pid'), '--error-logfile', log_path, 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for(lambda: healthy(f'http://127.0.0.1:{port}'), 60)
+        first_response = time.monotonic() - started
+        boots = wait_for(lambda: len(booted_workers(log_path)) >= workers and booted_workers(log_path), 60)
+        all_workers = time.monotonic() - started
+
+        process.send_signal(signal.SIGTTIN)
+        grown = wait_for(lambda: len(booted_workers(log_path)) > workers and booted_workers(log_path), 60)
+        scale_out = next(seconds for pid, seconds in grown.items() if pid not in boots)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    return {
+        'first_response_s': first_response,
+        'all_workers_s': all_workers,
+        'worker_boot_s': sorted(boots.values()),
+        'scale_out_s': scale_out,
+    }
+
+
+def summarize(runs):
+    boots = [seconds for run in runs for seconds in run['worker_boot_s']]
+    return {
+        'runs': len(runs),
+        'first_response_ms': round(statistics.median(run['first_response_s'] for run in runs) * 1000, 1),
+        'all_workers_ms': round(statistics.median(run['all_workers_s'] for run in runs) * 1000, 1),
+        'worker_boot_p50_ms': round(statistics.median(boots) * 1000, 1),
+        'worker_boot_max_ms': round(max(boots) * 1000, 1),
+        'scale_out_ms': round(statistics.median(run['scale_out_s'] for run in runs) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=3, help='Boots per mode; medians are reported')
+    parser.add_argument('--modes', nargs='+', choices=sorted(MODES), default=['no-preload', 'preload'])
+    parser.add_argument('--workdir', help='Scratch directory (default: a new temporary directory)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='nano-boot-')
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'workers': args.workers,
+        },
+        'modes': {}
+    }
+    for mode in args.modes:
+        # The first boot of each mode also creates or checks the schema of the shared scratch database
+        runs = [boot_once(mode, args.workers, workdir) for _ in range(args.runs)]
+        report['modes'][mode] = summarize(runs)
+        print(f"{mode:<12} " + '  '.join(f'{k}={v}' for k, v in report['modes'][mode].items()), file=sys.stderr)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f'Wrote {args.output}')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
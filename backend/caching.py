@@ -0,0 +1,23 @@
+"""
+Response caching for test listings.
+
+Uses Flask-Caching with a pluggable backend chosen by CACHE_TYPE. The default
+FileSystemCache is shared by every gunicorn worker on the host, so an
+invalidation in one worker is seen by all of them; SimpleCache keeps entries
+in process and suits a single worker or local development.
+"""
+
+from flask_caching import Cache
+
+cache = Cache()
+
+ACTIVE_TESTS_KEY = 'tests:active'
+
+
+def teacher_tests_key(teacher_id):
+    return f'tests:teacher:{teacher_id}'
+
+
+def invalidate_test_listings(teacher_id):
+    """Drop the cached listings a change to one of this teacher's tests can affect"""
+    cache.delete_many(teacher_tests_key(teacher_id), ACTIVE_TESTS_KEY)
@@ -0,0 +1,207 @@
+"""
+Optional read replicas.
+
+Every URL in DATABASE_REPLICA_URLS becomes a Flask-SQLAlchemy bind named
+`replica_0`, `replica_1`, ... Views decorated with `@replica_reads` send
+their SELECTs to one replica per request, picked round-robin among replicas
+whose last health check passed. Everything else, every write and every read
+that follows a write in the same request, goes to the primary.
+
+After a successful write request the caller's JWT identity is pinned to the
+primary for DB_REPLICA_STICKY_SECONDS through the shared cache, so a student
+opening a result straight after submitting never reads from a replica that
+has not caught up yet.
+
+Views that lazily build missing rows (summaries, statistics) call
+`use_primary()` first, so the rebuild reads its source rows from the primary
+and commits there rather than trusting a replica that may lag behind.
+"""
+
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_app_context, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+from caching import cache
+
+REPLICA_PREFIX = 'replica_'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+_POOL_SETTINGS = {
+    'POOL_SIZE': ('pool_size', int),
+    'MAX_OVERFLOW': ('max_overflow', int),
+    'POOL_RECYCLE': ('pool_recycle', int),
+    'POOL_TIMEOUT': ('pool_timeout', float),
+}
+
+
+def pool_options(environ, prefix, fallback_prefix=None):
+    """Engine pool options from e.g. DB_POOL_SIZE; unset values keep SQLAlchemy's defaults"""
+    options = {}
+    for name, (option, convert) in _POOL_SETTINGS.items():
+        value = environ.get(prefix + name)
+        if value is None and fallback_prefix:
+            value = environ.get(fallback_prefix + name)
+        if value is not None:
+            options[option] = convert(value)
+    return options
+
+
+def replica_binds(urls, options):
+    """SQLALCHEMY_BINDS entries for a comma-separated list of replica URLs"""
+    urls = [url.strip() for url in (urls or '').split(',') if url.strip()]
+    return {f'{REPLICA_PREFIX}{i}': {'url': url, 'pool_pre_ping': True, **options} for i, url in enumerate(urls)}
+
+
+def enforce_foreign_keys(engine):
+    """SQLite ignores foreign keys (and ON DELETE CASCADE) unless each connection turns them on"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys = ON')
+        cursor.close()
+
+
+class RoutingSession(Session):
+    """Session that sends reads of replica-enabled requests to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self.info.get('wrote'):
+            if self._flushing or isinstance(clause, (UpdateBase, TextClause)):
+                # Later reads in this session must see the write
+                self.info['wrote'] = True
+            elif has_app_context() and g.get('read_replica'):
+                engine = self._replica_engine()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica_engine(self):
+        router = current_app.extensions['db_router']
+        key = self.info.get('replica')
+        if key is None:
+            key = router.choose()
+            if key is None:
+                g.read_replica = False  # No healthy replica; stay on the primary
+                return None
+            self.info['replica'] = key
+        return router.engines[key]
+
+
+class ReplicaRouter:
+    """Round-robin replica choice with cached health checks"""
+
+    def __init__(self, check_interval=5.0, retry_after=30.0, sticky_seconds=30):
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.sticky_seconds = sticky_seconds
+        self.engines = {}
+        self._order = itertools.count()
+        self._checked = {}
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    def init_app(self, app, db):
+        app.extensions['db_router'] = self
+        keys = sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {})
+                      if isinstance(key, str) and key.startswith(REPLICA_PREFIX))
+        with app.app_context():
+            self.engines = {key: db.engines[key] for key in keys}
+        for key, engine in self.engines.items():
+            event.listen(engine, 'handle_error', self._error_listener(key))
+        if self.enabled:
+            app.after_request(self._pin_writer)
+
+    def choose(self):
+        """Bind key of the next healthy replica, or None"""
+        keys = list(self.engines)
+        start = next(self._order)
+        for i in range(len(keys)):
+            key = keys[(start + i) % len(keys)]
+            if self._healthy(key):
+                return key
+        return None
+
+    def _healthy(self, key):
+        now = time.monotonic()
+        if now < self._down_until.get(key, 0):
+            return False
+        if now - self._checked.get(key, 0) < self.check_interval:
+            return True
+        with self._lock:
+            if now - self._checked.get(key, 0) < self.check_interval:
+                return now >= self._down_until.get(key, 0)
+            self._checked[key] = now
+            try:
+                with self.engines[key].connect() as conn:
+                    conn.execute(text('SELECT 1'))
+            except DBAPIError as e:
+                self.mark_down(key, e)
+                return False
+        return True
+
+    def mark_down(self, key, error=None):
+        self._down_until[key] = time.monotonic() + self.retry_after
+        print(f"[ERROR] Replica {key} unavailable for {self.retry_after:.0f}s: {error}")
+
+    def _error_listener(self, key):
+        def handle_error(context):
+            if context.is_disconnect:
+                self.mark_down(key, context.original_exception)
+        return handle_error
+
+    # ---- Read-your-writes ----
+
+    @staticmethod
+    def _identity():
+        try:
+            verify_jwt_in_request(optional=True)
+            return get_jwt().get('sub')
+        except Exception:
+            return None  # Missing or invalid token: nothing to pin
+
+    @staticmethod
+    def _pin_key(identity):
+        return f'db:primary-pin:{identity}'
+
+    def is_pinned(self):
+        identity = self._identity()
+        return identity is not None and cache.get(self._pin_key(identity)) is not None
+
+    def _pin_writer(self, response):
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            identity = self._identity()
+            if identity is not None:
+                cache.set(self._pin_key(identity), 1, timeout=self.sticky_seconds)
+        return response
+
+
+def use_primary():
+    """Send the rest of this request's statements to the primary, e.g. before a lazy rebuild that writes"""
+    if has_app_context():
+        g.read_replica = False
+
+
+def replica_reads(view):
+    """Allow the view's reads to go to a replica unless the caller wrote recently"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        router = current_app.extensions.get('db_router')
+        if router is not None and router.enabled and not router.is_pinned():
+            g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,98 @@
+"""
+Set-based deletion of tests and everything that belongs to them.
+
+Nothing here loads rows into the session: each table is cleared with one
+DELETE statement, except results, which are deleted in chunks of
+PURGE_CHUNK_SIZE with a commit after each chunk. No single transaction holds
+locks on every result row of a large test, and a purge job reports progress
+after every chunk.
+
+The foreign keys to tests carry ON DELETE CASCADE as a backstop. The child
+tables are still cleared explicitly, because SQLite databases created before
+the cascades keep their old constraints.
+
+A test with more than PURGE_SYNC_MAX_RESULTS results is first soft-deleted
+(`deleted_at` is set, which hides it everywhere) and then purged by a
+background job.
+"""
+
+import os
+from datetime import datetime
+
+from sqlalchemy import func
+
+from models import db, Test, Question, TestResult, TestStats, QuestionStats, ScoreBucket, AttemptSession
+from student_summaries import drop_test_summaries
+
+
+def purge_chunk_size():
+    return int(os.getenv('PURGE_CHUNK_SIZE', 1000))
+
+
+def sync_delete_limit():
+    return int(os.getenv('PURGE_SYNC_MAX_RESULTS', 2000))
+
+
+def count_results(test_id):
+    return db.session.query(func.count(TestResult.id)).filter(TestResult.test_id == test_id).scalar()
+
+
+def soft_delete_test(test):
+    """Hide a test and stop new attempts at it; its rows stay until purge_test runs"""
+    test.deleted_at = datetime.utcnow()
+    AttemptSession.query.filter_by(test_id=test.id).delete(synchronize_session=False)
+    # Summaries are rebuilt without results of deleted tests on their next read
+    drop_test_summaries(test.id)
+
+
+def delete_results(test_id, chunk_size):
+    """Delete one chunk of a test's results in the caller's transaction; returns the number deleted"""
+    ids = [result_id for (result_id,) in db.session.query(TestResult.id)
+           .filter(TestResult.test_id == test_id)
+           .order_by(TestResult.id)
+           .limit(chunk_size)]
+    if ids:
+        TestResult.query.filter(TestResult.id.in_(ids)).delete(synchronize_session=False)
+    return len(ids)
+
+
+def delete_test_rows(test_id):
+    """Delete a test whose results are gone, with its questions and statistics, in the caller's transaction"""
+    AttemptSession.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    QuestionStats.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    ScoreBucket.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    TestStats.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    Question.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    Test.query.filter_by(id=test_id).delete(synchronize_session=False)
+
+
+def delete_test_now(test):
+    """Delete a small test in the request: one statement per table and a single commit"""
+    test_id = test.id
+    drop_test_summaries(test_id)
+    AttemptSession.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    TestResult.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    delete_test_rows(test_id)
+    db.session.commit()
+
+
+def purge_test(job, test_id):
+    """Job body (job may be None): delete a soft-deleted test's results chunk by chunk, then the test itself"""
+    chunk_size = purge_chunk_size()
+    deleted = 0
+    while True:
+        count = delete_results(test_id, chunk_size)
+        if not count:
+            break
+        deleted += count
+        if job is not None:
+            job.processed = deleted
+        db.session.commit()
+    delete_test_rows(test_id)
+    db.session.commit()
+    return {'test_id': test_id, 'results_deleted': deleted}
+
+
+def deleted_test_ids():
+    """Soft-deleted tests whose purge has not finished, e.g. because the worker running it restarted"""
+    return [test_id for (test_id,) in db.session.query(Test.id).filter(Test.deleted_at.isnot(None)).order_by(Test.id)]
@@ -1,18 +1,58 @@
 # Gunicorn Configuration for Production
 # Usage: gunicorn -c gunicorn_config.py wsgi:app
+#
+# GUNICORN_PROFILE selects the worker model:
+#   sync   - one request at a time per worker, (2 * CPU) + 1 workers (default)
+#   gevent - CPU + 1 workers, each serving up to GUNICORN_WORKER_CONNECTIONS requests
+#            concurrently while they wait on the database; needs requirements-gevent.txt
 
-import multiprocessing
 import os
 
+PROFILE = os.getenv('GUNICORN_PROFILE', 'sync')
+if PROFILE not in ('sync', 'gevent'):
+    raise RuntimeError(f"GUNICORN_PROFILE must be 'sync' or 'gevent', not {PROFILE!r}")
+
+if PROFILE == 'gevent':
+    # Patch before anything imports socket, threading or psycopg2, so the app and its
+    # connection pool only ever see cooperative versions of them
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+import multiprocessing
+import time
+
 # Server Socket
-bind = "0.0.0.0:5000"
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"  # PaaS hosts (Render, Heroku) assign PORT
 backlog = 2048
 
 # Worker Processes
-workers = multiprocessing.cpu_count() * 2 + 1  # Formula: (2 * CPU) + 1
-worker_class = "sync"  # For CPU-bound: use "sync", for I/O-bound: use "gevent"
-worker_connections = 1000
+if PROFILE == 'gevent':
+    workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() + 1))
+    worker_class = "gevent"
+else:
+    workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))  # Formula: (2 * CPU) + 1
+    worker_class = "sync"
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
 timeout = 30
+
+# Database pool per worker. A sync worker needs one connection; a gevent worker can have
+# worker_connections requests in flight, so its pool is capped by the connections the
+# database allows (DB_MAX_CONNECTIONS shared by all workers) and greenlets queue for it.
+if PROFILE == 'gevent':
+    os.environ.setdefault('DB_POOL_SIZE', str(max(1, min(
+        worker_connections, int(os.getenv('DB_MAX_CONNECTIONS', 100)) // workers
+    ))))
+    os.environ.setdefault('DB_MAX_OVERFLOW', '0')
+    os.environ.setdefault('DB_POOL_TIMEOUT', '30')
+
+# Admission control (admission.py): requests a worker handles at once before shedding the
+# lower priorities with 503. A sync worker only ever handles one, so there its limits are the
+# X-Request-Start queue time and the token buckets; a gevent worker admits a few more requests
+# than it has connections so the pool stays busy while responses are serialized.
+if PROFILE == 'gevent':
+    os.environ.setdefault('ADMISSION_MAX_CONCURRENT', str(int(os.environ['DB_POOL_SIZE']) * 2))
 keepalive = 2
 
 # Logging
@@ -26,7 +66,7 @@ proc_name = "nano_test_platform"
 
 # Server Mechanics
 daemon = False
-pidfile = "/var/run/nano_test_platform.pid"
+pidfile = os.getenv('GUNICORN_PIDFILE')  # e.g. /var/run/nano_test_platform.pid; not writable on most PaaS hosts
 umask = 0
 user = None
 group = None
@@ -40,15 +80,49 @@ ssl_version = None
 # Application
 pythonpath = None
 raw_env = []
+# The master imports the app once (static files compressed, schema checked) and forks workers
+# that share it, instead of every worker importing and checking the schema on its own.
+# Preloaded code is not reloaded by HUP; restart the master to deploy.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+os.environ.setdefault('SCHEMA_SETUP', 'master' if preload_app else 'import')
 
 # Server Hooks
 def on_starting(server):
     print("Nano Test Platform Server Starting...")
+    if os.environ['SCHEMA_SETUP'] == 'master':
+        from app import prepare_database  # Already imported when preload_app is on
+        started = time.monotonic()
+        prepare_database()
+        server.log.info("Schema ready in %.2fs", time.monotonic() - started)
+
+def pre_fork(server, worker):
+    worker.boot_started = time.monotonic()  # Copied into the forked worker
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import reset_after_fork
+        reset_after_fork()
+
+def post_worker_init(worker):
+    # Fork to ready to accept requests, including the app import when it is not preloaded
+    worker.log.info("Worker %s booted in %.3fs", worker.pid, time.monotonic() - worker.boot_started)
+
+def worker_exit(server, worker):
+    # Snapshots are written at most once a second; save the last requests before exiting
+    from app import metrics
+    metrics.write_snapshot()
+
+def child_exit(server, worker):
+    # Keep the exited worker's metric totals but stop listing it (see metrics.py)
+    from metrics import retire_worker
+    metrics_dir = os.getenv('METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+    if os.path.isdir(metrics_dir):
+        retire_worker(metrics_dir, worker.pid)
 
 def when_ready(server):
     print("Nano Test Platform Server Ready!")
-    print(f"Listening on http://0.0.0.0:5000")
-    print(f"Workers: {server.num_workers}")
+    print(f"Listening on http://{bind}")
+    print(f"Workers: {server.num_workers} ({PROFILE})")
 
 def on_exit(server):
     print("Nano Test Platform Server Shutting Down...")
@@ -0,0 +1,220 @@
+"""
+Content-addressed storage for question images.
+
+Images arrive from the teacher dashboard as base64 data URLs. They are decoded
+once at upload time and written to disk under their SHA-256 hash, so the same
+diagram used across several tests is stored (and cached by browsers) once.
+
+Only PNG, JPEG, WebP and GIF images are accepted, and the type is detected
+from the bytes, never taken from the data URL: images are served from the
+app's own origin, so anything a browser could render as a document (HTML,
+SVG) must never be stored.
+
+Originals are served to students as uploaded, so EXIF, XMP and text metadata
+(camera details, GPS position) are stripped before an image is stored: the
+EXIF orientation is applied and the image re-encoded in its own format.
+Images without metadata are stored byte for byte.
+"""
+
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image as PILImage, ImageOps, ImageSequence
+except ImportError:  # pragma: no cover - Pillow is optional; types are then detected from magic bytes
+    PILImage = None
+
+# Pillow format name -> MIME type of the image types that may be stored and served
+ALLOWED_FORMATS = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+}
+ALLOWED_MIME_TYPES = frozenset(ALLOWED_FORMATS.values())
+
+# Magic-byte signatures used when Pillow is not installed
+_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'RIFF', 'image/webp'),
+]
+
+# Image.info entries that describe how to render an image rather than where it came from
+RENDERING_INFO = frozenset({
+    'icc_profile', 'dpi', 'transparency', 'gamma', 'srgb', 'chromaticity', 'aspect', 'background',
+    'duration', 'loop', 'version', 'extension', 'timestamp', 'disposal', 'blend', 'bbox',
+    'jfif', 'jfif_version', 'jfif_unit', 'jfif_density', 'adobe', 'adobe_transform',
+    'progressive', 'progression', 'interlace',
+})
+# Re-encoding options per format; JPEG and lossy WebP are re-encoded at high quality
+_SAVE_OPTIONS = {
+    'PNG': {'optimize': True},
+    'JPEG': {'quality': 95},
+    'WEBP': {'quality': 95, 'method': 4},
+    'GIF': {},
+}
+
+_DATA_URL_RE = re.compile(r'^data:[^;,]*(?:;[\w-]+=[^;,]*)*;base64,', re.IGNORECASE)
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class InvalidImageError(ValueError):
+    """Raised when an uploaded image cannot be decoded"""
+
+
+def sniff_mime_type(data):
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            if mime_type == 'image/webp' and data[8:12] != b'WEBP':
+                continue
+            return mime_type
+    return None
+
+
+def detect_image_type(data):
+    """MIME type of a PNG, JPEG, WebP or GIF image; raises InvalidImageError for anything else"""
+    if not data:
+        raise InvalidImageError('Image is empty')
+    if PILImage is None:
+        mime_type = sniff_mime_type(data)
+    else:
+        try:
+            with PILImage.open(io.BytesIO(data)) as image:
+                mime_type = ALLOWED_FORMATS.get(image.format)
+                if mime_type:
+                    image.verify()
+        except Exception:
+            mime_type = None
+    if mime_type not in ALLOWED_MIME_TYPES:
+        raise InvalidImageError('Image must be a PNG, JPEG, WebP or GIF file')
+    return mime_type
+
+
+def strip_metadata(data):
+    """Image bytes without EXIF, XMP or text metadata, upright; unchanged when there is nothing to drop"""
+    if PILImage is None:
+        return data
+    try:
+        return _strip_metadata(data)
+    except Exception:
+        raise InvalidImageError('Image could not be decoded')
+
+
+def _strip_metadata(data):
+    with PILImage.open(io.BytesIO(data)) as image:
+        image_format = image.format
+        if image_format not in _SAVE_OPTIONS or not (set(image.info) - RENDERING_INFO or image.getexif()):
+            return data
+        animated = getattr(image, 'is_animated', False)
+        options = dict(_SAVE_OPTIONS[image_format])
+        if animated:
+            # Frames are saved as they are; orientation tags on animations are rare and not applied
+            durations = []
+            for frame in ImageSequence.Iterator(image):
+                frame.load()  # WebP frames read their duration on load
+                durations.append(frame.info.get('duration', 0))
+            image.seek(0)
+            options.update(save_all=True, duration=durations)
+            if 'loop' in image.info:
+                options['loop'] = image.info['loop']
+        else:
+            image = ImageOps.exif_transpose(image)
+        for key in ('icc_profile', 'transparency', 'dpi'):
+            if key in image.info and not (key == 'transparency' and image_format == 'JPEG'):
+                options[key] = image.info[key]
+        # The encoders write EXIF, XMP and comments they find in info; keep only what was chosen above
+        image.info = {}
+        out = io.BytesIO()
+        image.save(out, image_format, **options)
+        return out.getvalue()
+
+
+def decode_image(value):
+    """Decode a base64 string or data URL into (bytes, mime_type); the type is detected from the bytes"""
+    value = value.strip()
+    match = _DATA_URL_RE.match(value)
+    if match:
+        value = value[match.end():]
+    try:
+        data = base64.b64decode(''.join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        raise InvalidImageError('Image is not valid base64 data')
+    return data, detect_image_type(data)
+
+
+def is_image_hash(value):
+    return bool(value) and bool(_HASH_RE.match(value))
+
+
+class ImageStore:
+    """Stores image bytes on disk at <root>/<hash[:2]>/<hash>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, image_hash):
+        return os.path.join(self.root, image_hash[:2], image_hash)
+
+    def exists(self, image_hash):
+        return os.path.exists(self.path_for(image_hash))
+
+    def put(self, data):
+        """Write bytes to the store and return their hash; identical content is written once"""
+        image_hash, tmp_path = self.stage(data)
+        if tmp_path is not None:
+            self.publish([(image_hash, tmp_path)])
+        return image_hash
+
+    def stage(self, data):
+        """
+        Write bytes to a temporary file beside their final path, to be published or discarded later.
+
+        Returns (hash, temporary path), with a path of None when the content is already stored.
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        path = self.path_for(image_hash)
+        if os.path.exists(path):
+            return image_hash, None
+        return image_hash, self._write_temp(os.path.dirname(path), data)
+
+    def publish(self, staged):
+        """Move staged (hash, temporary path) pairs into place; readers never see a partial blob"""
+        for image_hash, tmp_path in staged:
+            os.replace(tmp_path, self.path_for(image_hash))
+
+    def discard(self, staged):
+        """Remove staged files that will not be published"""
+        for _, tmp_path in staged:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def rewrite(self, image_hash, data):
+        """Replace a stored blob in place, keeping the hash it is referenced by"""
+        path = self.path_for(image_hash)
+        os.replace(self._write_temp(os.path.dirname(path), data), path)
+
+    @staticmethod
+    def _write_temp(directory, data):
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def read(self, image_hash):
+        with open(self.path_for(image_hash), 'rb') as f:
+            return f.read()
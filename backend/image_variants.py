@@ -0,0 +1,147 @@
+"""
+Downscaled WebP variants of question images.
+
+Teachers upload photos straight from their phones. After a test is saved, a
+background job sends each new image to a process pool. The pool applies the
+EXIF orientation, drops EXIF and XMP metadata (camera details, GPS position)
+and encodes WebP copies at the widths in IMAGE_VARIANT_WIDTHS, never wider
+than the original. Variants are stored in the image store like any other
+image and listed in `image_variants`, and question payloads carry them as
+`image_srcset` so each client downloads only the width it displays.
+
+Animated images are left as uploaded. The image store
+deduplicates by hash, so an image shared between tests is transcoded once.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from models import db, Image, ImageVariant, Question
+
+try:
+    from PIL import Image as PILImage, ImageOps
+except ImportError:  # pragma: no cover - Pillow is optional; images are then served as uploaded
+    PILImage = None
+
+VARIANT_MIME_TYPE = 'image/webp'
+# Formats Pillow can decode and that are worth re-encoding
+TRANSCODABLE_TYPES = ('image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/bmp', 'image/tiff')
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def variant_widths():
+    return sorted({int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640,1280').split(',') if w.strip()})
+
+
+def _pool_size():
+    return int(os.getenv('IMAGE_TRANSCODE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+
+def get_transcode_pool():
+    """Process pool for transcoding, created lazily in each worker process"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A pool whose process died (e.g. killed while decoding a huge image) cannot be reused
+        if _pool is None or _pool_pid != os.getpid() or getattr(_pool, '_broken', False):
+            # spawn, not fork: the worker process has threads and open database connections
+            _pool = ProcessPoolExecutor(max_workers=_pool_size(), mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def target_widths(original_width, widths):
+    """Requested widths narrower than the original, plus one at (up to) full size"""
+    return sorted({w for w in widths if w < original_width} | {min(original_width, max(widths))})
+
+
+def transcode(data, widths, quality=80):
+    """Return [(width, height, webp bytes)] for an encoded image; runs in the pool"""
+    with PILImage.open(io.BytesIO(data)) as image:
+        if getattr(image, 'is_animated', False):
+            return []
+        icc_profile = image.info.get('icc_profile')
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        variants = []
+        for width in target_widths(image.width, widths):
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), PILImage.LANCZOS)
+            out = io.BytesIO()
+            # Only the colour profile is carried over; EXIF and XMP are not written
+            resized.save(out, 'WEBP', quality=quality, method=4, icc_profile=icc_profile or None)
+            variants.append((width, height, out.getvalue()))
+        return variants
+
+
+def pending_images(image_hashes, force=False):
+    """Hashes among image_hashes that are transcodable and have no variants yet"""
+    query = db.session.query(Image.hash).filter(Image.hash.in_(set(image_hashes)),
+                                                Image.mime_type.in_(TRANSCODABLE_TYPES))
+    if not force:
+        query = query.filter(~db.session.query(ImageVariant.image_hash)
+                             .filter(ImageVariant.image_hash == Image.hash).exists())
+    return [image_hash for (image_hash,) in query]
+
+
+def transcode_images(image_store, image_hashes, job=None, force=False):
+    """
+    Create variants for images in the store; returns (transcoded hashes, errors).
+
+    With `force`, images that already have variants are transcoded again, for
+    example after IMAGE_VARIANT_WIDTHS changed. Progress is recorded on `job`.
+    """
+    if PILImage is None:
+        print("[ERROR] Pillow is not installed, question images are served as uploaded")
+        return [], []
+
+    pending = pending_images(image_hashes, force)
+    if job is not None:
+        job.total = len(pending)
+        db.session.commit()
+    widths = variant_widths()
+    quality = int(os.getenv('IMAGE_VARIANT_QUALITY', 80))
+    pool = get_transcode_pool()
+    futures = {pool.submit(transcode, image_store.read(image_hash), widths, quality): image_hash
+               for image_hash in pending}
+
+    transcoded = []
+    errors = []
+    for future in as_completed(futures):
+        image_hash = futures[future]
+        try:
+            variants = future.result()
+        except Exception as e:
+            errors.append({'image_hash': image_hash, 'message': f'Could not transcode image: {e}'})
+            variants = None
+
+        if variants:
+            ImageVariant.query.filter_by(image_hash=image_hash).delete(synchronize_session=False)
+            for width, height, data in variants:
+                variant_hash = image_store.put(data)
+                if db.session.get(Image, variant_hash) is None:
+                    db.session.add(Image(hash=variant_hash, mime_type=VARIANT_MIME_TYPE, size=len(data)))
+                db.session.add(ImageVariant(image_hash=image_hash, width=width, height=height,
+                                            variant_hash=variant_hash))
+            transcoded.append(image_hash)
+        if job is not None:
+            job.processed = (job.processed or 0) + 1
+        db.session.commit()
+    return transcoded, errors
+
+
+def tests_using_images(image_hashes):
+    """Ids of tests with a question showing one of the images"""
+    if not image_hashes:
+        return []
+    return [test_id for (test_id,) in db.session.query(Question.test_id)
+            .filter(Question.image_hash.in_(set(image_hashes)))
+            .distinct()]
@@ -0,0 +1,183 @@
+"""
+Incrementally maintained item-analysis statistics.
+
+Every scored submission adds its per-question outcomes to `question_stats`
+and its marks to `test_stats` with `column = column + delta` updates, in the
+same transaction as the result row. Reading the analytics for a test is then
+O(questions) no matter how many results exist.
+
+Difficulty is the percentage of attempts answered correctly. Discrimination
+is the point-biserial correlation between answering the question correctly
+and the total marks, which can be derived from running sums alone.
+"""
+
+import math
+
+from sqlalchemy import bindparam, update
+
+from models import db, Question, TestResult, TestStats, QuestionStats, ScoreBucket, OPTION_CODES, packed_responses
+from answer_keys import encode_responses
+from rankings import record_scores
+
+_CHOICE_COLUMNS = {
+    OPTION_CODES['A']: 'choice_a',
+    OPTION_CODES['B']: 'choice_b',
+    OPTION_CODES['C']: 'choice_c',
+    OPTION_CODES['D']: 'choice_d',
+}
+_COUNTER_COLUMNS = ['correct_count', 'wrong_count', 'unanswered_count', *_CHOICE_COLUMNS.values(), 'correct_score_sum']
+
+
+def _question_deltas(key, scored):
+    """Aggregate (responses, marks) pairs into one delta row per question"""
+    deltas = [dict.fromkeys(_COUNTER_COLUMNS, 0) for _ in range(len(key))]
+    for responses, marks in scored:
+        for i, (response, correct) in enumerate(zip(responses, key.correct)):
+            delta = deltas[i]
+            if response == 0:
+                delta['unanswered_count'] += 1
+                continue
+            if response == correct:
+                delta['correct_count'] += 1
+                delta['correct_score_sum'] += marks
+            else:
+                delta['wrong_count'] += 1
+            choice = _CHOICE_COLUMNS.get(response)
+            if choice:
+                delta[choice] += 1
+    for question_id, delta in zip(key.question_ids, deltas):
+        delta['b_question_id'] = question_id
+    return deltas
+
+
+def ensure_stats_rows(test_id, question_ids):
+    """Create zeroed stats rows for a newly created test"""
+    db.session.add(TestStats(test_id=test_id, attempts=0, score_sum=0, score_sq_sum=0))
+    db.session.add_all(
+        QuestionStats(question_id=question_id, test_id=test_id, **dict.fromkeys(_COUNTER_COLUMNS, 0))
+        for question_id in question_ids
+    )
+
+
+def record_submissions(key, scored):
+    """
+    Add scored submissions of one test to its statistics inside the caller's transaction.
+
+    `scored` is a list of (responses, marks_obtained) pairs where responses is the byte
+    vector produced by answer_keys.encode_responses. The test's score histogram is
+    updated too. Tests whose statistics were never built are skipped;
+    `flask rebuild-item-stats` backfills them.
+    """
+    if not scored or not len(key):
+        return
+
+    marks = [m for _, m in scored]
+    updated = db.session.execute(
+        update(TestStats)
+        .where(TestStats.test_id == key.test_id)
+        .values(
+            attempts=TestStats.attempts + len(scored),
+            score_sum=TestStats.score_sum + sum(marks),
+            score_sq_sum=TestStats.score_sq_sum + sum(m * m for m in marks)
+        )
+    ).rowcount
+    if not updated:
+        return
+    record_scores(key.test_id, marks)
+
+    # One executemany statement covering every question of the test
+    stmt = (update(QuestionStats.__table__)
+            .where(QuestionStats.__table__.c.question_id == bindparam('b_question_id'))
+            .values({column: getattr(QuestionStats.__table__.c, column) + bindparam(column)
+                     for column in _COUNTER_COLUMNS}))
+    db.session.execute(stmt, _question_deltas(key, scored))
+
+
+def rebuild_test_stats(key, batch_size=1000):
+    """Recompute a test's statistics and score histogram from all of its stored results"""
+    QuestionStats.query.filter_by(test_id=key.test_id).delete(synchronize_session=False)
+    TestStats.query.filter_by(test_id=key.test_id).delete(synchronize_session=False)
+    ScoreBucket.query.filter_by(test_id=key.test_id).delete(synchronize_session=False)
+    ensure_stats_rows(key.test_id, key.question_ids)
+    db.session.flush()
+
+    batch = []
+    query = (db.session.query(TestResult.answers_packed, TestResult.answers, TestResult.marks_obtained)
+             .filter(TestResult.test_id == key.test_id)
+             .yield_per(batch_size))
+    for answers_packed, answers, marks in query:
+        if answers_packed is not None:
+            responses = packed_responses(answers_packed)
+        else:
+            responses = legacy_responses(key, answers)
+        batch.append((responses, marks or 0))
+        if len(batch) >= batch_size:
+            record_submissions(key, batch)
+            batch = []
+    record_submissions(key, batch)
+
+
+def legacy_responses(key, answers):
+    """Response vector of a result stored before packing, which kept no question_status"""
+    answers = answers or {}
+    # Any recorded answer was an answered question
+    status = {q_id: 'answered' for q_id, answer in answers.items() if answer is not None}
+    return encode_responses(key, answers, status)
+
+
+def _point_biserial(attempts, correct, correct_score_sum, score_sum, stddev):
+    if not stddev or correct == 0 or correct == attempts:
+        return None
+    mean_correct = correct_score_sum / correct
+    mean_incorrect = (score_sum - correct_score_sum) / (attempts - correct)
+    p = correct / attempts
+    return round((mean_correct - mean_incorrect) / stddev * math.sqrt(p * (1 - p)), 4)
+
+
+def get_test_analytics(test_id):
+    """Item analysis for a test, or None if its statistics have not been built"""
+    test_stats = db.session.get(TestStats, test_id)
+    if test_stats is None:
+        return None
+
+    attempts = test_stats.attempts
+    mean = test_stats.score_sum / attempts if attempts else 0
+    variance = test_stats.score_sq_sum / attempts - mean * mean if attempts else 0
+    stddev = math.sqrt(max(variance, 0))
+
+    rows = (db.session.query(QuestionStats, Question.order, Question.correct_answer)
+            .join(Question, Question.id == QuestionStats.question_id)
+            .filter(QuestionStats.test_id == test_id)
+            .order_by(Question.order, Question.id)
+            .all())
+
+    questions = []
+    for stats, order, correct_answer in rows:
+        question_attempts = stats.correct_count + stats.wrong_count + stats.unanswered_count
+        questions.append({
+            'question_id': stats.question_id,
+            'order': order,
+            'correct_answer': correct_answer,
+            'attempts': question_attempts,
+            'correct_count': stats.correct_count,
+            'wrong_count': stats.wrong_count,
+            'unanswered_count': stats.unanswered_count,
+            'difficulty': round(stats.correct_count / question_attempts * 100, 2) if question_attempts else None,
+            'discrimination': _point_biserial(
+                question_attempts, stats.correct_count, stats.correct_score_sum, test_stats.score_sum, stddev
+            ),
+            'options': {
+                'A': stats.choice_a,
+                'B': stats.choice_b,
+                'C': stats.choice_c,
+                'D': stats.choice_d
+            }
+        })
+
+    return {
+        'test_id': test_id,
+        'attempts': attempts,
+        'mean_marks': round(mean, 2),
+        'marks_stddev': round(stddev, 2),
+        'questions': questions
+    }
@@ -0,0 +1,49 @@
+"""
+Background jobs with progress stored in the `jobs` table.
+
+A job runs in a daemon thread of the worker that accepted the request, while
+its status lives in the database so any worker can answer
+`GET /api/jobs/<id>`.
+"""
+
+import threading
+import uuid
+
+from models import db, Job
+
+
+def create_job(kind, teacher_id=None, total=0, errors=None):
+    job = Job(id=str(uuid.uuid4()), kind=kind, teacher_id=teacher_id, status='queued',
+              total=total, processed=0, errors=errors or [])
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def start_job(app, job_id, target, *args):
+    """Run target(job, *args) in a background thread inside an app context"""
+    def run():
+        with app.app_context():
+            job = db.session.get(Job, job_id)
+            job.status = 'running'
+            db.session.commit()
+            try:
+                job.result = target(job, *args)
+                job.status = 'completed'
+            except Exception as e:
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.errors = (job.errors or []) + [{'message': str(e)}]
+                print(f"[ERROR] Job {job_id} ({job.kind}) failed: {str(e)}")
+            db.session.commit()
+
+    thread = threading.Thread(target=run, name=f'job-{job_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def add_job_errors(job, errors):
+    # Reassign so SQLAlchemy notices the JSON change
+    if errors:
+        job.errors = (job.errors or []) + list(errors)
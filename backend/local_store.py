@@ -0,0 +1,101 @@
+"""
+Small helpers for host-local SQLite stores and the threads that drain them.
+
+A LocalStore is a SQLite file in WAL mode shared by every gunicorn worker on
+the host. Writes to it are cheap fsync'd appends, so requests can be
+acknowledged without waiting on the main database; a BackgroundFlusher in
+each worker then moves the data to the main database in batches.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class LocalStore:
+    """SQLite file with one connection per thread (and per process, so it is fork safe)"""
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit mode; callers group statements with BEGIN IMMEDIATE when needed
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn.executescript(self.schema)
+                    self._schema_ready = True
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, taking the write lock up front to avoid upgrade deadlocks"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class BackgroundFlusher:
+    """Daemon thread that calls `flush()` inside an app context every `interval` seconds"""
+
+    def __init__(self, app, flush, interval=0.5, name='flusher'):
+        self.app = app
+        self.flush = flush
+        self.interval = interval
+        self.name = name
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def ensure_started(self):
+        # Threads do not survive fork, so a worker restarts its own flusher
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    # Keep draining while there is a backlog
+                    while self.flush():
+                        pass
+            except Exception as e:
+                print(f"[ERROR] {self.name} failed: {str(e)}")
+                time.sleep(self.interval)
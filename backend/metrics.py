@@ -0,0 +1,426 @@
+"""
+Request metrics in Prometheus text format, plus on-demand profiling.
+
+Each worker keeps counters, gauges and histograms in memory and writes a
+snapshot to METRICS_DIR at most once a second. `/api/metrics` merges the
+snapshots of every worker on the host, so the numbers cover the whole
+gunicorn server whichever worker answers the scrape. When a worker exits, its
+counters and histograms are folded into `archive.json` and its snapshot is
+deleted (gunicorn's child_exit hook, or the next scrape that finds its pid
+gone), so totals never go backwards and dead workers do not pile up.
+
+SQL query counts and time are attributed to the current request through
+SQLAlchemy engine events.
+
+Profiling works through the same directory. A profile request is written
+there as a small JSON file, any worker that sees a matching request claims
+one of its N slots with an exclusive file create, and each captured cProfile
+is dumped next to it. The results endpoint merges them with pstats.
+"""
+
+import cProfile
+import fcntl
+import glob
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+HISTOGRAMS = {
+    'nano_http_request_duration_seconds': (
+        'Request latency by endpoint',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    ),
+    'nano_http_response_bytes': (
+        'Response body size by endpoint',
+        (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+    ),
+    'nano_db_queries_per_request': (
+        'SQL statements executed per request',
+        (0, 1, 2, 5, 10, 20, 50, 100)
+    ),
+    'nano_request_queue_seconds': (
+        'Time from the proxy receiving a request (X-Request-Start) to a worker starting it',
+        (0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 20, 30)
+    ),
+}
+COUNTERS = {
+    'nano_http_requests_total': 'Requests by endpoint, method and status',
+    'nano_db_queries_total': 'SQL statements executed by endpoint',
+    'nano_db_query_seconds_total': 'Time spent executing SQL by endpoint',
+    'nano_admission_requests_total': 'Admission decisions by priority and outcome',
+}
+GAUGES = {
+    'nano_http_requests_in_flight': 'Requests currently being handled',
+    'nano_admission_in_flight': 'Admitted requests being handled by priority',
+    'nano_admission_waiting': 'Requests waiting for a concurrency slot by priority',
+}
+
+SNAPSHOT_INTERVAL = 1.0
+ARCHIVE_FILE = 'archive.json'
+PROFILE_REFRESH_INTERVAL = 1.0
+
+
+class MetricsRegistry:
+    """Thread-safe in-process metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_gauge(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        bounds = HISTOGRAMS[name][1]
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(bounds), 'sum': 0, 'count': 0}
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                'histograms': [[name, list(labels), dict(h, buckets=list(h['buckets']))]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_snapshots(snapshots):
+    """Sum counters and histograms of all workers; gauges only of workers still running"""
+    counters, gauges, histograms = {}, {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        if snapshot.get('pid') and _pid_alive(snapshot['pid']):
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, h in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.setdefault(key, {'buckets': [0] * len(h['buckets']), 'sum': 0, 'count': 0})
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], h['buckets'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+    return counters, gauges, histograms
+
+
+def _worker_path(directory, pid):
+    return os.path.join(directory, f'worker-{pid}.json')
+
+
+def _worker_pid(path):
+    try:
+        return int(os.path.basename(path)[len('worker-'):-len('.json')])
+    except ValueError:
+        return None
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(directory, path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+class _DirectoryLock:
+    """Exclusive lock between the processes folding and reading snapshots in a directory"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def _retire(directory, pid):
+    """Fold a worker's counters and histograms into the archive and delete its snapshot (lock held)"""
+    path = _worker_path(directory, pid)
+    snapshot = _read_json(path)
+    if snapshot is not None:
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archive = _read_json(archive_path) or {'pid': None, 'counters': [], 'gauges': [], 'histograms': []}
+        counters, _, histograms = merge_snapshots([archive, dict(snapshot, pid=None)])
+        _write_json(directory, archive_path, {
+            'pid': None,
+            'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+            'gauges': [],
+            'histograms': [[name, labels, h] for (name, labels), h in histograms.items()],
+        })
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def retire_worker(directory, pid):
+    """Call when a worker has exited: keep its totals in the archive and remove its snapshot"""
+    with _DirectoryLock(directory):
+        _retire(directory, pid)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(counters, gauges, histograms, help_text=None):
+    help_text = help_text or {}
+    lines = []
+
+    def header(name, kind):
+        lines.append(f'# HELP {name} {help_text.get(name, name)}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    for name in sorted({name for name, _ in counters}):
+        header(name, 'counter')
+        for (n, labels), value in sorted(counters.items()):
+            if n == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name in sorted({name for name, _ in gauges}):
+        header(name, 'gauge')
+        for (n, labels), value in sorted(gauges.items()):
+            if n == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name in sorted({name for name, _ in histograms}):
+        header(name, 'histogram')
+        bounds = HISTOGRAMS[name][1]
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            for bound, count in zip(bounds, h['buckets']):
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {h["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {h["sum"]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {h["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Flask integration: request hooks, SQL event listeners, cross-worker snapshots and profiling"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.registry = MetricsRegistry()
+        self.help_text = {name: help for name, (help, _) in HISTOGRAMS.items()}
+        self.help_text.update(COUNTERS)
+        self.help_text.update(GAUGES)
+        self._last_snapshot = 0
+        self._profiles = {}
+        self._profiles_checked = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def instrument_engine(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    # ---- SQL events ----
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault('nano_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('nano_query_start')
+        if not starts or not has_request_context():
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        g.nano_sql_queries = g.get('nano_sql_queries', 0) + 1
+        g.nano_sql_seconds = g.get('nano_sql_seconds', 0) + elapsed
+
+    # ---- Request hooks ----
+
+    def _before_request(self):
+        g.nano_request_start = time.perf_counter()
+        g.nano_in_flight = True
+        self.registry.add_gauge('nano_http_requests_in_flight', 1)
+        self._maybe_start_profile()
+
+    def _after_request(self, response):
+        start = g.get('nano_request_start')
+        if start is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        elapsed = time.perf_counter() - start
+        registry = self.registry
+        registry.observe('nano_http_request_duration_seconds', elapsed, endpoint=endpoint)
+        registry.inc('nano_http_requests_total', endpoint=endpoint, method=request.method,
+                     status=response.status_code)
+        if not response.is_streamed and response.content_length is not None:
+            registry.observe('nano_http_response_bytes', response.content_length, endpoint=endpoint)
+        queries = g.get('nano_sql_queries', 0)
+        registry.observe('nano_db_queries_per_request', queries, endpoint=endpoint)
+        if queries:
+            registry.inc('nano_db_queries_total', queries, endpoint=endpoint)
+            registry.inc('nano_db_query_seconds_total', g.get('nano_sql_seconds', 0), endpoint=endpoint)
+        return response
+
+    def _teardown_request(self, exc):
+        if g.pop('nano_in_flight', False):
+            self.registry.add_gauge('nano_http_requests_in_flight', -1)
+        self._finish_profile()
+        if time.perf_counter() - self._last_snapshot >= SNAPSHOT_INTERVAL:
+            self.write_snapshot()
+
+    # ---- Cross-worker aggregation ----
+
+    def write_snapshot(self):
+        self._last_snapshot = time.perf_counter()
+        _write_json(self.directory, _worker_path(self.directory, os.getpid()), self.registry.snapshot())
+
+    def render(self):
+        """Prometheus exposition of every worker's metrics, including those of exited workers"""
+        self.write_snapshot()
+        with _DirectoryLock(self.directory):
+            snapshots = []
+            for path in glob.glob(os.path.join(self.directory, 'worker-*.json')):
+                pid = _worker_pid(path)
+                if pid is not None and not _pid_alive(pid):
+                    _retire(self.directory, pid)  # Exited without the child_exit hook, e.g. outside gunicorn
+                    continue
+                snapshot = _read_json(path)
+                if snapshot is not None:  # None while a worker replaces its file; picked up next scrape
+                    snapshots.append(snapshot)
+            archive = _read_json(os.path.join(self.directory, ARCHIVE_FILE))
+            if archive is not None:
+                snapshots.append(archive)
+        return render_prometheus(*merge_snapshots(snapshots), help_text=self.help_text)
+
+    # ---- Profiling ----
+
+    def request_profile(self, endpoint, requests):
+        profile_id = uuid.uuid4().hex[:12]
+        with open(os.path.join(self.directory, f'profile-{profile_id}.json'), 'w') as f:
+            json.dump({'endpoint': endpoint, 'requests': requests, 'created_at': time.time()}, f)
+        self._profiles_checked = 0
+        return profile_id
+
+    def _active_profiles(self):
+        now = time.perf_counter()
+        if now - self._profiles_checked >= PROFILE_REFRESH_INTERVAL:
+            self._profiles_checked = now
+            profiles = {}
+            for path in glob.glob(os.path.join(self.directory, 'profile-*.json')):
+                profile_id = os.path.basename(path)[len('profile-'):-len('.json')]
+                try:
+                    with open(path) as f:
+                        spec = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                if self._captured(profile_id) < spec['requests']:
+                    profiles[profile_id] = spec
+            self._profiles = profiles
+        return self._profiles
+
+    def _captured(self, profile_id):
+        return len(glob.glob(os.path.join(self.directory, f'profile-{profile_id}.slot*')))
+
+    def _maybe_start_profile(self):
+        profiles = self._active_profiles()
+        if not profiles:
+            return
+        for profile_id, spec in profiles.items():
+            if spec['endpoint'] != request.endpoint:
+                continue
+            for slot in range(spec['requests']):
+                try:
+                    # O_EXCL makes the slot claim atomic across workers
+                    fd = os.open(os.path.join(self.directory, f'profile-{profile_id}.slot{slot}'),
+                                 os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    continue
+                os.close(fd)
+                profiler = cProfile.Profile()
+                g.nano_profile = (profile_id, slot, profiler)
+                profiler.enable()
+                return
+            self._profiles_checked = 0  # All slots taken; refresh on the next request
+
+    def _finish_profile(self):
+        profile = g.pop('nano_profile', None)
+        if profile is None:
+            return
+        profile_id, slot, profiler = profile
+        profiler.disable()
+        profiler.dump_stats(os.path.join(self.directory, f'profile-{profile_id}.{slot}.prof'))
+
+    def profile_report(self, profile_id, limit=50):
+        """Return (spec, captured count, pstats text) or None for an unknown profile"""
+        spec_path = os.path.join(self.directory, f'profile-{profile_id}.json')
+        if not os.path.exists(spec_path):
+            return None
+        with open(spec_path) as f:
+            spec = json.load(f)
+        dumps = sorted(glob.glob(os.path.join(self.directory, f'profile-{profile_id}.*.prof')))
+        if not dumps:
+            return spec, 0, ''
+        output = io.StringIO()
+        stats = pstats.Stats(*dumps, stream=output)
+        stats.sort_stats('cumulative').print_stats(limit)
+        return spec, len(dumps), output.getvalue()
@@ -0,0 +1,242 @@
+"""
+Versioned schema migrations.
+
+`db.create_all()` creates missing tables with everything declared on the
+models, but never changes a table that already exists. Every change to an
+existing table is therefore a numbered migration below. `schema_migrations`
+records which ones a database has applied, and `migrate()` (run at startup
+and by `flask db-upgrade`) applies the rest in order.
+
+Migrations must also be harmless on a fresh database, where create_all has
+already produced their result: columns are only added if missing and indexes
+use IF NOT EXISTS. Index migrations are not transactional so Postgres can
+build them CONCURRENTLY without blocking submissions on a live database.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, LargeBinary, MetaData, String, Table, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+Migration = namedtuple('Migration', ['version', 'description', 'apply', 'transactional'])
+MIGRATIONS = []
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(255), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# Any constant works; it only has to be the same in every process
+_PG_LOCK_ID = 0x6e616e6f
+
+
+def migration(version, description, transactional=True):
+    def register(apply):
+        MIGRATIONS.append(Migration(version, description, apply, transactional))
+        return apply
+    return register
+
+
+def create_index(conn, name, table, columns, unique=False):
+    unique_sql = 'UNIQUE ' if unique else ''
+    # CONCURRENTLY keeps the table writable while the index builds (Postgres only, outside a transaction)
+    concurrently = 'CONCURRENTLY ' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(f'CREATE {unique_sql}INDEX {concurrently}IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+# ==================== Migrations ====================
+
+# (table, column, DDL type) for columns added after the initial schema;
+# SQLAlchemy types are compiled for the database's dialect
+ADDED_COLUMNS = [
+    ('questions', 'image_hash', 'VARCHAR(64) REFERENCES images (hash)'),
+    ('tests', 'version', 'INTEGER NOT NULL DEFAULT 1'),
+    ('test_results', 'receipt_id', 'VARCHAR(36)'),
+    ('test_results', 'answers_packed', LargeBinary()),
+    ('tests', 'question_count', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Statements that fill a column right after it is added
+BACKFILLS = {
+    ('tests', 'question_count'):
+        'UPDATE tests SET question_count = (SELECT COUNT(*) FROM questions WHERE questions.test_id = tests.id)',
+}
+
+
+def add_columns(conn, columns):
+    """Add (table, column, DDL type) columns that are missing, running their BACKFILLS"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    columns_by_table = {}
+    for table, column, ddl in columns:
+        if table not in existing_tables:
+            continue
+        if table not in columns_by_table:
+            columns_by_table[table] = {c['name'] for c in inspector.get_columns(table)}
+        if column in columns_by_table[table]:
+            continue
+        if not isinstance(ddl, str):
+            ddl = ddl.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+        if (table, column) in BACKFILLS:
+            conn.execute(text(BACKFILLS[(table, column)]))
+        columns_by_table[table].add(column)
+        print(f"[INFO] Added column {table}.{column}")
+
+
+@migration(1, 'Add columns introduced after the initial schema')
+def add_initial_columns(conn):
+    add_columns(conn, ADDED_COLUMNS)
+
+
+@migration(2, 'Index submission receipts and leaderboard order', transactional=False)
+def index_receipts_and_leaderboard(conn):
+    create_index(conn, 'ix_test_results_receipt_id', 'test_results', 'receipt_id', unique=True)
+    create_index(conn, 'ix_test_results_leaderboard', 'test_results', 'test_id, marks_obtained DESC, submitted_at, id')
+
+
+@migration(3, 'Index foreign keys in the order their listings are read', transactional=False)
+def index_foreign_keys(conn):
+    # Result listings filter by student or test and page by (submitted_at, id)
+    create_index(conn, 'ix_test_results_student_submitted', 'test_results', 'student_id, submitted_at, id')
+    create_index(conn, 'ix_test_results_test_submitted', 'test_results', 'test_id, submitted_at, id')
+    # Test.questions loads in (order, id) order
+    create_index(conn, 'ix_questions_test_order', 'questions', 'test_id, "order", id')
+    create_index(conn, 'ix_questions_image_hash', 'questions', 'image_hash')
+    create_index(conn, 'ix_tests_teacher_id', 'tests', 'teacher_id')
+
+
+# (table, column, referred table.column, ON DELETE action) declared on the models
+CASCADING_FOREIGN_KEYS = [
+    ('questions', 'test_id', 'tests.id', 'CASCADE'),
+    ('test_results', 'test_id', 'tests.id', 'CASCADE'),
+    ('test_stats', 'test_id', 'tests.id', 'CASCADE'),
+    ('question_stats', 'test_id', 'tests.id', 'CASCADE'),
+    ('question_stats', 'question_id', 'questions.id', 'CASCADE'),
+    ('score_buckets', 'test_id', 'tests.id', 'CASCADE'),
+    ('attempt_sessions', 'test_id', 'tests.id', 'CASCADE'),
+    ('attempt_sessions', 'result_id', 'test_results.id', 'SET NULL'),
+]
+
+
+@migration(4, 'Soft-delete tests and cascade deletes from tests to their rows', transactional=False)
+def cascade_test_deletes(conn):
+    add_columns(conn, [('tests', 'deleted_at', DateTime())])
+    # SQLite cannot change the constraints of an existing table; deletions.py clears
+    # child rows explicitly, so older SQLite databases keep working without the cascades
+    if conn.dialect.name != 'postgresql':
+        return
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    for table, column, referred, action in CASCADING_FOREIGN_KEYS:
+        if table not in existing_tables:
+            continue
+        referred_table, referred_column = referred.split('.')
+        for fk in inspector.get_foreign_keys(table):
+            if fk['constrained_columns'] != [column] or fk['options'].get('ondelete', '').upper() == action:
+                continue
+            name = fk['name']
+            # NOT VALID then VALIDATE: existing rows are checked without blocking writes
+            conn.execute(text(
+                f'ALTER TABLE {table} DROP CONSTRAINT {name}, '
+                f'ADD CONSTRAINT {name} FOREIGN KEY ({column}) '
+                f'REFERENCES {referred_table} ({referred_column}) ON DELETE {action} NOT VALID'
+            ))
+            conn.execute(text(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}'))
+
+
+counters = Table(
+    'counters', MetaData(),
+    Column('name', String(50), primary_key=True),
+    Column('value', Integer, nullable=False),
+)
+
+
+@migration(5, 'Draw test versions from a shared counter so they never repeat')
+def seed_test_version_counter(conn):
+    counters.create(conn, checkfirst=True)
+    exists = conn.execute(text("SELECT 1 FROM counters WHERE name = 'test_version'")).first()
+    if exists is None:
+        # Start above every version in use; tests edited from now on never share a version
+        current = conn.execute(text('SELECT COALESCE(MAX(version), 1) FROM tests')).scalar()
+        conn.execute(counters.insert().values(name='test_version', value=current))
+
+
+
+@migration(6, 'Lowercase student emails so logins match imported rosters')
+def lowercase_student_emails(conn):
+    # Addresses that differ from another student's only by case are left alone
+    conn.execute(text(
+        'UPDATE students SET email = LOWER(TRIM(email)) '
+        'WHERE email <> LOWER(TRIM(email)) AND NOT EXISTS '
+        '(SELECT 1 FROM students other WHERE other.id <> students.id '
+        'AND LOWER(TRIM(other.email)) = LOWER(TRIM(students.email)))'
+    ))
+    clashes = conn.execute(text('SELECT COUNT(*) FROM students WHERE email <> LOWER(TRIM(email))')).scalar()
+    if clashes:
+        print(f"[INFO] {clashes} student emails differ from another student's only by case and were not changed")
+
+
+
+@migration(7, 'Remember the spool receipt of submitted attempts', transactional=False)
+def attempt_receipts(conn):
+    add_columns(conn, [('attempt_sessions', 'receipt_id', 'VARCHAR(36)')])
+    create_index(conn, 'ix_attempt_sessions_receipt_id', 'attempt_sessions', 'receipt_id')
+
+
+# ==================== Runner ====================
+
+def _applied_versions(engine):
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+        return {row.version for row in conn.execute(schema_migrations.select())}
+
+
+def pending_migrations(engine):
+    applied = _applied_versions(engine)
+    return [m for m in sorted(MIGRATIONS) if m.version not in applied]
+
+
+def _record(conn, m):
+    conn.execute(schema_migrations.insert().values(
+        version=m.version, description=m.description, applied_at=datetime.utcnow()
+    ))
+
+
+def _apply(engine, m):
+    if m.transactional:
+        with engine.begin() as conn:
+            m.apply(conn)
+            _record(conn, m)
+        return
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        m.apply(conn)
+    with engine.begin() as conn:
+        _record(conn, m)
+
+
+def migrate(db):
+    """Apply every pending migration to the primary database; returns the versions applied"""
+    engine = db.engine
+    applied = []
+    lock = None
+    if engine.dialect.name == 'postgresql':
+        # Workers booting together wait here instead of racing through the same DDL
+        lock = engine.connect()
+        lock.execute(text('SELECT pg_advisory_lock(:id)'), {'id': _PG_LOCK_ID})
+    try:
+        for m in pending_migrations(engine):
+            try:
+                _apply(engine, m)
+            except IntegrityError:
+                continue  # Recorded by another process at the same time
+            applied.append(m.version)
+            print(f"[INFO] Applied migration {m.version}: {m.description}")
+    finally:
+        if lock is not None:
+            lock.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': _PG_LOCK_ID})
+            lock.close()
+    return applied
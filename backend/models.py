@@ -1,9 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
+import struct
 
-db = SQLAlchemy()
+from db_routing import RoutingSession
+from passwords import hash_password, verify_password
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Option letters are stored as small integer codes; 0 means not answered
+OPTION_CODES = {'A': 1, 'B': 2, 'C': 3, 'D': 4}
+OPTION_LETTERS = {code: letter for letter, code in OPTION_CODES.items()}
+OTHER_ANSWER = 7  # Answered with something other than A-D, always wrong
 
 class Teacher(db.Model):
     __tablename__ = 'teachers'
@@ -19,10 +27,10 @@ class Teacher(db.Model):
     tests = db.relationship('Test', back_populates='teacher', cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
     
     def to_dict(self):
         return {
@@ -34,11 +42,16 @@ class Teacher(db.Model):
         }
 
 
+def normalize_email(email):
+    """Emails are stored, imported and looked up lowercased, so one address is one student"""
+    return (email or '').strip().lower()
+
+
 class Student(db.Model):
     __tablename__ = 'students'
     
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(255), unique=True, nullable=False)
+    email = db.Column(db.String(255), unique=True, nullable=False)  # Always normalize_email()ed
     password_hash = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(255))
     roll_number = db.Column(db.String(50))
@@ -48,10 +61,10 @@ class Student(db.Model):
     results = db.relationship('TestResult', back_populates='student', cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
     
     def to_dict(self):
         return {
@@ -63,22 +76,61 @@ class Student(db.Model):
         }
 
 
+class Counter(db.Model):
+    """Named counters shared by every worker; see next_test_version()"""
+    __tablename__ = 'counters'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False)
+
+
+TEST_VERSION_COUNTER = 'test_version'
+
+
+def next_test_version():
+    """
+    Take the next test version from the shared counter, inside the caller's transaction.
+    
+    Versions never repeat across tests, so (test id, version) identifies one state of one
+    test even when SQLite hands a deleted test's id to a new test. Caches keyed by it in
+    any worker can never serve another test's answer key or snapshot.
+    """
+    counter = Counter.__table__
+    # The UPDATE locks the row until commit, so concurrent callers get distinct values
+    db.session.execute(counter.update()
+                       .where(counter.c.name == TEST_VERSION_COUNTER)
+                       .values(value=counter.c.value + 1))
+    return db.session.execute(
+        db.select(counter.c.value).where(counter.c.name == TEST_VERSION_COUNTER)
+    ).scalar_one()
+
+
 class Test(db.Model):
     __tablename__ = 'tests'
+    # Never reuse the id of a deleted test in new SQLite databases
+    __table_args__ = {'sqlite_autoincrement': True}
     
     id = db.Column(db.Integer, primary_key=True)
-    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False, index=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
     duration = db.Column(db.Integer)  # in minutes
     passing_marks = db.Column(db.Integer)  # percentage
     is_active = db.Column(db.Boolean, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1)  # From next_test_version(); keys cached answer keys and snapshots
+    question_count = db.Column(db.Integer, nullable=False, default=0)  # Maintained by create_test
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # Set while a background job purges the test
     
-    # Relationships
+    # Relationships; the database deletes children through ON DELETE CASCADE
     teacher = db.relationship('Teacher', back_populates='tests')
-    questions = db.relationship('Question', back_populates='test', cascade='all, delete-orphan')
-    results = db.relationship('TestResult', back_populates='test', cascade='all, delete-orphan')
+    questions = db.relationship('Question', back_populates='test', cascade='all, delete-orphan',
+                                passive_deletes=True, order_by='(Question.order, Question.id)')
+    results = db.relationship('TestResult', back_populates='test', cascade='all, delete-orphan',
+                              passive_deletes=True)
+    
+    def bump_version(self):
+        self.version = next_test_version()
     
     def to_dict(self, include_questions=False):
         data = {
@@ -89,7 +141,7 @@ class Test(db.Model):
             'duration': self.duration,
             'passing_marks': self.passing_marks,
             'is_active': self.is_active,
-            'question_count': len(self.questions),
+            'question_count': self.question_count,
             'created_at': self.created_at.isoformat()
         }
         if include_questions:
@@ -97,11 +149,43 @@ class Test(db.Model):
         return data
 
 
+class Image(db.Model):
+    __tablename__ = 'images'
+    
+    hash = db.Column(db.String(64), primary_key=True)  # SHA-256 of the image bytes
+    mime_type = db.Column(db.String(100), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def url(self):
+        return image_url(self.hash)
+
+
+def image_url(image_hash):
+    return f'/api/images/{image_hash}'
+
+
+class ImageVariant(db.Model):
+    """A downscaled WebP rendition of a stored image, created by image_variants"""
+    __tablename__ = 'image_variants'
+    
+    image_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), primary_key=True)
+    width = db.Column(db.Integer, primary_key=True)
+    height = db.Column(db.Integer, nullable=False)
+    variant_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), nullable=False)  # Stored like any image
+    
+    def to_dict(self):
+        return {'url': image_url(self.variant_hash), 'width': self.width, 'height': self.height}
+
+
 class Question(db.Model):
     __tablename__ = 'questions'
+    # Test.questions loads in (order, id) order
+    __table_args__ = (db.Index('ix_questions_test_order', 'test_id', 'order', 'id'), {'sqlite_autoincrement': True})
     
     id = db.Column(db.Integer, primary_key=True)
-    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), nullable=False)
     question_text = db.Column(db.Text, nullable=False)
     option_a = db.Column(db.String(255), nullable=False)
     option_b = db.Column(db.String(255), nullable=False)
@@ -109,10 +193,22 @@ class Question(db.Model):
     option_d = db.Column(db.String(255), nullable=False)
     correct_answer = db.Column(db.String(1), nullable=False)  # A, B, C, or D
     order = db.Column(db.Integer)
-    image = db.Column(db.Text, nullable=True)  # Base64 encoded image data
+    image = db.Column(db.Text, nullable=True)  # Legacy inline base64 image, moved to the image store by `flask migrate-images`
+    image_hash = db.Column(db.String(64), db.ForeignKey('images.hash'), nullable=True, index=True)
     
     # Relationships
     test = db.relationship('Test', back_populates='questions')
+    # Loaded for all questions of a test in one extra query
+    image_variants = db.relationship('ImageVariant', lazy='selectin', viewonly=True,
+                                     primaryjoin='Question.image_hash == foreign(ImageVariant.image_hash)',
+                                     order_by='ImageVariant.width')
+    
+    @property
+    def image_src(self):
+        """URL of the stored image, or the legacy inline base64 for rows not yet migrated"""
+        if self.image_hash:
+            return image_url(self.image_hash)
+        return self.image
     
     def to_dict(self, include_answer=False):
         data = {
@@ -123,7 +219,9 @@ class Question(db.Model):
             'option_c': self.option_c,
             'option_d': self.option_d,
             'order': self.order,
-            'image': self.image  # Base64 encoded image or None
+            'image': self.image_src,
+            'image_hash': self.image_hash,
+            'image_srcset': [variant.to_dict() for variant in self.image_variants]
         }
         if include_answer:
             data['correct_answer'] = self.correct_answer
@@ -135,7 +233,7 @@ class TestResult(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
-    test_id = db.Column(db.Integer, db.ForeignKey('tests.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), nullable=False)
     answers = db.Column(db.JSON)  # JSON object with question_id: answer mapping
     marked_for_review = db.Column(db.JSON)  # JSON array of question IDs marked for review
     marks_obtained = db.Column(db.Float)
@@ -146,11 +244,32 @@ class TestResult(db.Model):
     unanswered_count = db.Column(db.Integer)
     is_passed = db.Column(db.Boolean)
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    receipt_id = db.Column(db.String(36), unique=True, index=True)  # Set when written from the submission spool
+    answers_packed = db.Column(db.LargeBinary)  # Packed answers and review flags, see pack_answers()
     
     # Relationships
     student = db.relationship('Student', back_populates='results')
     test = db.relationship('Test', back_populates='results')
     
+    def decode_answers(self, question_keys):
+        """
+        Return ({question_id: letter}, {marked question ids}) keyed by stringified question id.
+        
+        question_keys is the test's stringified question ids in question order, the same
+        order the answers were packed in. Rows written before packing fall back to the JSON columns.
+        """
+        if self.answers_packed is not None:
+            return unpack_answers(self.answers_packed, question_keys)
+        
+        answers = {k: v for k, v in (self.answers or {}).items() if v is not None}
+        # Legacy marked_for_review could be a list of ids or a {id: bool} dict
+        marked = self.marked_for_review or []
+        if isinstance(marked, dict):
+            marked_ids = {str(qid) for qid, flag in marked.items() if flag}
+        else:
+            marked_ids = {str(qid) for qid in marked}
+        return answers, marked_ids
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -170,3 +289,293 @@ class TestResult(db.Model):
             'is_passed': self.is_passed,
             'submitted_at': self.submitted_at.isoformat()
         }
+
+
+# Serves leaderboard pages (best marks first, earliest submission breaking ties) without sorting
+db.Index('ix_test_results_leaderboard', TestResult.test_id, TestResult.marks_obtained.desc(),
+         TestResult.submitted_at, TestResult.id)
+# Result listings of a student or a test, paged by (submitted_at, id)
+db.Index('ix_test_results_student_submitted', TestResult.student_id, TestResult.submitted_at, TestResult.id)
+db.Index('ix_test_results_test_submitted', TestResult.test_id, TestResult.submitted_at, TestResult.id)
+
+
+class TestStats(db.Model):
+    """Running score totals for a test, maintained by item_stats on every submission"""
+    __tablename__ = 'test_stats'
+    
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0)
+    score_sq_sum = db.Column(db.Float, nullable=False, default=0)
+
+
+class QuestionStats(db.Model):
+    """Running per-question response counts, maintained by item_stats on every submission"""
+    __tablename__ = 'question_stats'
+    
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id', ondelete='CASCADE'), primary_key=True)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), nullable=False, index=True)
+    correct_count = db.Column(db.Integer, nullable=False, default=0)
+    wrong_count = db.Column(db.Integer, nullable=False, default=0)
+    unanswered_count = db.Column(db.Integer, nullable=False, default=0)
+    choice_a = db.Column(db.Integer, nullable=False, default=0)
+    choice_b = db.Column(db.Integer, nullable=False, default=0)
+    choice_c = db.Column(db.Integer, nullable=False, default=0)
+    choice_d = db.Column(db.Integer, nullable=False, default=0)
+    correct_score_sum = db.Column(db.Float, nullable=False, default=0)  # Total marks of students who got it right
+
+
+class ScoreBucket(db.Model):
+    """Number of a test's results with each score, maintained by rankings on every submission"""
+    __tablename__ = 'score_buckets'
+    
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), primary_key=True)
+    marks = db.Column(db.Float, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class StudentSummary(db.Model):
+    """A student's performance across all tests, maintained by student_summaries on every submission"""
+    __tablename__ = 'student_summaries'
+    
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    passed_count = db.Column(db.Integer, nullable=False, default=0)
+    percentage_sum = db.Column(db.Float, nullable=False, default=0)
+    best_percentage = db.Column(db.Float, nullable=True)
+    worst_percentage = db.Column(db.Float, nullable=True)
+    recent = db.Column(db.JSON)  # Newest results first, see student_summaries.RECENT_RESULTS
+    last_submitted_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        recent = self.recent or []
+        average = self.percentage_sum / self.attempts if self.attempts else None
+        recent_average = sum(r['percentage'] for r in recent) / len(recent) if recent else None
+        return {
+            'student_id': self.student_id,
+            'attempts': self.attempts,
+            'passed_count': self.passed_count,
+            'average_percentage': round(average, 2) if average is not None else None,
+            'pass_rate': round(self.passed_count / self.attempts * 100, 2) if self.attempts else None,
+            'best_percentage': self.best_percentage,
+            'worst_percentage': self.worst_percentage,
+            'recent_average_percentage': round(recent_average, 2) if recent_average is not None else None,
+            # Positive when the latest results are above the student's overall average
+            'trend': round(recent_average - average, 2) if recent else None,
+            'last_submitted_at': self.last_submitted_at.isoformat() if self.last_submitted_at else None,
+            'recent': recent
+        }
+
+
+class AttemptSession(db.Model):
+    """A student's in-progress attempt at a test, autosaved while they work on it"""
+    __tablename__ = 'attempt_sessions'
+    __table_args__ = (db.Index('ix_attempt_sessions_student_test', 'student_id', 'test_id', 'status'),)
+    
+    id = db.Column(db.String(36), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
+    test_id = db.Column(db.Integer, db.ForeignKey('tests.id', ondelete='CASCADE'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # in_progress, submitted, expired
+    state = db.Column(db.JSON)  # {'answers': {...}, 'marked_for_review': {...}, 'question_status': {...}}
+    saved_seq = db.Column(db.Integer, nullable=False, default=0)  # Last autosave written to this row
+    result_id = db.Column(db.Integer, db.ForeignKey('test_results.id', ondelete='SET NULL'), nullable=True)
+    receipt_id = db.Column(db.String(36), nullable=True, index=True)  # Spool receipt until result_id is set
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=True)  # started_at + test duration
+    saved_at = db.Column(db.DateTime, nullable=True)
+    submitted_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self, state=None, seq=None):
+        """state/seq override the stored ones with a newer autosave that is not flushed yet"""
+        remaining = None
+        if self.expires_at is not None:
+            remaining = max(0, int((self.expires_at - datetime.utcnow()).total_seconds()))
+        return {
+            'id': self.id,
+            'test_id': self.test_id,
+            'status': self.status,
+            'state': state if state is not None else self.state,
+            'seq': seq if seq is not None else self.saved_seq,
+            'result_id': self.result_id,
+            'receipt_id': self.receipt_id,
+            'started_at': self.started_at.isoformat(),
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'remaining_seconds': remaining,
+            'submitted_at': self.submitted_at.isoformat() if self.submitted_at else None
+        }
+
+
+class Job(db.Model):
+    """Progress of a background job (bulk imports and other long-running work)"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.JSON)  # List of {'row': n, 'message': ...}
+    result = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'progress': round(self.processed / self.total * 100, 1) if self.total else None,
+            'errors': self.errors or [],
+            'result': self.result,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+# ==================== Packed Answers ====================
+# A result's answers are stored as one binary value aligned to the test's question order:
+#
+#   byte 0        format version
+#   bytes 1-2     question count n (big-endian)
+#   ceil(n/2)     one nibble per question, high nibble first:
+#                 bits 0-2 option code (0 blank, 1-4 A-D, 7 other), bit 3 set if the status was 'answered'
+#   ceil(n/8)     review bitmap, most significant bit first
+#
+# That is about 5 bits per question instead of a JSON object keyed by question id.
+
+PACKED_FORMAT_VERSION = 1
+_HEADER = struct.Struct('>BH')
+_ANSWERED_FLAG = 0x8
+
+# Byte -> scored code of its high / low nibble (0 unless the answered flag is set)
+_SCORED_HIGH = bytes(((b >> 4) & 0x7) if b & 0x80 else 0 for b in range(256))
+_SCORED_LOW = bytes((b & 0x7) if b & 0x08 else 0 for b in range(256))
+
+
+def pack_answers(question_keys, answers, marked_for_review, question_status):
+    """Pack a submission's answers, statuses and review flags in question order"""
+    answers = answers or {}
+    question_status = question_status or {}
+    if isinstance(marked_for_review, dict):
+        marked = {str(qid) for qid, flag in marked_for_review.items() if flag}
+    else:
+        marked = {str(qid) for qid in (marked_for_review or [])}
+    
+    n = len(question_keys)
+    nibbles = bytearray((n + 1) // 2)
+    bitmap = bytearray((n + 7) // 8)
+    for i, q_id in enumerate(question_keys):
+        answer = answers.get(q_id)
+        value = 0 if answer is None else OPTION_CODES.get(answer, OTHER_ANSWER)
+        if value and question_status.get(q_id) == 'answered':
+            value |= _ANSWERED_FLAG
+        nibbles[i // 2] |= value << 4 if i % 2 == 0 else value
+        if q_id in marked:
+            bitmap[i // 8] |= 0x80 >> (i % 8)
+    return _HEADER.pack(PACKED_FORMAT_VERSION, n) + bytes(nibbles) + bytes(bitmap)
+
+
+def unpack_answers(packed, question_keys):
+    """Inverse of pack_answers: ({question_id: letter}, {marked question ids})"""
+    _, n = _HEADER.unpack_from(packed)
+    nibbles = packed[_HEADER.size:_HEADER.size + (n + 1) // 2]
+    bitmap = packed[_HEADER.size + (n + 1) // 2:]
+    answers = {}
+    marked = set()
+    for i, q_id in enumerate(question_keys[:n]):
+        value = (nibbles[i // 2] >> 4) if i % 2 == 0 else nibbles[i // 2]
+        code = value & 0x7
+        if code:
+            answers[q_id] = OPTION_LETTERS.get(code, '?')
+        if bitmap[i // 8] & (0x80 >> (i % 8)):
+            marked.add(q_id)
+    return answers, marked
+
+
+def packed_responses(packed):
+    """
+    Scored response vector of a packed result: one byte per question holding the option
+    code if it was answered and 0 otherwise, as produced by answer_keys.encode_responses.
+    Decoding runs in C via bytes.translate, so it is cheap enough for bulk analytics.
+    """
+    _, n = _HEADER.unpack_from(packed)
+    nibbles = packed[_HEADER.size:_HEADER.size + (n + 1) // 2]
+    responses = bytearray(len(nibbles) * 2)
+    responses[0::2] = nibbles.translate(_SCORED_HIGH)
+    responses[1::2] = nibbles.translate(_SCORED_LOW)
+    return bytes(responses[:n])
+
+
+# ==================== Result Listings ====================
+# Listing endpoints read plain columns instead of TestResult objects, so a page of
+# results costs one joined query however many rows it has.
+
+RESULT_LISTING_COLUMNS = (
+    TestResult.id,
+    TestResult.student_id,
+    TestResult.test_id,
+    TestResult.marks_obtained,
+    TestResult.max_marks,
+    TestResult.percentage,
+    TestResult.correct_count,
+    TestResult.wrong_count,
+    TestResult.unanswered_count,
+    TestResult.is_passed,
+    TestResult.submitted_at,
+    Test.teacher_id.label('test_teacher_id'),
+    Test.name.label('test_name'),
+    Test.description.label('test_description'),
+    Test.duration.label('test_duration'),
+    Test.passing_marks.label('test_passing_marks'),
+    Test.is_active.label('test_is_active'),
+    Test.question_count.label('test_question_count'),
+    Test.created_at.label('test_created_at'),
+    Student.email.label('student_email'),
+)
+
+
+def query_result_listing(*criterion):
+    """Results of live tests joined to their test and student, selecting only the listed columns"""
+    return (db.session.query(*RESULT_LISTING_COLUMNS)
+            .join(Test, Test.id == TestResult.test_id)
+            .join(Student, Student.id == TestResult.student_id)
+            .filter(Test.deleted_at.is_(None), *criterion))
+
+
+def result_row_to_dict(row):
+    """Same shape as TestResult.to_dict, built from a listing row"""
+    return {
+        'id': row.id,
+        'student_id': row.student_id,
+        'test_id': row.test_id,
+        'test_name': row.test_name,
+        'test': {
+            'id': row.test_id,
+            'teacher_id': row.test_teacher_id,
+            'name': row.test_name,
+            'description': row.test_description,
+            'duration': row.test_duration,
+            'passing_marks': row.test_passing_marks,
+            'is_active': row.test_is_active,
+            'question_count': row.test_question_count,
+            'created_at': row.test_created_at.isoformat()
+        },
+        'student_email': row.student_email,
+        'marks_obtained': row.marks_obtained,
+        'max_marks': row.max_marks,
+        'percentage': row.percentage,
+        'passing_marks': row.test_passing_marks,
+        'score': row.marks_obtained,
+        'correct_count': row.correct_count,
+        'wrong_count': row.wrong_count,
+        'unanswered_count': row.unanswered_count,
+        'is_passed': row.is_passed,
+        'submitted_at': row.submitted_at.isoformat()
+    }
+
+
+def serialize_result_rows(rows):
+    return [result_row_to_dict(row) for row in rows]
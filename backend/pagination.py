@@ -0,0 +1,90 @@
+"""
+Keyset (cursor) pagination over (submitted_at, id).
+
+Cursors are opaque to clients: a url-safe base64 encoding of the last row's
+sort key. Paging with `WHERE (submitted_at, id) > cursor` stays fast at any
+depth, unlike OFFSET, and is stable while new results are being submitted.
+Leaderboards page the same way over (marks descending, submitted_at, id).
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor this server did not issue"""
+
+
+def _encode(values):
+    raw = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+
+def encode_cursor(submitted_at, row_id):
+    return _encode([submitted_at.isoformat(), row_id])
+
+
+def decode_cursor(cursor):
+    try:
+        submitted_at, row_id = _decode(cursor)
+        return datetime.fromisoformat(submitted_at), int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorError('Invalid cursor')
+
+
+def encode_leaderboard_cursor(marks, submitted_at, row_id):
+    return _encode([marks, submitted_at.isoformat(), row_id])
+
+
+def decode_leaderboard_cursor(cursor):
+    try:
+        marks, submitted_at, row_id = _decode(cursor)
+        return float(marks), datetime.fromisoformat(submitted_at), int(row_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursorError('Invalid cursor')
+
+
+def parse_page_size(value):
+    try:
+        limit = int(value) if value else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise InvalidCursorError('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _after(timestamp_column, id_column, submitted_at, row_id):
+    return or_(
+        timestamp_column > submitted_at,
+        and_(timestamp_column == submitted_at, id_column > row_id)
+    )
+
+
+def after_cursor(timestamp_column, id_column, cursor):
+    """Filter for rows strictly after the cursor in (timestamp, id) order"""
+    return _after(timestamp_column, id_column, *decode_cursor(cursor))
+
+
+def after_key(timestamp_column, id_column, submitted_at, row_id):
+    """Filter for rows strictly after (submitted_at, row_id), for batch jobs walking a test's results"""
+    return _after(timestamp_column, id_column, submitted_at, row_id)
+
+
+def after_leaderboard_cursor(marks_column, timestamp_column, id_column, cursor):
+    """Filter for rows strictly after the cursor in (marks descending, timestamp, id) order"""
+    marks, submitted_at, row_id = decode_leaderboard_cursor(cursor)
+    return or_(
+        marks_column < marks,
+        and_(marks_column == marks, _after(timestamp_column, id_column, submitted_at, row_id))
+    )
@@ -0,0 +1,62 @@
+"""
+Password hashing off the request path.
+
+werkzeug's password hashes are deliberately slow. Bulk operations hash in a
+process pool so the work runs on all cores and never holds up the request
+threads of a gunicorn worker.
+
+Under the gevent worker a single hash would block every greenlet of the
+worker for its whole duration, so logins hash in gevent's native thread pool
+instead; hashlib releases the GIL while it works, so the event loop keeps
+serving other requests.
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _pool_size():
+    return int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+
+def get_hash_pool():
+    """Process pool for hashing, created lazily in each worker process"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: the worker process has threads and open database connections
+            _pool = ProcessPoolExecutor(max_workers=_pool_size(), mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _run_blocking(func, *args):
+    """Call func off the event loop when running under gevent, directly otherwise"""
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            import gevent
+            return gevent.get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+def hash_password(password):
+    return _run_blocking(generate_password_hash, password)
+
+
+def verify_password(password_hash, password):
+    return _run_blocking(check_password_hash, password_hash, password)
+
+
+def hash_passwords(passwords, chunksize=32):
+    """Hash a list of passwords in parallel, preserving order"""
+    return list(get_hash_pool().map(generate_password_hash, passwords, chunksize=chunksize))
@@ -0,0 +1,102 @@
+"""
+Query-plan checks for the hot queries.
+
+Each entry in HOT_QUERIES builds a statement the app runs on a busy path and
+names the table that must be read through an index. `check_query_plans`
+EXPLAINs every statement on the primary database and reports a full scan of
+that table, or an explicit sort where the index should already return rows in
+order. `flask check-query-plans` exits non-zero on a regression, so CI can
+run it against both SQLite and Postgres.
+
+Postgres would happily seq-scan the small tables of a test database, so the
+check disables seq scans and sorts for the EXPLAIN: when a usable index
+exists the planner then picks it, and when it does not the plan still shows
+the scan or sort.
+"""
+
+import json
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import (TestResult, Test, Question, QuestionStats, ScoreBucket, AttemptSession, StudentSummary,
+                    query_result_listing)
+
+HotQuery = namedtuple('HotQuery', ['name', 'table', 'ordered', 'build'])
+
+HOT_QUERIES = [
+    HotQuery('student result listing', 'test_results', True,
+             lambda: query_result_listing(TestResult.student_id == 1)
+             .order_by(TestResult.submitted_at, TestResult.id).limit(100).statement),
+    HotQuery('test result listing', 'test_results', True,
+             lambda: query_result_listing(TestResult.test_id == 1)
+             .order_by(TestResult.submitted_at, TestResult.id).limit(100).statement),
+    HotQuery('leaderboard page', 'test_results', True,
+             lambda: select(TestResult.id, TestResult.marks_obtained).where(TestResult.test_id == 1)
+             .order_by(TestResult.marks_obtained.desc(), TestResult.submitted_at, TestResult.id).limit(100)),
+    HotQuery('test questions', 'questions', True,
+             lambda: select(Question).where(Question.test_id == 1).order_by(Question.order, Question.id)),
+    HotQuery('tests using an image', 'questions', False,
+             lambda: select(Question.test_id).where(Question.image_hash == 'x').distinct()),
+    HotQuery('teacher test listing', 'tests', False,
+             lambda: select(Test).where(Test.teacher_id == 1)),
+    HotQuery('question statistics', 'question_stats', False,
+             lambda: select(QuestionStats).where(QuestionStats.test_id == 1)),
+    HotQuery('score histogram', 'score_buckets', False,
+             lambda: select(ScoreBucket).where(ScoreBucket.test_id == 1)),
+    HotQuery('attempt in progress', 'attempt_sessions', False,
+             lambda: select(AttemptSession).where(AttemptSession.student_id == 1, AttemptSession.test_id == 1,
+                                                  AttemptSession.status == 'in_progress')),
+    HotQuery('student summary', 'student_summaries', False,
+             lambda: select(StudentSummary).where(StudentSummary.student_id == 1)),
+]
+
+
+def _sqlite_problems(conn, sql, hot_query):
+    details = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+    problems = []
+    for detail in details:
+        words = detail.split()
+        # "SCAN test_results" is a full scan; "SCAN t USING INDEX ..." walks an index in order
+        if words[:2] == ['SCAN', hot_query.table] and 'INDEX' not in words:
+            problems.append(f'full scan of {hot_query.table}')
+        if hot_query.ordered and detail.startswith('USE TEMP B-TREE FOR'):
+            problems.append('sorts instead of reading an index in order')
+    return details, problems
+
+
+def _postgres_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _postgres_nodes(child)
+
+
+def _postgres_problems(conn, sql, hot_query):
+    with conn.begin():
+        conn.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        conn.exec_driver_sql('SET LOCAL enable_sort = off')
+        plan = conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}').scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = list(_postgres_nodes(plan[0]['Plan']))
+    details = [f"{node['Node Type']} {node.get('Relation Name', '')} {node.get('Index Name', '')}".strip()
+               for node in nodes]
+    problems = []
+    for node in nodes:
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == hot_query.table:
+            problems.append(f'full scan of {hot_query.table}')
+        if hot_query.ordered and node['Node Type'] in ('Sort', 'Incremental Sort'):
+            problems.append('sorts instead of reading an index in order')
+    return details, problems
+
+
+def check_query_plans(engine):
+    """[(HotQuery, plan lines, problems)] for every hot query"""
+    explain = _postgres_problems if engine.dialect.name == 'postgresql' else _sqlite_problems
+    report = []
+    with engine.connect() as conn:
+        for hot_query in HOT_QUERIES:
+            sql = str(hot_query.build().compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+            details, problems = explain(conn, sql, hot_query)
+            report.append((hot_query, details, problems))
+    return report
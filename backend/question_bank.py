@@ -0,0 +1,146 @@
+"""
+Question validation and streaming question-bank import.
+
+`validate_questions` checks a whole batch column by column and returns every
+error at once; `create_test` and the bulk import both use it.
+
+The bulk import reads either NDJSON (first line the test, then one question
+per line) or a multipart upload (a `test` JSON field, a `questions` CSV file
+and image files referenced by name from the CSV's `image` column). Questions
+are parsed one at a time and their images are staged in the image store, so
+only the question text and image hashes are ever held in memory. Staged
+images are published once the test is saved and discarded if it is rejected.
+"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import insert
+
+from models import db, Question, OPTION_CODES
+from image_store import InvalidImageError
+
+QUESTION_FIELDS = ('text', 'optionA', 'optionB', 'optionC', 'optionD', 'correct', 'image')
+INSERT_BATCH_SIZE = 500
+
+
+class QuestionImportError(ValueError):
+    """Raised when an upload cannot be parsed at all"""
+
+
+def validate_questions(questions):
+    """Return a list of {'row', 'message'} errors covering every invalid question"""
+    errors = []
+    texts = [q.get('text') for q in questions]
+    options = {letter: [q.get(f'option{letter}') for q in questions] for letter in 'ABCD'}
+    corrects = [q.get('correct') for q in questions]
+
+    for idx, text in enumerate(texts):
+        if not text:
+            errors.append((idx, 0, 'Question text is required'))
+    for idx in range(len(questions)):
+        missing = [letter for letter in 'ABCD' if not options[letter][idx]]
+        if missing:
+            errors.append((idx, 1, f'Missing options: {", ".join(missing)}'))
+    for idx, correct in enumerate(corrects):
+        if not correct:
+            errors.append((idx, 2, 'Correct answer is required'))
+        elif str(correct).strip().upper() not in OPTION_CODES:
+            errors.append((idx, 2, 'Correct answer must be A, B, C or D'))
+    for idx, q in enumerate(questions):
+        if q.get('image_error'):
+            errors.append((idx, 3, q['image_error']))
+
+    errors.sort()
+    return [{'row': idx + 1, 'message': f'Question {idx + 1}: {message}'} for idx, _, message in errors]
+
+
+def prepare_question(q_data, store_image, images=None):
+    """Normalise one uploaded question, staging its image and keeping only the hash"""
+    question = {field: q_data.get(field) for field in QUESTION_FIELDS}
+    if question['correct']:
+        question['correct'] = str(question['correct']).strip().upper()
+
+    image = question.pop('image')
+    question['image_hash'] = None
+    if image:
+        try:
+            if images is not None:
+                # Multipart uploads reference image files by name
+                upload = images.get(image)
+                if upload is None:
+                    raise InvalidImageError(f'Image file {image} was not uploaded')
+                question['image_hash'] = store_image(upload.read(), raw=True)
+            else:
+                question['image_hash'] = store_image(image)
+        except InvalidImageError as e:
+            question['image_error'] = str(e)
+    return question
+
+
+def iter_ndjson_upload(stream):
+    """Yield the test metadata object, then each question object, from an NDJSON stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig')
+    for line_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise QuestionImportError(f'Line {line_number} is not valid JSON')
+        if not isinstance(record, dict):
+            raise QuestionImportError(f'Line {line_number} must be a JSON object')
+        yield record
+
+
+def read_ndjson_upload(stream, store_image):
+    records = iter_ndjson_upload(stream)
+    test_data = next(records, None)
+    if test_data is None:
+        raise QuestionImportError('Upload is empty')
+    questions = [prepare_question(record, store_image) for record in records]
+    return test_data, questions
+
+
+def read_multipart_upload(form, files, store_image):
+    try:
+        test_data = json.loads(form.get('test') or '{}')
+    except ValueError:
+        raise QuestionImportError('The test field must be a JSON object')
+    questions_file = files.get('questions')
+    if questions_file is None:
+        raise QuestionImportError('A questions CSV file is required')
+
+    images = {}
+    for upload in files.getlist('images'):
+        images[upload.filename] = upload
+
+    reader = csv.DictReader(io.TextIOWrapper(questions_file.stream, encoding='utf-8-sig', newline=''))
+    if not reader.fieldnames or 'text' not in reader.fieldnames:
+        raise QuestionImportError('The questions CSV must have a header row with a text column')
+    questions = [prepare_question(row, store_image, images) for row in reader]
+    return test_data, questions
+
+
+def insert_questions(test_id, questions):
+    """Bulk insert validated questions in chunks inside the caller's transaction; returns their ids"""
+    for start in range(0, len(questions), INSERT_BATCH_SIZE):
+        chunk = questions[start:start + INSERT_BATCH_SIZE]
+        db.session.execute(insert(Question), [
+            {
+                'test_id': test_id,
+                'question_text': q['text'],
+                'option_a': q['optionA'],
+                'option_b': q['optionB'],
+                'option_c': q['optionC'],
+                'option_d': q['optionD'],
+                'correct_answer': q['correct'],
+                'order': start + idx + 1,
+                'image_hash': q['image_hash']
+            }
+            for idx, q in enumerate(chunk)
+        ])
+    return [question_id for (question_id,) in db.session.query(Question.id)
+            .filter(Question.test_id == test_id)
+            .order_by(Question.order, Question.id)]
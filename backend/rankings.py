@@ -0,0 +1,153 @@
+"""
+Percentile rank and leaderboard per test.
+
+`score_buckets` holds a histogram of each test's results: one row per
+distinct score with the number of results that got it. Every scored
+submission adds to its bucket with an upsert in the same transaction as the
+result row, so all workers share one consistent histogram in the database.
+
+Scores are whole marks between 0 and 4 x questions, so a test has at most a
+few hundred buckets however many students take it. A result's rank and
+percentile are one aggregate over those buckets instead of a sort of every
+result, and leaderboard pages read `ix_test_results_leaderboard` in order.
+
+Ranks are competition ranks: results with equal marks share a rank and the
+next rank skips ahead (1, 2, 2, 4). The percentile is the percentile rank
+(results below + half of the ties) / total x 100.
+"""
+
+from sqlalchemy import bindparam, case, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, TestResult, TestStats, ScoreBucket
+
+# Dialects with INSERT ... ON CONFLICT; others take the select-then-write path
+UPSERT_INSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def _upsert_buckets(rows):
+    """Add {'test_id', 'marks', 'count'} rows to their buckets, creating missing ones"""
+    dialect_insert = UPSERT_INSERTS.get(db.engine.dialect.name)
+    if dialect_insert is None:
+        _merge_buckets(rows)
+        return
+    stmt = dialect_insert(ScoreBucket.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['test_id', 'marks'],
+        set_={'count': ScoreBucket.__table__.c.count + stmt.excluded.count}
+    )
+    db.session.execute(stmt, rows)
+
+
+def _merge_buckets(rows):
+    """
+    Portable upsert: update the buckets that exist and insert the rest.
+
+    Callers have already updated the test's TestStats row in this transaction, and
+    that row lock keeps concurrent submissions from inserting the same bucket twice.
+    """
+    table = ScoreBucket.__table__
+    existing = set(db.session.execute(
+        select(table.c.test_id, table.c.marks)
+        .where(table.c.test_id.in_({row['test_id'] for row in rows}))
+        .with_for_update()
+    ).all())
+    updates = [row for row in rows if (row['test_id'], row['marks']) in existing]
+    inserts = [row for row in rows if (row['test_id'], row['marks']) not in existing]
+    if updates:
+        db.session.execute(
+            update(table)
+            .where(table.c.test_id == bindparam('b_test_id'), table.c.marks == bindparam('b_marks'))
+            .values(count=table.c.count + bindparam('b_count')),
+            [{f'b_{column}': value for column, value in row.items()} for row in updates]
+        )
+    if inserts:
+        db.session.execute(insert(table), inserts)
+
+
+def record_scores(test_id, marks):
+    """Add the marks of new results of one test to its histogram inside the caller's transaction"""
+    counts = {}
+    for m in marks:
+        counts[m] = counts.get(m, 0) + 1
+    if counts:
+        # Sorted so concurrent submissions lock buckets in the same order
+        _upsert_buckets([{'test_id': test_id, 'marks': m, 'count': n} for m, n in sorted(counts.items())])
+
+
+def rebuild_score_buckets(test_id):
+    """Recompute a test's histogram from its stored results"""
+    ScoreBucket.query.filter_by(test_id=test_id).delete(synchronize_session=False)
+    marks = func.coalesce(TestResult.marks_obtained, 0)
+    db.session.execute(
+        insert(ScoreBucket).from_select(
+            ['test_id', 'marks', 'count'],
+            select(TestResult.test_id, marks, func.count())
+            .where(TestResult.test_id == test_id)
+            .group_by(TestResult.test_id, marks)
+        )
+    )
+
+
+def stale_score_buckets():
+    """Ids of tests whose histogram does not add up to their result count"""
+    totals = (db.session.query(ScoreBucket.test_id, func.sum(ScoreBucket.count).label('total'))
+              .group_by(ScoreBucket.test_id)
+              .subquery())
+    rows = (db.session.query(TestStats.test_id)
+            .outerjoin(totals, totals.c.test_id == TestStats.test_id)
+            .filter(TestStats.attempts != func.coalesce(totals.c.total, 0))
+            .all())
+    return [row.test_id for row in rows]
+
+
+def _percentile(below, ties, total):
+    return round((below + ties / 2) / total * 100, 2) if total else None
+
+
+def get_standing(test_id, marks):
+    """{'rank', 'percentile', 'out_of'} of a result with these marks, or None before the histogram is built"""
+    marks = marks or 0
+    above, ties, total = db.session.query(
+        func.sum(case((ScoreBucket.marks > marks, ScoreBucket.count), else_=0)),
+        func.sum(case((ScoreBucket.marks == marks, ScoreBucket.count), else_=0)),
+        func.sum(ScoreBucket.count)
+    ).filter(ScoreBucket.test_id == test_id).one()
+    if not total:
+        return None
+    return {
+        'rank': above + 1,
+        'percentile': _percentile(total - above - ties, ties, total),
+        'out_of': total
+    }
+
+
+class Histogram:
+    """A test's score buckets loaded once to rank every entry of a leaderboard page"""
+
+    def __init__(self, test_id):
+        rows = (db.session.query(ScoreBucket.marks, ScoreBucket.count)
+                .filter(ScoreBucket.test_id == test_id, ScoreBucket.count > 0)
+                .order_by(ScoreBucket.marks.desc())
+                .all())
+        self.total = sum(count for _, count in rows)
+        self._above = {}
+        self._ties = {}
+        above = 0
+        for marks, count in rows:
+            self._above[marks] = above
+            self._ties[marks] = count
+            above += count
+
+    def __bool__(self):
+        return self.total > 0
+
+    def standing(self, marks):
+        marks = marks or 0
+        above = self._above.get(marks, 0)
+        ties = self._ties.get(marks, 0)
+        return {
+            'rank': above + 1,
+            'percentile': _percentile(self.total - above - ties, ties, self.total),
+            'out_of': self.total
+        }
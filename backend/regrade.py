@@ -0,0 +1,154 @@
+"""
+Bulk regrading of a test's results after its answer key changes.
+
+Results are read in chunks of REGRADE_CHUNK_SIZE in (submitted_at, id) order,
+which `ix_test_results_test_submitted` serves without sorting. Each chunk
+becomes an answer matrix of one row per result and one column per question
+holding the scored option code (0 for unanswered), and is scored with NumPy
+array operations instead of a Python loop per result. Marks are whole numbers
+between 0 and the test's maximum, so percentage and pass status are looked
+up in tables built once per key with the same arithmetic as
+`answer_keys.score_responses`; a regraded result is identical to a fresh
+submission of the same answers.
+
+Only results whose scores changed are written back, with one executemany
+UPDATE and a commit per chunk. If the answers change again while a regrade is
+running, the older job stops and leaves the rest to the regrade that change
+started. Other edits bump the test's version too (a rename, new image
+variants) but leave the key as it was, so the job carries on.
+"""
+
+import os
+
+import numpy as np
+from sqlalchemy import bindparam, update
+
+from models import db, Test, TestResult, packed_responses
+from answer_keys import MARKS_PER_CORRECT, MARKS_PER_WRONG, compile_answer_key
+from item_stats import legacy_responses, rebuild_test_stats
+from pagination import after_key
+from student_summaries import drop_test_summaries
+
+REGRADE_COLUMNS = (TestResult.id, TestResult.submitted_at, TestResult.answers_packed, TestResult.answers,
+                   TestResult.correct_count, TestResult.wrong_count, TestResult.unanswered_count,
+                   TestResult.marks_obtained, TestResult.max_marks, TestResult.percentage, TestResult.is_passed)
+SCORE_COLUMNS = ('correct_count', 'wrong_count', 'unanswered_count', 'marks_obtained', 'max_marks',
+                 'percentage', 'is_passed')
+
+
+def regrade_chunk_size():
+    return int(os.getenv('REGRADE_CHUNK_SIZE', 5000))
+
+
+def answer_matrix(key, rows):
+    """uint8 matrix of scored option codes, one row per result aligned to the key's question order"""
+    n = len(key)
+    vectors = []
+    for row in rows:
+        if row.answers_packed is not None:
+            responses = packed_responses(row.answers_packed)
+        else:
+            responses = legacy_responses(key, row.answers)
+        # Results packed before questions were added or removed are padded or cut to the key
+        vectors.append(responses[:n].ljust(n, b'\0'))
+    return np.frombuffer(b''.join(vectors), dtype=np.uint8).reshape(len(rows), n)
+
+
+def score_tables(key):
+    """Percentage and pass status of every possible mark, computed as score_responses does"""
+    max_marks = key.max_marks
+    percentages = [(marks / max_marks * 100) if max_marks > 0 else 0 for marks in range(max_marks + 1)]
+    return (np.array([round(percentage, 2) for percentage in percentages], dtype=np.float64),
+            np.array([percentage >= key.passing_marks for percentage in percentages], dtype=bool))
+
+
+def score_matrix(key, matrix, tables=None):
+    """Score every row of an answer matrix; returns {score column: array with one value per row}"""
+    percentage_table, passed_table = tables or score_tables(key)
+    correct_options = np.frombuffer(key.correct, dtype=np.uint8)
+    correct = np.count_nonzero(matrix == correct_options, axis=1)
+    answered = np.count_nonzero(matrix, axis=1)
+    wrong = answered - correct
+    marks = np.maximum(0, correct * MARKS_PER_CORRECT - wrong * MARKS_PER_WRONG)
+    return {
+        'correct_count': correct,
+        'wrong_count': wrong,
+        'unanswered_count': len(key) - answered,
+        'marks_obtained': marks,
+        'max_marks': np.full(len(matrix), key.max_marks),
+        'percentage': percentage_table[marks],
+        'is_passed': passed_table[marks],
+    }
+
+
+def changed_scores(rows, scores):
+    """Update parameters for the rows whose stored scores differ from the new ones"""
+    changed = np.zeros(len(rows), dtype=bool)
+    for column in SCORE_COLUMNS:
+        # NULLs become NaN, which never compares equal, so unscored rows are rewritten too
+        stored = np.array([getattr(row, column) for row in rows], dtype=np.float64)
+        changed |= stored != scores[column]
+    indexes = np.flatnonzero(changed)
+    if not len(indexes):
+        return []
+    # Plain Python values for the DB driver
+    columns = {column: scores[column][indexes].tolist() for column in SCORE_COLUMNS}
+    return [
+        {'b_id': rows[index].id, **{f'b_{column}': columns[column][i] for column in SCORE_COLUMNS}}
+        for i, index in enumerate(indexes.tolist())
+    ]
+
+
+def _update_statement():
+    table = TestResult.__table__
+    return (update(table)
+            .where(table.c.id == bindparam('b_id'))
+            .values({column: bindparam(f'b_{column}') for column in SCORE_COLUMNS}))
+
+
+def _superseded(key):
+    """True once the test was deleted, or its questions or correct answers changed, after this key was compiled"""
+    row = (db.session.query(Test.version, Test.passing_marks)
+           .filter(Test.id == key.test_id, Test.deleted_at.is_(None))
+           .first())
+    if row is None:
+        return True
+    if row.version == key.version:
+        return False
+    current = compile_answer_key(key.test_id, row.version, row.passing_marks or 0)
+    return current.question_ids != key.question_ids or current.correct != key.correct
+
+
+def regrade_test(job, key):
+    """Job body (job may be None): rescore every result of a test against its current answer key"""
+    chunk_size = regrade_chunk_size()
+    tables = score_tables(key)
+    stmt = _update_statement()
+    regraded = changed = 0
+    last = None
+    while True:
+        query = db.session.query(*REGRADE_COLUMNS).filter(TestResult.test_id == key.test_id)
+        if last is not None:
+            query = query.filter(after_key(TestResult.submitted_at, TestResult.id, *last))
+        rows = query.order_by(TestResult.submitted_at, TestResult.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last = (rows[-1].submitted_at, rows[-1].id)
+
+        updates = changed_scores(rows, score_matrix(key, answer_matrix(key, rows), tables))
+        if _superseded(key):
+            db.session.rollback()
+            return {'test_id': key.test_id, 'regraded': regraded, 'changed': changed, 'superseded': True}
+        if updates:
+            db.session.execute(stmt, updates)
+        regraded += len(rows)
+        changed += len(updates)
+        if job is not None:
+            job.processed = regraded
+        db.session.commit()
+
+    # Item statistics and the score histogram are rebuilt from the new scores; summaries on next read
+    rebuild_test_stats(key)
+    drop_test_summaries(key.test_id)
+    db.session.commit()
+    return {'test_id': key.test_id, 'regraded': regraded, 'changed': changed, 'superseded': False}
@@ -0,0 +1,119 @@
+"""
+Bulk student roster import.
+
+The upload (CSV, NDJSON or a JSON array) is parsed row by row from the
+request stream and validated in the request, so every problem in the file is
+reported up front. Valid rows are then imported by a background job that
+hashes passwords in a process pool and inserts students in batched
+executemany statements.
+"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import insert
+
+from models import db, Student, normalize_email
+from passwords import hash_passwords
+from jobs import add_job_errors
+
+ROSTER_FIELDS = ('email', 'password', 'name', 'roll_number')
+IMPORT_BATCH_SIZE = 500
+
+
+class RosterFormatError(ValueError):
+    """Raised when the upload cannot be parsed at all"""
+
+
+def iter_roster_rows(stream, content_type):
+    """Yield one dict per roster row from a request body stream"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    content_type = (content_type or '').split(';')[0].strip().lower()
+
+    if content_type in ('text/csv', 'application/csv'):
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or 'email' not in reader.fieldnames:
+            raise RosterFormatError('CSV must have a header row with at least an email column')
+        yield from reader
+    elif content_type in ('application/x-ndjson', 'application/ndjson'):
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise RosterFormatError(f'Line {line_number} is not valid JSON')
+    elif content_type == 'application/json':
+        try:
+            data = json.load(text)
+        except ValueError:
+            raise RosterFormatError('Body is not valid JSON')
+        if isinstance(data, dict):
+            data = data.get('students')
+        if not isinstance(data, list):
+            raise RosterFormatError('Expected a JSON array of students')
+        yield from data
+    else:
+        raise RosterFormatError('Upload must be text/csv, application/x-ndjson or application/json')
+
+
+def validate_roster(rows):
+    """Return (valid rows, errors); rows are numbered from 1 in upload order"""
+    valid = []
+    errors = []
+    seen = set()
+    for row_number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': row_number, 'message': 'Row must be an object'})
+            continue
+        email = normalize_email(row.get('email'))
+        password = row.get('password') or ''
+        if not email or '@' not in email:
+            errors.append({'row': row_number, 'email': email, 'message': 'A valid email is required'})
+            continue
+        if not password:
+            errors.append({'row': row_number, 'email': email, 'message': 'Password is required'})
+            continue
+        if email in seen:
+            errors.append({'row': row_number, 'email': email, 'message': 'Duplicate email in upload'})
+            continue
+        seen.add(email)
+        valid.append({
+            'row': row_number,
+            'email': email,
+            'password': password,
+            'name': (row.get('name') or '').strip() or email,
+            'roll_number': (row.get('roll_number') or '').strip() or None
+        })
+    return valid, errors
+
+
+def import_students(job, rows):
+    """Job body: create students in batches, recording per-row errors and progress on the job"""
+    created = 0
+    skipped = 0
+    for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+        batch = rows[start:start + IMPORT_BATCH_SIZE]
+
+        existing = {email for (email,) in db.session.query(Student.email)
+                    .filter(Student.email.in_([row['email'] for row in batch]))}
+        errors = [{'row': row['row'], 'email': row['email'], 'message': 'Student already exists'}
+                  for row in batch if row['email'] in existing]
+        batch = [row for row in batch if row['email'] not in existing]
+
+        hashes = hash_passwords([row['password'] for row in batch])
+        if batch:
+            db.session.execute(insert(Student), [
+                {'email': row['email'], 'name': row['name'], 'roll_number': row['roll_number'],
+                 'password_hash': password_hash}
+                for row, password_hash in zip(batch, hashes)
+            ])
+
+        created += len(batch)
+        skipped += len(errors)
+        add_job_errors(job, errors)
+        job.processed = min(start + IMPORT_BATCH_SIZE, len(rows))
+        db.session.commit()
+
+    return {'created': created, 'skipped': skipped}
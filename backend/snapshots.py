@@ -0,0 +1,131 @@
+"""
+Pre-serialized test-delivery snapshots.
+
+`GET /api/tests/<id>` returns the same bytes to every student taking a test,
+so each (test id, version) is serialized once into compact JSON with gzip and
+brotli variants. The variants are written to a directory shared by every
+gunicorn worker on the host and kept in a small in-process LRU, so a request
+costs one primary-key lookup of the test's version and a dict lookup.
+
+A snapshot never changes: any edit bumps the test's version, which selects a
+new snapshot. Versions are never reused, not even by a new test that gets a
+deleted test's id, and every request reads the current version from the
+database, so an edit or deletion in one worker reaches all of them.
+`invalidate` just frees the memory and files of versions that can no longer
+be requested.
+"""
+
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+_VARIANTS = ('json', 'json.gz', 'json.br')
+
+
+class DeliverySnapshot:
+    __slots__ = ('body', 'gzip', 'brotli', 'etag', 'mimetype')
+
+    def __init__(self, body, gzip_body, brotli_body):
+        self.body = body
+        self.gzip = gzip_body
+        self.brotli = brotli_body
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.mimetype = 'application/json'
+
+    @classmethod
+    def build(cls, data):
+        body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        return cls(
+            body,
+            gzip.compress(body, compresslevel=9, mtime=0),
+            brotli.compress(body, quality=9) if brotli is not None else None
+        )
+
+
+class SnapshotStore:
+    """Snapshots on disk plus an in-process LRU of the most recently served ones"""
+
+    def __init__(self, directory, maxsize=64):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, test_id, version, variant):
+        return os.path.join(self.directory, f'{test_id}-{version}.{variant}')
+
+    def get(self, test_id, version, build):
+        """Snapshot of a test version; `build()` returns the payload dict when it has to be created"""
+        key = (test_id, version)
+        with self._lock:
+            snapshot = self._cache.get(key)
+            if snapshot is not None:
+                self._cache.move_to_end(key)
+                return snapshot
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        # One build per version in this worker; other workers pick up the files
+        with build_lock:
+            snapshot = self._cache.get(key) or self._read(test_id, version)
+            if snapshot is None:
+                snapshot = DeliverySnapshot.build(build())
+                self._write(test_id, version, snapshot)
+            with self._lock:
+                self._cache[key] = snapshot
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+                self._build_locks.pop(key, None)
+        return snapshot
+
+    def _read(self, test_id, version):
+        try:
+            with open(self._path(test_id, version, 'json'), 'rb') as f:
+                body = f.read()
+            with open(self._path(test_id, version, 'json.gz'), 'rb') as f:
+                gzip_body = f.read()
+        except FileNotFoundError:
+            return None
+        brotli_body = None
+        if brotli is not None:
+            try:
+                with open(self._path(test_id, version, 'json.br'), 'rb') as f:
+                    brotli_body = f.read()
+            except FileNotFoundError:
+                brotli_body = brotli.compress(body, quality=9)
+        return DeliverySnapshot(body, gzip_body, brotli_body)
+
+    def _write(self, test_id, version, snapshot):
+        # Compressed variants first: a reader that finds the plain body finds the rest too
+        for variant, data in (('json.br', snapshot.brotli), ('json.gz', snapshot.gzip), ('json', snapshot.body)):
+            if data is None:
+                continue
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(test_id, version, variant))
+
+    def invalidate(self, test_id):
+        """Drop every stored version of a test"""
+        test_id = int(test_id)
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == test_id]:
+                del self._cache[key]
+        for variant in _VARIANTS:
+            for path in glob.glob(os.path.join(self.directory, f'{test_id}-*.{variant}')):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,176 @@
+"""
+In-memory manifest of the frontend files.
+
+The manifest is built once at startup: every file is read, hashed and
+precompressed (gzip, plus brotli when the module is installed), so serving a
+static file is a dict lookup followed by writing bytes that are already in
+memory. Each file is also reachable under a content-hashed name such as
+`style.3f2a9c1b.css`. HTML pages are rewritten to reference those names,
+which can then be cached for a year, while the pages themselves are
+revalidated cheaply with their ETag.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+_COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+_REFERENCE_RE = re.compile(r'''(?P<attr>\b(?:src|href)=)(?P<quote>["'])(?P<url>[^"'#?:]+)(?P=quote)''')
+_RELOAD_CHECK_INTERVAL = 1.0
+
+
+class StaticAsset:
+    __slots__ = ('name', 'body', 'mimetype', 'etag', 'gzip', 'brotli', 'hashed_name')
+
+    def __init__(self, name, body, mimetype):
+        self.name = name
+        self.body = body
+        self.mimetype = mimetype
+        digest = hashlib.sha256(body).hexdigest()
+        self.etag = digest[:32]
+        self.gzip = None
+        self.brotli = None
+        if mimetype.startswith(_COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(compressed) < len(body):
+                self.gzip = compressed
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.brotli = compressed
+        root, ext = os.path.splitext(name)
+        self.hashed_name = f'{root}.{digest[:8]}{ext}'
+
+
+class StaticManifest:
+    """Maps request paths to preloaded assets, optionally rebuilding when files change"""
+
+    def __init__(self, root, reload=False):
+        self.root = root
+        self.reload = reload
+        self._assets = {}
+        self._hashed = {}
+        self._signature = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+        self.build()
+
+    def _scan(self):
+        files = []
+        if self.root and os.path.isdir(self.root):
+            for dirpath, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                    files.append((name, path, os.stat(path).st_mtime_ns))
+        return sorted(files)
+
+    def build(self):
+        files = self._scan()
+        assets = {}
+        html = []
+        for name, path, _ in files:
+            with open(path, 'rb') as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if mimetype == 'text/html':
+                html.append((name, body))
+            else:
+                assets[name] = StaticAsset(name, body, mimetype)
+
+        # Point pages at hashed asset names so those can be cached forever; links between pages stay as they are
+        hashable = dict(assets)
+        for name, body in html:
+            base = os.path.dirname(name)
+            assets[name] = StaticAsset(name, self._rewrite_references(body, base, hashable), 'text/html')
+
+        self._assets = assets
+        self._hashed = {asset.hashed_name: asset for asset in assets.values() if asset.mimetype != 'text/html'}
+        self._signature = [(name, mtime) for name, _, mtime in files]
+        self._last_check = time.monotonic()
+
+    @staticmethod
+    def _rewrite_references(body, base, assets):
+        text = body.decode('utf-8')
+
+        def replace(match):
+            url = match.group('url')
+            target = assets.get(os.path.normpath(os.path.join(base, url)).replace(os.sep, '/'))
+            if target is None or url.startswith('/'):
+                return match.group(0)
+            hashed = os.path.join(os.path.dirname(url), os.path.basename(target.hashed_name)).replace(os.sep, '/')
+            return f"{match.group('attr')}{match.group('quote')}{hashed}{match.group('quote')}"
+
+        return _REFERENCE_RE.sub(replace, text).encode('utf-8')
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._last_check < _RELOAD_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if now - self._last_check < _RELOAD_CHECK_INTERVAL:
+                return
+            self._last_check = now
+            signature = [(name, mtime) for name, _, mtime in self._scan()]
+            if signature != self._signature:
+                self.build()
+
+    def lookup(self, path):
+        """Return (asset, immutable) for a request path, or (None, False)"""
+        if self.reload:
+            self._maybe_reload()
+        name = path.lstrip('/') or 'index.html'
+        asset = self._assets.get(name)
+        if asset is not None:
+            return asset, False
+        asset = self._hashed.get(name)
+        return asset, asset is not None
+
+    def serve(self, request, path):
+        """Build the response for a static path, or return None if there is no such file"""
+        asset, immutable = self.lookup(path)
+        if asset is None:
+            return None
+        return encoded_response(request, asset, IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL)
+
+
+def encoded_response(request, asset, cache_control):
+    """
+    Response for anything with body/gzip/brotli/etag/mimetype attributes: picks the best
+    encoding the client accepts and answers 304 when its ETag matches.
+    """
+    body = asset.body
+    encoding = None
+    if asset.brotli is not None and request.accept_encodings['br']:
+        body, encoding = asset.brotli, 'br'
+    elif asset.gzip is not None and request.accept_encodings['gzip']:
+        body, encoding = asset.gzip, 'gzip'
+    # Strong ETags must differ between encodings of the same file
+    etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': cache_control,
+    }
+    if asset.gzip is not None or asset.brotli is not None:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if etag in request.if_none_match or asset.etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
@@ -0,0 +1,132 @@
+"""
+Materialized per-student performance summaries.
+
+`student_summaries` keeps one row per student with their attempt count,
+percentage total, pass count, best and worst percentage and their most
+recent results. Every new result updates the row in the same transaction
+as the result itself, so the student home page is a single-row lookup no
+matter how many tests the student has taken.
+
+Rows are built from the student's full history the first time they are
+read or the student next submits, whichever comes first. A submission that
+finds no row builds it from a history that already holds the new results;
+if a concurrent read inserts the row first, that row was built from
+committed results only, and the new ones are added to it. Deleting a test
+drops the summaries of its students, which are then rebuilt the same way.
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Test, TestResult, StudentSummary
+
+RECENT_RESULTS = 5
+SUMMARY_COLUMNS = (TestResult.id, TestResult.test_id, TestResult.marks_obtained, TestResult.max_marks,
+                   TestResult.percentage, TestResult.is_passed, TestResult.submitted_at)
+
+
+def _add_results(summary, results, test_names):
+    """Fold result values (dicts with the SUMMARY_COLUMNS keys) into a summary"""
+    for values in results:
+        percentage = values['percentage'] or 0
+        summary.attempts = (summary.attempts or 0) + 1
+        summary.passed_count = (summary.passed_count or 0) + (1 if values['is_passed'] else 0)
+        summary.percentage_sum = (summary.percentage_sum or 0) + percentage
+        if summary.best_percentage is None or percentage > summary.best_percentage:
+            summary.best_percentage = percentage
+        if summary.worst_percentage is None or percentage < summary.worst_percentage:
+            summary.worst_percentage = percentage
+        if summary.last_submitted_at is None or values['submitted_at'] > summary.last_submitted_at:
+            summary.last_submitted_at = values['submitted_at']
+
+    newest = sorted(results, key=lambda values: (values['submitted_at'], values['id']), reverse=True)
+    recent = [{
+        'result_id': values['id'],
+        'test_id': values['test_id'],
+        'test_name': test_names.get(values['test_id']),
+        'marks_obtained': values['marks_obtained'],
+        'max_marks': values['max_marks'],
+        'percentage': values['percentage'],
+        'is_passed': values['is_passed'],
+        'submitted_at': values['submitted_at'].isoformat()
+    } for values in newest[:RECENT_RESULTS]]
+    # Reassigned rather than mutated so the JSON column is marked as changed
+    summary.recent = (recent + (summary.recent or []))[:RECENT_RESULTS]
+
+
+def _test_names(test_ids):
+    return dict(db.session.query(Test.id, Test.name).filter(Test.id.in_(set(test_ids))).all())
+
+
+def record_results(results):
+    """
+    Add new results to their students' summaries inside the caller's transaction.
+
+    `results` are dicts of TestResult column values including the new row's id and
+    submitted_at, already flushed. Students without a summary get one built from
+    their history, which includes these results.
+    """
+    by_student = {}
+    for values in results:
+        by_student.setdefault(values['student_id'], []).append(values)
+    if not by_student:
+        return
+
+    # Locked in student order so concurrent batches cannot deadlock
+    summaries = (StudentSummary.query
+                 .filter(StudentSummary.student_id.in_(by_student))
+                 .order_by(StudentSummary.student_id)
+                 .with_for_update()
+                 .all())
+    test_names = _test_names(values['test_id'] for values in results)
+    for summary in summaries:
+        _add_results(summary, by_student[summary.student_id], test_names)
+    for student_id in sorted(set(by_student) - {summary.student_id for summary in summaries}):
+        _build_summary(student_id, by_student[student_id], test_names)
+
+
+def _build_summary(student_id, results, test_names):
+    """Build a missing summary in the caller's transaction, or add the results to one built concurrently"""
+    try:
+        with db.session.begin_nested():
+            rebuild_student_summary(student_id)
+    except IntegrityError:
+        # Inserted by a read that committed first; it could not see these uncommitted results
+        summary = StudentSummary.query.filter_by(student_id=student_id).with_for_update().one()
+        _add_results(summary, results, test_names)
+
+
+def rebuild_student_summary(student_id):
+    """Recompute a student's summary from all of their results of live tests and return it"""
+    StudentSummary.query.filter_by(student_id=student_id).delete(synchronize_session=False)
+    summary = StudentSummary(student_id=student_id, attempts=0, passed_count=0, percentage_sum=0, recent=[])
+    rows = (db.session.query(*SUMMARY_COLUMNS)
+            .join(Test, Test.id == TestResult.test_id)
+            .filter(TestResult.student_id == student_id, Test.deleted_at.is_(None))
+            .order_by(TestResult.submitted_at, TestResult.id)
+            .all())
+    results = [row._asdict() for row in rows]
+    _add_results(summary, results, _test_names(values['test_id'] for values in results))
+    db.session.add(summary)
+    return summary
+
+
+def get_student_summary(student_id):
+    """The student's summary, built from their history on first read"""
+    summary = db.session.get(StudentSummary, student_id)
+    if summary is None:
+        summary = rebuild_student_summary(student_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Built by a concurrent request first
+            db.session.rollback()
+            summary = db.session.get(StudentSummary, student_id)
+    return summary
+
+
+def drop_test_summaries(test_id):
+    """Drop the summaries of everyone who took a test whose results are being deleted"""
+    student_ids = db.session.query(TestResult.student_id).filter(TestResult.test_id == test_id).distinct()
+    StudentSummary.query.filter(StudentSummary.student_id.in_(student_ids.scalar_subquery())).delete(
+        synchronize_session=False
+    )
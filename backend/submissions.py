@@ -0,0 +1,239 @@
+"""
+Submission ingestion.
+
+`build_result_values` turns a scored submission into TestResult column values
+and is shared by the direct path in `submit_test` and the write-behind spool.
+
+In spool mode (SUBMISSION_INGEST_MODE=spool) a submission is appended to a
+host-local SQLite spool and acknowledged with a receipt id straight away. A
+background flusher in each worker claims pending submissions, scores them and
+writes the TestResult rows to the main database in batched multi-row inserts.
+Each result carries its receipt id, so a crash between the insert and marking
+the spool row completed never produces a duplicate result.
+"""
+
+import json
+import sqlite3
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from models import db, AttemptSession, TestResult, pack_answers
+from local_store import LocalStore
+from answer_keys import score_submission
+from item_stats import record_submissions
+from student_summaries import record_results
+
+SPOOL_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS submissions (
+    receipt_id TEXT PRIMARY KEY,
+    idempotency_key TEXT UNIQUE,
+    student_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    claim TEXT,
+    claimed_at REAL,
+    result_id INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_submissions_status ON submissions (status, created_at);
+CREATE INDEX IF NOT EXISTS ix_submissions_claim ON submissions (claim);
+'''
+
+# Submissions claimed by a worker that died mid-flush are retried after this many seconds
+CLAIM_TIMEOUT = 60
+
+
+def build_result_values(key, student_id, answers, marked_for_review, question_status):
+    """Score a submission and return (TestResult column values, Score)"""
+    score = score_submission(key, answers, question_status)
+    values = {
+        'student_id': student_id,
+        'test_id': key.test_id,
+        'answers_packed': pack_answers(key.question_keys, answers, marked_for_review, question_status),
+        'marks_obtained': score.marks_obtained,
+        'max_marks': score.max_marks,
+        'percentage': score.percentage,
+        'correct_count': score.correct_count,
+        'wrong_count': score.wrong_count,
+        'unanswered_count': score.unanswered_count,
+        'is_passed': score.is_passed
+    }
+    return values, score
+
+
+def record_scored(entries):
+    """Update derived statistics for (key, score) pairs inside the caller's transaction"""
+    by_test = {}
+    for key, score in entries:
+        by_test.setdefault(key.test_id, (key, []))[1].append((score.responses, score.marks_obtained))
+    for key, scored in by_test.values():
+        record_submissions(key, scored)
+
+
+class SubmissionSpool:
+    """Durable append-only queue of submissions waiting to be written to the main database"""
+
+    def __init__(self, path):
+        self.store = LocalStore(path, SPOOL_SCHEMA)
+
+    def enqueue(self, student_id, test_id, payload, idempotency_key=None):
+        """Spool a submission and return its row; retries with the same key and test return the original row"""
+        # Scoped to the student and test, so a key reused on another test never swallows that submission
+        scoped_key = f'{student_id}:{test_id}:{idempotency_key}' if idempotency_key else None
+        receipt_id = str(uuid.uuid4())
+        conn = self.store.connection()
+        try:
+            conn.execute(
+                'INSERT INTO submissions (receipt_id, idempotency_key, student_id, test_id, payload, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (receipt_id, scoped_key, student_id, test_id, json.dumps(payload), time.time())
+            )
+        except sqlite3.IntegrityError:
+            return conn.execute('SELECT * FROM submissions WHERE idempotency_key = ?', (scoped_key,)).fetchone()
+        return self.get(receipt_id)
+
+    def get(self, receipt_id):
+        return self.store.connection().execute(
+            'SELECT * FROM submissions WHERE receipt_id = ?', (receipt_id,)
+        ).fetchone()
+
+    def claim(self, batch_size):
+        """Atomically claim up to batch_size pending submissions for this worker"""
+        claim = uuid.uuid4().hex
+        now = time.time()
+        with self.store.transaction() as conn:
+            conn.execute(
+                "UPDATE submissions SET status = 'pending', claim = NULL "
+                "WHERE status = 'flushing' AND claimed_at < ?",
+                (now - CLAIM_TIMEOUT,)
+            )
+            conn.execute(
+                "UPDATE submissions SET status = 'flushing', claim = ?, claimed_at = ? "
+                "WHERE receipt_id IN (SELECT receipt_id FROM submissions WHERE status = 'pending' "
+                "ORDER BY created_at LIMIT ?)",
+                (claim, now, batch_size)
+            )
+        return self.store.connection().execute(
+            'SELECT * FROM submissions WHERE claim = ? ORDER BY created_at', (claim,)
+        ).fetchall()
+
+    def complete(self, result_ids):
+        """Mark submissions completed; result_ids maps receipt id -> TestResult id"""
+        with self.store.transaction() as conn:
+            conn.executemany(
+                "UPDATE submissions SET status = 'completed', result_id = ?, claim = NULL, error = NULL "
+                "WHERE receipt_id = ?",
+                [(result_id, receipt_id) for receipt_id, result_id in result_ids.items()]
+            )
+
+    def fail(self, receipt_id, error):
+        self.store.connection().execute(
+            "UPDATE submissions SET status = 'failed', error = ?, claim = NULL WHERE receipt_id = ?",
+            (error, receipt_id)
+        )
+
+    def release(self, receipt_ids):
+        """Return claimed submissions to the queue after a transient error"""
+        with self.store.transaction() as conn:
+            conn.executemany(
+                "UPDATE submissions SET status = 'pending', claim = NULL WHERE receipt_id = ?",
+                [(receipt_id,) for receipt_id in receipt_ids]
+            )
+
+    def pending_count(self):
+        return self.store.connection().execute(
+            "SELECT COUNT(*) FROM submissions WHERE status IN ('pending', 'flushing')"
+        ).fetchone()[0]
+
+
+def flush_spool(spool, answer_keys, batch_size=200):
+    """Write one batch of spooled submissions to the main database; returns True if a batch was claimed"""
+    claimed = spool.claim(batch_size)
+    if not claimed:
+        return False
+
+    rows = {}
+    for submission in claimed:
+        key = answer_keys.get(submission['test_id'])
+        if key is None:
+            spool.fail(submission['receipt_id'], 'Test not found')
+            continue
+        payload = json.loads(submission['payload'])
+        values, score = build_result_values(
+            key,
+            submission['student_id'],
+            payload.get('answers', {}),
+            payload.get('marked_for_review', {}),
+            payload.get('question_status', {})
+        )
+        values['receipt_id'] = submission['receipt_id']
+        values['submitted_at'] = datetime.utcfromtimestamp(submission['created_at'])
+        rows[submission['receipt_id']] = (values, key, score)
+
+    if not rows:
+        return True
+
+    try:
+        _insert_results(list(rows.values()))
+    except OperationalError as e:
+        # Database unavailable: leave everything queued for the next flush
+        db.session.rollback()
+        spool.release(rows.keys())
+        print(f"[ERROR] Flushing submissions failed, will retry: {str(e)}")
+        return False
+    except Exception as e:
+        db.session.rollback()
+        print(f"[ERROR] Batch insert of {len(rows)} submissions failed, retrying one by one: {str(e)}")
+        for receipt_id, entry in list(rows.items()):
+            try:
+                _insert_results([entry])
+            except Exception as row_error:
+                db.session.rollback()
+                spool.fail(receipt_id, str(row_error))
+                del rows[receipt_id]
+
+    spool.complete(_result_ids(rows.keys()))
+    return True
+
+
+def _insert_results(entries):
+    """Insert (values, key, score) entries, their statistics and student summaries in one transaction"""
+    # Results already written by a flush that crashed before marking the spool are skipped
+    existing = _result_ids(values['receipt_id'] for values, _, _ in entries)
+    entries = [entry for entry in entries if entry[0]['receipt_id'] not in existing]
+    if entries:
+        db.session.execute(insert(TestResult), [values for values, _, _ in entries])
+        record_scored((key, score) for _, key, score in entries)
+        result_ids = _result_ids(values['receipt_id'] for values, _, _ in entries)
+        record_results([{**values, 'id': result_ids[values['receipt_id']]} for values, _, _ in entries])
+        _link_attempts(result_ids.keys())
+    db.session.commit()
+
+
+def _link_attempts(receipt_ids):
+    """Point attempts submitted through the spool at their new results"""
+    attempts = AttemptSession.__table__
+    results = TestResult.__table__
+    db.session.execute(
+        update(attempts)
+        .where(attempts.c.receipt_id.in_(list(receipt_ids)))
+        .values(result_id=select(results.c.id)
+                .where(results.c.receipt_id == attempts.c.receipt_id)
+                .scalar_subquery())
+    )
+
+
+def _result_ids(receipt_ids):
+    receipt_ids = list(receipt_ids)
+    if not receipt_ids:
+        return {}
+    return dict(db.session.query(TestResult.receipt_id, TestResult.id)
+                .filter(TestResult.receipt_id.in_(receipt_ids))
+                .all())
+
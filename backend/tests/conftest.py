@@ -0,0 +1,89 @@
+"""
+Shared fixtures: one app per test session on a throwaway SQLite database.
+
+The app reads its configuration when it is imported, so every path it
+writes to is pointed at a temporary directory before the import.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_instance = tempfile.mkdtemp(prefix='nano-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{_instance}/test.db'
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+for name, path in [('IMAGE_STORE_DIR', 'images'), ('SUBMISSION_SPOOL_PATH', 'submission_spool.db'),
+                   ('ATTEMPT_STORE_PATH', 'attempt_store.db'), ('METRICS_DIR', 'metrics'),
+                   ('SNAPSHOT_DIR', 'snapshots'), ('CACHE_DIR', 'cache')]:
+    os.environ[name] = os.path.join(_instance, path)
+
+import app as app_module  # noqa: E402
+
+
+def question(correct='A', image=None):
+    return {'text': 'q', 'optionA': 'a', 'optionB': 'b', 'optionC': 'c', 'optionD': 'd',
+            'correct': correct, 'image': image}
+
+
+@pytest.fixture
+def app():
+    app_module.app.config['SUBMISSION_INGEST_MODE'] = 'direct'
+    return app_module.app
+
+
+@pytest.fixture
+def context(app):
+    """An app context for direct database access; requests made meanwhile share its session and g"""
+    with app.app_context():
+        yield
+        app_module.db.session.rollback()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def teacher(client):
+    token = client.post('/api/auth/teacher-login',
+                        json={'teacher_id': 'nano123', 'password': 'nano123'}).json['access_token']
+    return {'Authorization': f'Bearer {token}'}
+
+
+@pytest.fixture
+def login_student(client):
+    """Log in (and on first use create) a student; returns (headers, student id)"""
+    def login(email):
+        data = client.post('/api/auth/student-login', json={'email': email, 'password': 'pw'}).json
+        return {'Authorization': f"Bearer {data['access_token']}"}, data['user']['id']
+    return login
+
+
+@pytest.fixture
+def make_test(client, teacher):
+    """Create a test whose correct answers cycle A, B, C, D; returns its dict with questions"""
+    def make(count=4, **fields):
+        body = {'name': 't', 'passing_marks': 40, **fields,
+                'questions': [question('ABCD'[i % 4]) for i in range(count)]}
+        test_id = client.post('/api/tests', json=body, headers=teacher).json['test']['id']
+        return client.get(f'/api/tests/{test_id}').json
+    return make
+
+
+@pytest.fixture
+def submit(client):
+    """Submit answers ({question index: option}) to a test directly; returns the response"""
+    def submit_answers(test, headers, answers, **kwargs):
+        ids = [str(q['id']) for q in test['questions']]
+        chosen = {ids[i]: option for i, option in answers.items()}
+        return client.post('/api/results/submit', headers=headers, json={
+            'test_id': test['id'], 'answers': chosen,
+            'question_status': {q_id: 'answered' for q_id in chosen}
+        }, **kwargs)
+    return submit_answers
@@ -0,0 +1,107 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as app_module
+import models
+from models import db
+
+
+@pytest.fixture
+def attempt(client, make_test, login_student):
+    """Start an attempt at a 30-minute test; returns (student headers, attempt dict)"""
+    def start(email):
+        test = make_test(4, duration=30)
+        headers, _ = login_student(email)
+        response = client.post('/api/attempts', json={'test_id': test['id']}, headers=headers)
+        assert response.status_code == 201
+        return headers, response.json['attempt']
+    return start
+
+
+def overdue(app, attempt_id, days=2):
+    """Move an attempt's deadline into the past, as if the student left it open for days"""
+    with app.app_context():
+        row = db.session.get(models.AttemptSession, attempt_id)
+        row.expires_at = datetime.utcnow() - timedelta(days=days)
+        db.session.commit()
+
+
+def status(app, attempt_id):
+    with app.app_context():
+        return db.session.get(models.AttemptSession, attempt_id).status
+
+
+def test_resuming_an_overdue_attempt_starts_a_new_one(app, client, attempt):
+    headers, stale = attempt('attempt-1@x')
+    overdue(app, stale['id'])
+
+    response = client.post('/api/attempts', json={'test_id': stale['test_id']}, headers=headers)
+
+    assert response.status_code == 201
+    assert response.json['attempt']['id'] != stale['id']
+    assert response.json['attempt']['remaining_seconds'] > 0
+    assert status(app, stale['id']) == 'expired'
+
+
+def test_overdue_attempts_cannot_be_saved(app, client, attempt):
+    headers, stale = attempt('attempt-2@x')
+    overdue(app, stale['id'])
+
+    response = client.patch(f"/api/attempts/{stale['id']}", json={'changes': {}}, headers=headers)
+
+    assert response.status_code == 409
+    assert response.json['message'] == 'Attempt expired'
+
+
+@pytest.mark.parametrize('ingest_mode', ['direct', 'spool'])
+def test_overdue_attempts_cannot_be_submitted(app, client, attempt, ingest_mode):
+    app.config['SUBMISSION_INGEST_MODE'] = ingest_mode
+    headers, stale = attempt(f'attempt-3-{ingest_mode}@x')
+    overdue(app, stale['id'])
+
+    response = client.post('/api/results/submit', json={'attempt_id': stale['id']},
+                           headers={**headers, 'Idempotency-Key': 'late'})
+
+    assert response.status_code == 409
+    assert response.json['message'] == 'Attempt expired'
+    assert status(app, stale['id']) == 'expired'
+
+
+def test_attempts_within_the_grace_period_can_still_be_submitted(app, client, attempt):
+    headers, late = attempt('attempt-4@x')
+    with app.app_context():
+        row = db.session.get(models.AttemptSession, late['id'])
+        row.expires_at = datetime.utcnow() - timedelta(seconds=30)
+        db.session.commit()
+
+    response = client.post('/api/results/submit', json={'attempt_id': late['id']}, headers=headers)
+
+    assert response.status_code == 201
+
+
+def test_spooled_attempt_resubmits_return_one_receipt_and_one_result(app, client, attempt):
+    app.config['SUBMISSION_INGEST_MODE'] = 'spool'
+    headers, started = attempt('attempt-5@x')
+
+    first = client.post('/api/results/submit', json={'attempt_id': started['id']}, headers=headers)
+    retry = client.post('/api/results/submit', json={'attempt_id': started['id']}, headers=headers)
+
+    assert first.status_code == retry.status_code == 202
+    assert retry.json['receipt_id'] == first.json['receipt_id']
+
+    with app.app_context():
+        # Flushed here or by the background flusher, whichever claims the submission first
+        deadline = time.monotonic() + 10
+        while app_module.submission_spool.get(first.json['receipt_id'])['status'] != 'completed':
+            assert time.monotonic() < deadline
+            if not app_module.flush_spool(app_module.submission_spool, app_module.answer_keys):
+                time.sleep(0.05)
+        results = models.TestResult.query.filter_by(test_id=started['test_id']).all()
+        assert len(results) == 1
+        assert db.session.get(models.AttemptSession, started['id']).result_id == results[0].id
+
+    after_flush = client.post('/api/results/submit', json={'attempt_id': started['id']}, headers=headers)
+    assert after_flush.status_code == 200
+    assert after_flush.json['result']['id'] == results[0].id
@@ -0,0 +1,61 @@
+import base64
+import io
+import os
+
+from PIL import Image as PILImage
+
+import app as app_module
+from conftest import question
+
+
+def png(color):
+    out = io.BytesIO()
+    PILImage.new('RGB', (8, 8), color).save(out, 'PNG')
+    return out.getvalue()
+
+
+def stored_files():
+    """Every file under the image store, published or staged"""
+    root = app_module.image_store.root
+    return {os.path.join(directory, name) for directory, _, names in os.walk(root) for name in names}
+
+
+def data_url(data):
+    return 'data:image/png;base64,' + base64.b64encode(data).decode()
+
+
+def test_rejected_tests_leave_no_images_behind(client, teacher):
+    before = stored_files()
+    # The image is valid but the second question is not, so the whole test is rejected
+    response = client.post('/api/tests', headers=teacher, json={
+        'name': 'rejected', 'questions': [question(image=data_url(png('green'))), question(correct='E')]
+    })
+
+    assert response.status_code == 422
+    assert stored_files() == before
+
+
+def test_rejected_imports_leave_no_images_behind(client, teacher):
+    before = stored_files()
+    response = client.post('/api/tests/import', headers=teacher, content_type='multipart/form-data', data={
+        'test': '{"name": "rejected import"}',
+        'questions': (io.BytesIO(b'text,optionA,optionB,optionC,optionD,correct,image\n'
+                                 b'q,a,b,c,d,A,diagram.png\nq,a,b,c,d,,\n'), 'questions.csv'),
+        'images': (io.BytesIO(png('purple')), 'diagram.png'),
+    })
+
+    assert response.status_code == 422
+    assert stored_files() == before
+
+
+def test_saved_tests_publish_their_images(client, teacher):
+    image = png('orange')
+    response = client.post('/api/tests', headers=teacher, json={
+        'name': 'saved', 'questions': [question(image=data_url(image))]
+    })
+
+    assert response.status_code == 201
+    test = client.get(f"/api/tests/{response.json['test']['id']}").json
+    image_hash = test['questions'][0]['image'].rsplit('/', 1)[-1]
+    assert app_module.image_store.exists(image_hash)
+    assert client.get(test['questions'][0]['image']).data == image
@@ -0,0 +1,39 @@
+import base64
+import io
+
+from PIL import ExifTags, Image as PILImage
+
+import app as app_module
+from conftest import question
+
+
+def photo_with_location():
+    exif = PILImage.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    exif[ExifTags.Base.Make] = 'PhoneMaker'
+    exif.get_ifd(ExifTags.IFD.GPSInfo)[ExifTags.GPS.GPSLatitude] = (51.0, 30.0, 12.0)
+    out = io.BytesIO()
+    PILImage.new('RGB', (40, 20), 'red').save(out, 'JPEG', exif=exif)
+    return out.getvalue()
+
+
+def test_uploaded_originals_are_stored_without_metadata(client, teacher):
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(photo_with_location()).decode()
+    response = client.post('/api/tests', headers=teacher, json={
+        'name': 'photos', 'passing_marks': 40, 'questions': [question(image=data_url)]
+    })
+    assert response.status_code == 201
+    test = client.get(f"/api/tests/{response.json['test']['id']}").json
+
+    served = client.get(test['questions'][0]['image']).data
+    assert b'PhoneMaker' not in served
+    with PILImage.open(io.BytesIO(served)) as image:
+        assert not image.getexif()
+        # The orientation was applied before the tag was dropped
+        assert image.size == (20, 40)
+
+
+def test_images_without_metadata_are_stored_as_uploaded():
+    out = io.BytesIO()
+    PILImage.new('RGB', (8, 8), 'blue').save(out, 'PNG')
+    assert app_module.strip_metadata(out.getvalue()) == out.getvalue()
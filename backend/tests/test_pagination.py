@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import pytest
+
+import models
+from models import db
+
+
+def pages(client, url, headers, limit, cursor=None):
+    """Every entry of a keyset-paged listing from `cursor` on, following next_cursor to the end"""
+    entries = []
+    while True:
+        query = {'limit': limit, 'cursor': cursor} if cursor else {'limit': limit}
+        response = client.get(url, headers=headers, query_string=query)
+        assert response.status_code == 200
+        key = 'results' if 'results' in response.json else 'entries'
+        entries += response.json[key]
+        cursor = response.json['next_cursor']
+        if cursor is None:
+            return entries
+
+
+@pytest.fixture
+def scored_test(app, make_test, login_student, submit):
+    """A test with results of five students, three of them submitted at the same instant"""
+    test = make_test(4)
+    for i, answers in enumerate([{0: 'A'}, {0: 'A', 1: 'B'}, {}, {0: 'A'}, {0: 'B'}]):
+        headers, _ = login_student(f'page-{i}@x')
+        submit(test, headers, answers)
+    tied = datetime(2026, 1, 1, 9, 0, 0)
+    with app.app_context():
+        for result in models.TestResult.query.filter_by(test_id=test['id']).order_by(models.TestResult.id).limit(3):
+            result.submitted_at = tied
+        db.session.commit()
+    return test
+
+
+def test_result_pages_cover_every_result_once_in_order(client, teacher, scored_test):
+    url = f"/api/tests/{scored_test['id']}/results"
+    everything = client.get(url, headers=teacher).json
+
+    paged = pages(client, url, teacher, limit=2)
+
+    assert [row['id'] for row in paged] == [row['id'] for row in everything]
+    assert len(paged) == 5
+
+
+def test_result_pages_are_stable_while_results_arrive(client, teacher, login_student, submit, scored_test):
+    url = f"/api/tests/{scored_test['id']}/results"
+    first = client.get(url, headers=teacher, query_string={'limit': 2}).json
+    headers, _ = login_student('page-late@x')
+    submit(scored_test, headers, {0: 'A'})
+
+    rest = pages(client, url, teacher, limit=2, cursor=first['next_cursor'])
+
+    ids = [row['id'] for row in first['results'] + rest]
+    assert len(ids) == len(set(ids)) == 6
+
+
+def test_leaderboard_pages_follow_rank_order(client, teacher, scored_test):
+    entries = pages(client, f"/api/tests/{scored_test['id']}/leaderboard", teacher, limit=2)
+
+    marks = [entry['marks_obtained'] for entry in entries]
+    assert marks == sorted(marks, reverse=True)
+    assert len({entry['result_id'] for entry in entries}) == 5
+
+
+def test_foreign_cursors_are_rejected(client, teacher, scored_test):
+    response = client.get(f"/api/tests/{scored_test['id']}/results", headers=teacher,
+                          query_string={'cursor': 'not-a-cursor'})
+    assert response.status_code == 400
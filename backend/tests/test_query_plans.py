@@ -0,0 +1,18 @@
+import pytest
+
+from models import db
+from query_plans import HOT_QUERIES, check_query_plans
+
+
+@pytest.fixture(scope='module')
+def plans():
+    """Plans of the hot queries on the app's SQLite schema, built by create_all and the migrations"""
+    import app as app_module
+    with app_module.app.app_context():
+        return {hot_query.name: (details, problems) for hot_query, details, problems in check_query_plans(db.engine)}
+
+
+@pytest.mark.parametrize('name', [hot_query.name for hot_query in HOT_QUERIES])
+def test_hot_queries_use_their_indexes(plans, name):
+    details, problems = plans[name]
+    assert not problems, '\n'.join(details)
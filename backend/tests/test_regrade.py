@@ -0,0 +1,77 @@
+import pytest
+
+import app as app_module
+import regrade
+import models
+from models import db, Question
+
+pytestmark = pytest.mark.usefixtures('context')
+
+
+def change_answer(question_id, correct):
+    question = db.session.get(Question, question_id)
+    question.correct_answer = correct
+    question.test.bump_version()
+    db.session.commit()
+
+
+def marks(result_id):
+    db.session.expire_all()
+    return db.session.get(models.TestResult, result_id).marks_obtained
+
+
+def edit_during_regrade(monkeypatch, edit):
+    """Run `edit` after the regrade has read its first chunk"""
+    answer_matrix = regrade.answer_matrix
+
+    def edited(key, rows):
+        matrix = answer_matrix(key, rows)
+        edit()
+        return matrix
+    monkeypatch.setattr(regrade, 'answer_matrix', edited)
+
+
+def test_regrade_rescores_changed_answers(make_test, login_student, submit):
+    test = make_test(4)
+    headers, _ = login_student('regrade-1@x')
+    result_id = submit(test, headers, {0: 'B', 1: 'B'}).json['result']['id']
+    assert marks(result_id) == 3
+
+    change_answer(test['questions'][0]['id'], 'B')
+    outcome = regrade.regrade_test(None, app_module.answer_keys.get(test['id']))
+
+    assert outcome == {'test_id': test['id'], 'regraded': 1, 'changed': 1, 'superseded': False}
+    assert marks(result_id) == 8
+
+
+def test_regrade_survives_edits_that_keep_the_answers(monkeypatch, client, teacher, make_test, login_student,
+                                                      submit):
+    test = make_test(4)
+    headers, _ = login_student('regrade-2@x')
+    result_id = submit(test, headers, {0: 'B', 1: 'B'}).json['result']['id']
+    change_answer(test['questions'][0]['id'], 'B')
+    key = app_module.answer_keys.get(test['id'])
+
+    # A rename bumps the version while the regrade runs but leaves the key as it was
+    edit_during_regrade(monkeypatch, lambda: client.put(f"/api/tests/{test['id']}", json={'name': 'renamed'},
+                                                        headers=teacher))
+    outcome = regrade.regrade_test(None, key)
+
+    assert db.session.get(models.Test, test['id']).version != key.version
+    assert outcome['superseded'] is False
+    assert outcome['changed'] == 1
+    assert marks(result_id) == 8
+
+
+def test_regrade_stops_when_answers_change_again(monkeypatch, make_test, login_student, submit):
+    test = make_test(4)
+    headers, _ = login_student('regrade-3@x')
+    result_id = submit(test, headers, {0: 'B', 1: 'B'}).json['result']['id']
+    change_answer(test['questions'][0]['id'], 'B')
+    key = app_module.answer_keys.get(test['id'])
+
+    edit_during_regrade(monkeypatch, lambda: change_answer(test['questions'][1]['id'], 'C'))
+    outcome = regrade.regrade_test(None, key)
+
+    assert outcome['superseded'] is True
+    assert marks(result_id) == 3
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+import models
+from models import db
+
+
+@pytest.fixture
+def lagging_replica(app, monkeypatch, tmp_path):
+    """Returns a function that snapshots the primary into a replica that then stops replicating"""
+    path = tmp_path / 'replica.db'
+    engine = create_engine(f'sqlite:///{path}')
+
+    def snapshot():
+        with app.app_context():
+            primary = sqlite3.connect(db.engine.url.database)
+            replica = sqlite3.connect(path)
+            primary.backup(replica)
+            replica.close()
+            primary.close()
+        monkeypatch.setattr(app.extensions['db_router'], 'engines', {'replica_0': engine})
+
+    yield snapshot
+    engine.dispose()
+
+
+def test_summaries_missing_on_a_replica_are_built_from_the_primary(app, client, lagging_replica, login_student,
+                                                                    make_test, submit):
+    test = make_test(4)
+    lagging_replica()
+    # The student signs up and submits after the replica's snapshot
+    headers, student_id = login_student('replica-1@x')
+    submit(test, headers, {0: 'A'})
+    submit(test, headers, {0: 'B'})
+    with app.app_context():
+        models.StudentSummary.query.filter_by(student_id=student_id).delete()
+        db.session.commit()
+
+    response = client.get(f'/api/students/{student_id}/summary', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json['attempts'] == 2
+    with app.app_context():
+        assert db.session.get(models.StudentSummary, student_id).attempts == 2
+
+
+def test_statistics_missing_on_a_replica_are_rebuilt_from_the_primary(app, client, teacher, lagging_replica,
+                                                                      login_student, make_test, submit):
+    test = make_test(4)
+    headers, _ = login_student('replica-2@x')
+    submit(test, headers, {0: 'A'})
+    with app.app_context():
+        # A test from before item statistics existed
+        for model in (models.QuestionStats, models.TestStats, models.ScoreBucket):
+            model.query.filter_by(test_id=test['id']).delete()
+        db.session.commit()
+    lagging_replica()
+    submit(test, headers, {0: 'B'})
+
+    response = client.get(f"/api/tests/{test['id']}/analytics", headers=teacher)
+
+    assert response.status_code == 200
+    assert response.json['attempts'] == 2
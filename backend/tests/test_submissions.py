@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.fixture
+def spool_mode(app):
+    app.config['SUBMISSION_INGEST_MODE'] = 'spool'
+
+
+def test_retries_with_an_idempotency_key_return_the_first_receipt(spool_mode, make_test, login_student, submit):
+    test = make_test(4)
+    headers, _ = login_student('spool-1@x')
+    retry = {**headers, 'Idempotency-Key': 'k-1'}
+
+    first = submit(test, retry, {0: 'A'})
+    second = submit(test, retry, {0: 'B'})
+
+    assert first.status_code == second.status_code == 202
+    assert second.json['receipt_id'] == first.json['receipt_id']
+
+
+def test_an_idempotency_key_reused_on_another_test_is_a_new_submission(spool_mode, make_test, login_student,
+                                                                         submit):
+    first_test, second_test = make_test(4), make_test(4)
+    headers, _ = login_student('spool-2@x')
+    reused = {**headers, 'Idempotency-Key': 'k-1'}
+
+    first = submit(first_test, reused, {0: 'A'})
+    second = submit(second_test, reused, {0: 'A'})
+
+    assert second.json['receipt_id'] != first.json['receipt_id']
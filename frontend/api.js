@@ -1,5 +1,8 @@
 // API Configuration
 const API_BASE_URL = 'https://nano-test-platform1.onrender.com/api';
+// A busy server answers 503 with Retry-After; requests are retried this many times
+const MAX_BUSY_RETRIES = 4;
+const MAX_RETRY_DELAY_MS = 30000;
 
 class NanoAPI {
     constructor() {
@@ -19,11 +22,11 @@ class NanoAPI {
         };
     }
 
-    async request(endpoint, method = 'GET', data = null) {
+    async request(endpoint, method = 'GET', data = null, extraHeaders = {}) {
         const url = `${API_BASE_URL}${endpoint}`;
         const options = {
             method,
-            headers: this.getAuthHeader(),
+            headers: { ...this.getAuthHeader(), ...extraHeaders },
         };
 
         if (data) {
@@ -36,8 +39,20 @@ class NanoAPI {
                 body: data
             });
             
-            const response = await fetch(url, options);
+            let response = await fetch(url, options);
             console.log(`🟢 API Response: ${method} ${endpoint} - Status: ${response.status}`);
+
+            // Shed by admission control before any work was done, so every method is safe to retry
+            for (let attempt = 0; attempt < MAX_BUSY_RETRIES && response.status === 503; attempt++) {
+                const delay = this.retryDelay(response, attempt);
+                if (delay === null) {
+                    break;
+                }
+                console.warn(`🟡 Server busy: retrying ${method} ${endpoint} in ${Math.round(delay)}ms`);
+                await new Promise(resolve => setTimeout(resolve, delay));
+                response = await fetch(url, options);
+                console.log(`🟢 API Response: ${method} ${endpoint} - Status: ${response.status}`);
+            }
             
             if (!response.ok) {
                 let errorMessage = `HTTP ${response.status}`;
@@ -67,6 +82,17 @@ class NanoAPI {
         }
     }
 
+    retryDelay(response, attempt) {
+        // Milliseconds to wait before retrying a 503, or null if the server sent no Retry-After
+        const retryAfter = parseFloat(response.headers.get('Retry-After'));
+        if (!(retryAfter >= 0)) {
+            return null;
+        }
+        // Back off exponentially from Retry-After, spread over 50-150% so clients do not return in step
+        const base = Math.min(retryAfter * 1000 * Math.pow(2, attempt), MAX_RETRY_DELAY_MS);
+        return base * (0.5 + Math.random());
+    }
+
     // ==================== Authentication ====================
 
     async teacherLogin(teacherId, password) {
@@ -119,6 +145,10 @@ class NanoAPI {
         return this.request(`/tests/${testId}`, 'PUT', testData);
     }
 
+    async updateAnswerKey(testId, answers) {
+        return this.request(`/tests/${testId}/answer-key`, 'PUT', { answers: answers });
+    }
+
     async deleteTest(testId) {
         return this.request(`/tests/${testId}`, 'DELETE');
     }
@@ -126,7 +156,7 @@ class NanoAPI {
     // ==================== Results ====================
 
     async submitTest(testId, answers, markedForReview, questionStatus = {}) {
-        return this.request('/results/submit', 'POST', {
+        return this.sendSubmission(testId, {
             test_id: testId,
             answers: answers,
             marked_for_review: markedForReview,
@@ -134,6 +164,56 @@ class NanoAPI {
         });
     }
 
+    async submitAttempt(testId, attemptId, changes = {}) {
+        // The server already holds the autosaved answers; only unsaved changes are sent
+        return this.sendSubmission(testId, { attempt_id: attemptId, changes: changes });
+    }
+
+    async sendSubmission(testId, payload) {
+        // Reuse the same idempotency key when a failed submission is retried
+        const keyName = `submitKey:${testId}`;
+        let idempotencyKey = sessionStorage.getItem(keyName);
+        if (!idempotencyKey) {
+            idempotencyKey = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+            sessionStorage.setItem(keyName, idempotencyKey);
+        }
+
+        let response = await this.request('/results/submit', 'POST', payload, { 'Idempotency-Key': idempotencyKey });
+
+        // Spooled submissions are acknowledged with a receipt; wait until the result is scored
+        if (response.receipt_id) {
+            response = await this.waitForSubmission(response);
+        }
+
+        sessionStorage.removeItem(keyName);
+        return response;
+    }
+
+    async waitForSubmission(submission) {
+        let delay = 500;
+        while (submission.status === 'pending' || submission.status === 'flushing') {
+            await new Promise(resolve => setTimeout(resolve, delay));
+            delay = Math.min(delay * 2, 4000);
+            submission = await this.request(`/submissions/${submission.receipt_id}`, 'GET');
+        }
+        if (submission.status === 'failed') {
+            throw new Error(submission.error || 'Submission failed');
+        }
+        return submission;
+    }
+
+    // ==================== Attempts ====================
+
+    async startAttempt(testId) {
+        // Resumes the attempt in progress if there is one
+        const response = await this.request('/attempts', 'POST', { test_id: testId });
+        return response.attempt;
+    }
+
+    async saveAttempt(attemptId, changes) {
+        return this.request(`/attempts/${attemptId}`, 'PATCH', { changes: changes });
+    }
+
     async getResult(resultId) {
         return this.request(`/results/${resultId}`, 'GET');
     }
@@ -143,6 +223,19 @@ class NanoAPI {
         return this.request('/results', 'GET');
     }
 
+    async getResultsPage(limit = 20, cursor = null) {
+        // One page of the current student's results: {results, next_cursor}
+        const params = new URLSearchParams({ limit: limit });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        return this.request(`/results?${params}`, 'GET');
+    }
+
+    async getStudentSummary(studentId) {
+        return this.request(`/students/${studentId}/summary`, 'GET');
+    }
+
     async getStudentResults(studentId) {
         // For backward compatibility - now calls /results
         return this.request('/results', 'GET');
@@ -152,6 +245,14 @@ class NanoAPI {
         return this.request(`/tests/${testId}/results`, 'GET');
     }
 
+    async getLeaderboard(testId, limit = 10, cursor = null) {
+        const params = new URLSearchParams({ limit: limit });
+        if (cursor) {
+            params.set('cursor', cursor);
+        }
+        return this.request(`/tests/${testId}/leaderboard?${params}`, 'GET');
+    }
+
     // ==================== Health ====================
 
     async healthCheck() {
@@ -161,3 +262,8 @@ class NanoAPI {
 
 // Create global API instance
 const api = new NanoAPI();
+
+// srcset attribute listing a question image's downscaled variants, so browsers fetch only the width they show
+function imageSrcset(question) {
+    return (question.image_srcset || []).map(variant => `${variant.url} ${variant.width}w`).join(', ');
+}